@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark do pd.BOT sem conexão com o Discord.
+
+Gera um banco sintético num diretório temporário, importa o bot apontando para ele e chama os
+callbacks reais dos comandos com objetos falsos de ctx/autor/canal (o `send` não faz nada).
+O resultado é um JSON com vazão, latência (p50/p99) por comando, tempo gasto em `save_data` e
+nos flushes, e o atraso do event loop, para comparar números entre versões.
+
+Com `--shards N` (só no backend sqlite) a carga é dividida entre N processos sobre o mesmo
+banco, como o bot rodando com `run --shards N --processes N`: cada processo atende os canais
+do seu shard e todos alteram os mesmos perfis. Ao final o saldo total do banco é conferido
+contra a soma dos `pd.add_money` feitos por todos os processos.
+
+Exemplos:
+    python benchmark.py --profiles 10000
+    python benchmark.py --profiles 1000000 --backend sqlite --ops 50000 --output bench_output.txt
+    python benchmark.py --profiles 1000 --backend sqlite --shards 4 --only add_money hp_damage
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ITEMS = ["Flecha", "Corda", "Poção", "Tocha", "Ração", "Adaga", "Escudo", "Pergaminho", "Moeda antiga", "Lanterna"]
+ATTRIBUTES = ["for", "des", "con", "int", "sab", "car"]
+ROLLS = ["1d20+3", "2d6+1d4+2", "4d6kh3", "3#1d20+5", "d20adv", "8d6!", "20#100d6", "50#1000d6"]
+STATS = ["3d6+2 >= 15", "4d6kh3", "2d20kh1+5 >= 18", "10d10"]
+INITIATIVE_ROLLS = ["1d20+2", "1d20!+2"]
+
+# Comando -> peso no sorteio da carga. Leituras dominam, como num canal de jogo real.
+DEFAULT_MIX = {
+    "hp": 15, "hp_damage": 10, "gear": 12, "gear_add": 8, "gear_multi": 2, "gear_find": 2, "attribute": 8, "attribute_push": 3,
+    "money": 6, "add_money": 6, "batch": 2, "rank": 2, "leaderboard": 1,
+    "roll": 20, "sroll": 4, "roll_stats": 2, "macro": 6, "init": 4, "init_list": 2,
+}
+
+# --- Objetos falsos do Discord ---
+
+class FakeMessage:
+    mentions = []
+
+    async def delete(self):
+        pass
+
+class FakeMessageable:
+    sent = 0
+
+    def __init__(self, id):
+        self.id = id
+
+    async def send(self, content=None, **kwargs):
+        FakeMessageable.sent += 1
+
+class FakeUser(FakeMessageable):
+    def __init__(self, id):
+        super().__init__(id)
+        self.name = self.display_name = f"Jogador {id % 100000}"
+        self.mention = f"<@{id}>"
+
+class FakeContext:
+    def __init__(self, author, channel):
+        self.author = author
+        self.channel = channel
+        self.message = FakeMessage()
+        self.guild = None
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+# --- Banco sintético ---
+
+def synthetic_profile(rng, user_id):
+    profile = {
+        "name": f"Jogador {user_id % 100000}",
+        "money": rng.randint(0, 10_000),
+        "inventory": {item: rng.randint(1, 50) for item in rng.sample(ITEMS, rng.randint(0, 6))},
+        "hp_atual": rng.randint(1, 40),
+        "hp_max": 40,
+        "attributes": {name: rng.randint(-2, 5) for name in rng.sample(ATTRIBUTES, rng.randint(0, 6))},
+    }
+    # A macro "ataque" usa a FOR quando o jogador tem esse atributo (e o pd.attribute_push da carga a invalida).
+    profile["macros"] = {"ataque": "1d20+for+2" if "for" in profile["attributes"] else "1d20+2"}
+    return profile
+
+def synthetic_user_ids(profiles):
+    return [10**17 + index for index in range(profiles)]
+
+def write_synthetic_database(pdbot, profiles, seed):
+    """Grava `profiles` perfis em database.json (no diretório atual) e retorna os IDs gerados."""
+    rng = random.Random(seed)
+    user_ids = synthetic_user_ids(profiles)
+    with open(pdbot.USER_DATA_FILE, "w", encoding="utf-8") as f:
+        # Escrito em streaming para que 1M de perfis não precise existir inteiro na memória duas vezes.
+        f.write("{")
+        for index, user_id in enumerate(user_ids):
+            if index:
+                f.write(",")
+            f.write(f'"{user_id}":')
+            json.dump(synthetic_profile(rng, user_id), f, ensure_ascii=False)
+        f.write("}")
+    return user_ids
+
+# --- Medições ---
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(samples, elapsed=None):
+    ordered = sorted(samples)
+    summary = {
+        "count": len(ordered),
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": (ordered[-1] if ordered else 0.0) * 1000,
+    }
+    if elapsed:
+        summary["throughput_per_s"] = len(ordered) / elapsed
+    return summary
+
+class Timer:
+    """Envolve uma função (síncrona ou não) e acumula quantas vezes foi chamada e o tempo gasto."""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.calls += 1
+                self.seconds += time.perf_counter() - start
+        return timed
+
+    def wrap_async(self, function):
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.calls += 1
+                self.seconds += time.perf_counter() - start
+        return timed
+
+    def report(self):
+        return {"calls": self.calls, "seconds": self.seconds}
+
+async def monitor_loop_lag(samples, interval=0.01):
+    """Mede quanto cada `sleep(interval)` atrasa além do pedido: é o tempo que o loop ficou ocupado."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+# --- Carga ---
+
+def build_commands(pdbot, rng, ledger):
+    """
+    Cada entrada recebe um ctx e devolve a corrotina do callback real do comando.
+    `ledger` soma o dinheiro que os `pd.add_money` concluídos acrescentaram, para a conferência.
+    """
+    async def add_money(ctx):
+        amount = rng.randint(1, 100)
+        await pdbot.add_money.callback(ctx, amount)
+        ledger["money_added"] += amount
+
+    async def batch(ctx):
+        amount = rng.randint(1, 100)
+        await pdbot.batch_command.callback(ctx, args=f"hp {rng.randint(-5, 5)}\ngear +1 {rng.choice(ITEMS)}\nadd_money {amount}")
+        ledger["money_added"] += amount
+
+    return {
+        "hp": lambda ctx: pdbot.hp_command.callback(ctx),
+        "hp_damage": lambda ctx: pdbot.hp_command.callback(ctx, args=str(rng.randint(-5, 5))),
+        "gear": lambda ctx: pdbot.gear.callback(ctx),
+        "gear_add": lambda ctx: pdbot.gear.callback(ctx, args=f"+{rng.randint(1, 3)} {rng.choice(ITEMS)}"),
+        "gear_multi": lambda ctx: pdbot.gear.callback(ctx, args=", ".join(f"+{rng.randint(1, 3)} {item}" for item in rng.sample(ITEMS, 3))),
+        "gear_find": lambda ctx: pdbot.gear_find.callback(ctx, item=rng.choice(ITEMS).lower()),
+        "attribute": lambda ctx: pdbot.attribute_list.callback(ctx),
+        "attribute_push": lambda ctx: pdbot.attribute_push.callback(ctx, args=f"{rng.choice(ATTRIBUTES)}={rng.randint(-2, 5)}"),
+        "money": lambda ctx: pdbot.money.callback(ctx),
+        "add_money": add_money,
+        "batch": batch,
+        "rank": lambda ctx: pdbot.rank.callback(ctx),
+        "leaderboard": lambda ctx: pdbot.leaderboard.callback(ctx, rng.randint(1, 5)),
+        "roll": lambda ctx: pdbot.public_roll.callback(ctx, entrada=rng.choice(ROLLS)),
+        "sroll": lambda ctx: pdbot.secret_roll.callback(ctx, entrada=rng.choice(ROLLS)),
+        "roll_stats": lambda ctx: pdbot.roll_stats.callback(ctx, entrada=rng.choice(STATS)),
+        "macro": lambda ctx: pdbot.macro_roll.callback(ctx, "ataque"),
+        "init": lambda ctx: pdbot.initiative_roll.callback(ctx, roll_input=rng.choice(INITIATIVE_ROLLS)),
+        "init_list": lambda ctx: pdbot.initiative_list.callback(ctx),
+    }
+
+def shard_of(channel_id, shards):
+    """
+    Shard que receberia o canal, pela regra do Discord `(guild_id >> 22) % shards`. Os canais
+    falsos não têm servidor, então o próprio ID do canal faz o papel do ID do servidor.
+    """
+    return (channel_id >> 22) % shards
+
+async def run_workload(pdbot, user_ids, args):
+    shard_index = args.shard_index or 0
+    rng = random.Random(args.seed + 1 + shard_index)
+    ledger = {"money_added": 0}
+    commands = build_commands(pdbot, rng, ledger)
+    mix = {name: weight for name, weight in DEFAULT_MIX.items() if not args.only or name in args.only}
+    names, weights = list(mix), list(mix.values())
+    channel_ids = [(900_000 + index) << 22 for index in range(args.channels)]
+    channels = [FakeMessageable(channel_id) for channel_id in channel_ids
+                if shard_of(channel_id, args.shards) == shard_index]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    remaining = args.ops
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, weights)[0]
+            ctx = FakeContext(FakeUser(rng.choice(user_ids)), rng.choice(channels))
+            start = time.perf_counter()
+            try:
+                await commands[name](ctx)
+            except Exception:
+                errors[name] += 1
+            latencies[name].append(time.perf_counter() - start)
+
+    lag = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+
+    commands_report = {}
+    for name in names:
+        if latencies[name]:
+            commands_report[name] = {**summarize(latencies[name], elapsed), "errors": errors[name]}
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "elapsed_s": elapsed,
+        "total": {**summarize(all_latencies, elapsed), "errors": sum(errors.values())},
+        "commands": commands_report,
+        "event_loop_lag_ms": {key: value for key, value in summarize(lag).items() if key != "count"},
+        "ledger": ledger,
+    }
+
+async def run_benchmark(pdbot, user_ids, args, flush_timer):
+    # Sem o limite de envio: o benchmark mede o bot, não a espera educada pelo Discord.
+    pdbot.outbox = pdbot.Outbox(rate=1e9, burst=1e9)
+    for store in (pdbot.user_store, pdbot.initiative_store):
+        store.flush = flush_timer.wrap_async(store.flush)
+    report = await run_workload(pdbot, user_ids, args)
+    start = time.perf_counter()
+    await pdbot.outbox.close()
+    await pdbot.close_storage(pdbot.user_store, pdbot.initiative_store)
+    report["shutdown_flush_s"] = time.perf_counter() - start
+    return report
+
+def total_money(pdbot):
+    conn = pdbot.sqlite3.connect(pdbot.SQLITE_FILE)
+    try:
+        return conn.execute("SELECT COALESCE(SUM(money), 0) FROM profiles").fetchone()[0]
+    finally:
+        conn.close()
+
+def run_single(pdbot, user_ids, args, setup):
+    """Roda a carga neste processo. Também é o que cada processo filho faz no modo `--shards`."""
+    # Mede o "cold start": abrir o backend com o banco já no disco.
+    save_timer, flush_timer = Timer(), Timer()
+    pdbot.save_data = save_timer.wrap(pdbot.save_data)
+    start = time.perf_counter()
+    pdbot.user_store, pdbot.initiative_store = pdbot.open_storage(args.backend)
+    setup["open_storage_s"] = time.perf_counter() - start
+
+    pdbot.worker_pool.start(args.workers)
+    # Como em run_bot(): índice de inventário e ranking montados antes da carga começar.
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        pdbot.build_indexes()
+    setup["build_indexes_s"] = time.perf_counter() - start
+    report = asyncio.run(run_benchmark(pdbot, user_ids, args, flush_timer))
+    pdbot.worker_pool.shutdown()
+    return {
+        "setup": setup,
+        **report,
+        "persistence": {"save_data": save_timer.report(), "flush": flush_timer.report()},
+        "messages_sent": FakeMessageable.sent,
+    }
+
+def run_shards(pdbot, args, setup):
+    """
+    Divide as operações entre `args.shards` processos filhos sobre o mesmo banco SQLite e confere
+    que nenhuma alteração de saldo se perdeu entre eles.
+    """
+    initial_money = total_money(pdbot)
+    child_args = [sys.executable, os.path.abspath(__file__), "--workdir", os.getcwd(), "--reuse-database",
+                  "--profiles", str(args.profiles), "--backend", args.backend, "--concurrency", str(args.concurrency),
+                  "--channels", str(args.channels), "--workers", str(args.workers), "--seed", str(args.seed),
+                  "--shards", str(args.shards)]
+    if args.only:
+        child_args += ["--only", *args.only]
+    start = time.perf_counter()
+    children = []
+    for index in range(args.shards):
+        ops = args.ops // args.shards + (index < args.ops % args.shards)
+        children.append(subprocess.Popen(child_args + ["--ops", str(ops), "--shard-index", str(index)],
+                                         stdout=subprocess.PIPE, text=True))
+    shards = [json.loads(child.communicate()[0]) for child in children]
+    elapsed = time.perf_counter() - start
+
+    money_added = sum(shard["ledger"]["money_added"] for shard in shards)
+    final_money = total_money(pdbot)
+    total_ops = sum(shard["total"]["count"] for shard in shards)
+    return {
+        "setup": setup,
+        "elapsed_s": elapsed,
+        "total": {
+            "count": total_ops,
+            "throughput_per_s": total_ops / elapsed,
+            "errors": sum(shard["total"]["errors"] for shard in shards),
+        },
+        "consistency": {
+            "initial_money": initial_money,
+            "money_added": money_added,
+            "final_money": final_money,
+            "lost_updates": initial_money + money_added - final_money,
+            "ok": initial_money + money_added == final_money,
+        },
+        "shards": shards,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do pd.BOT com um banco sintético.")
+    parser.add_argument("--profiles", type=int, default=10_000, help="perfis no banco sintético (padrão: 10000)")
+    parser.add_argument("--backend", default="json", choices=["json", "sharded", "sqlite"])
+    parser.add_argument("--ops", type=int, default=20_000, help="comandos executados (padrão: 20000)")
+    parser.add_argument("--concurrency", type=int, default=32, help="comandos em andamento ao mesmo tempo")
+    parser.add_argument("--channels", type=int, default=200, help="canais distintos usados pela carga")
+    parser.add_argument("--only", nargs="*", choices=sorted(DEFAULT_MIX), help="roda só estes comandos")
+    parser.add_argument("--workers", type=int, default=0, help="processos para rolagens pesadas (padrão: 0, usa threads)")
+    parser.add_argument("--snapshot", default="json", choices=["json", "binary"],
+                        help="formato do database.json/initiative.json no backend json (padrão: json)")
+    parser.add_argument("--shards", type=int, default=1, help="processos do bot sobre o mesmo banco (exige sqlite)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--workdir", help="diretório do banco sintético (padrão: um temporário)")
+    parser.add_argument("--output", help="grava o JSON neste arquivo em vez de imprimir")
+    # Usados pelos processos filhos do modo --shards.
+    parser.add_argument("--shard-index", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--reuse-database", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.shards > 1 and args.backend != "sqlite":
+        parser.error("--shards exige --backend sqlite")
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pdbot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import pdbot
+    pdbot.config["snapshot_format"] = args.snapshot
+    random.seed(args.seed + (args.shard_index or 0))
+    setup = {}
+    if args.reuse_database:
+        user_ids = synthetic_user_ids(args.profiles)
+    else:
+        start = time.perf_counter()
+        user_ids = write_synthetic_database(pdbot, args.profiles, args.seed)
+        setup["generate_s"] = time.perf_counter() - start
+        setup["database_bytes"] = os.path.getsize(pdbot.USER_DATA_FILE)
+        if args.snapshot == "binary":
+            start = time.perf_counter()
+            pdbot.convert_data(pdbot.USER_DATA_FILE, binary=True)
+            setup["convert_s"] = time.perf_counter() - start
+        setup["snapshot_bytes"] = os.path.getsize(pdbot.USER_DATA_FILE)
+        if args.backend != "json":
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(sys.stderr):
+                pdbot.migrate_json(args.backend)
+            setup["migrate_s"] = time.perf_counter() - start
+
+    if args.shards > 1 and args.shard_index is None:
+        report = run_shards(pdbot, args, setup)
+    else:
+        report = run_single(pdbot, user_ids, args, setup)
+    result = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": pdbot.np.__version__ if pdbot.np is not None else None,
+        },
+        **report,
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,40 @@ import random
 import json
 import os
 import asyncio
+import sqlite3
+import contextlib
+import argparse
+import collections
+import functools
+import itertools
+import math
+import bisect
+import time
+import unicodedata
+import io
+import struct
+import zlib
+import threading
+import sys
+import multiprocessing
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import numpy as np
+except ImportError:  # O NumPy é opcional: sem ele, as rolagens em lote usam o módulo random.
+    np = None
+
+try:
+    import msgpack
+except ImportError:  # Opcional: sem ele, os registros do snapshot binário são JSON compacto.
+    msgpack = None
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:  # Opcional: sem ele, o ranking usa uma lista ordenada com bisect.
+    SortedList = None
 
 # ========================================================================================
 #                               CONFIGURAÇÃO INICIAL DO BOT
@@ -18,62 +52,2839 @@ import asyncio
 # --- Constantes de Arquivos ---
 USER_DATA_FILE = "database.json"
 INITIATIVE_FILE = "initiative.json"
+SQLITE_FILE = "pdbot.db"
+PROFILES_DIR = "profiles"
+CONFIG_FILE = "config.json"
+
+# --- Constantes de Persistência ---
+# Tempo (em segundos) que o bot espera antes de gravar, agrupando rajadas de alterações numa só escrita
+SAVE_DELAY = 2.0
+# Tamanho (em bytes) a partir do qual o diário de alterações é consolidado num novo snapshot
+JOURNAL_COMPACT_SIZE = 1024 * 1024
+# Backend "sharded": número de pastas em que os perfis são divididos e limite do cache de perfis
+# na memória (configurável com "profile_cache_mb" no config.json)
+PROFILE_BUCKETS = 256
+PROFILE_CACHE_BYTES = 64 * 1024 * 1024
+# Quanto "pesa" no cache a lembrança de que um usuário não está registrado
+MISSING_PROFILE_SIZE = 64
+# Backend "sqlite": quanto uma escrita espera (em ms) por outro processo que esteja gravando
+SQLITE_BUSY_TIMEOUT_MS = 5000
+# Snapshot binário (config: "snapshot_format": "binary"): cabeçalho e tamanho dos blocos de E/S
+SNAPSHOT_MAGIC = b"PDBS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK = 256 * 1024
+SNAPSHOT_BATCH = 1000  # pares (chave, valor) por registro
+SNAPSHOT_ZLIB_LEVEL = 6
+
+# --- Constantes de Rolagem ---
+MAX_ROLL_COUNT = 50       # repetições (o N de N#XdY)
+MAX_DICE = 1000           # dados por grupo
+MAX_SIDES = 1000          # lados por dado
+MAX_DICE_TERMS = 10       # grupos de dados numa expressão (ex: 2d6+1d4 tem 2)
+MAX_TOTAL_DICE = 100_000  # dados sorteados por comando, somando repetições e grupos
+MAX_EXPLOSIONS = 100      # dados extras que um grupo explosivo pode gerar
+DICE_CACHE_SIZE = 1024    # expressões compiladas mantidas em cache
+MAX_SHOWN_DICE = 40       # acima disso, um grupo é resumido em vez de listar cada dado
+MAX_DETAILED_ROLLS = 10   # acima disso, as repetições viram uma tabela de totais
+
+# --- Constantes de Macros ---
+MAX_MACROS = 25           # macros por jogador
+MAX_MACRO_LENGTH = 100    # caracteres da expressão de uma macro
+MACRO_CACHE_SIZE = 8192   # macros compiladas (já com os atributos do jogador) mantidas em cache
+
+# --- Constantes de Iniciativa ---
+MAX_INITIATIVE_ENTRIES = 200  # participantes numa lista de iniciativa
+MAX_NPCS_PER_COMMAND = 50     # NPCs adicionados de uma vez por pd.init_npc
+INITIATIVE_TTL_HOURS = 72     # listas sem uso há mais que isso são apagadas (config: "initiative_ttl_hours")
+MAX_INITIATIVE_CHANNELS = 10_000  # canais com lista; acima disso sai a menos usada (config: "max_initiative_channels")
+INITIATIVE_SWEEP_INTERVAL = 600   # de quanto em quanto tempo (s) as listas paradas são procuradas
+INITIATIVE_TOUCH_PERSIST = 300    # intervalo mínimo (s) entre gravações do horário de uso de um canal
+
+# --- Constantes de Concorrência ---
+LOCK_STRIPES = 1024       # locks por tipo de chave (usuário/canal); chaves na mesma listra se revezam
+LOCK_HOT_KEYS = 256       # chaves com espera acompanhadas nas métricas de contenção
+MAX_BATCH_OPERATIONS = 25 # alterações num só comando (pd.batch, pd.hp -5 @a @b, pd.gear +1 A, -1 B)
+
+# --- Constantes de Exibição ---
+EMBED_CACHE_SIZE = 4096   # embeds de perfil (pd.attribute, pd.gear, pd.hp) mantidos prontos
+
+# --- Constantes do Índice de Inventário ---
+ITEM_MAX_TYPOS = 2        # letras erradas toleradas ao procurar um item (pd.gear_find)
+ITEM_SUGGESTIONS = 5      # sugestões mostradas quando ninguém tem o item procurado
+GEAR_FIND_MAX_LINES = 20  # portadores listados por pd.gear_find
+INVENTORY_REFRESH_INTERVAL = 30.0  # com vários processos, de quanto em quanto tempo (s) o índice é remontado
+
+# --- Constantes do Ranking ---
+LEADERBOARD_PAGE_SIZE = 10       # jogadores por página do pd.leaderboard
+RANKING_REFRESH_INTERVAL = 30.0  # com vários processos, de quanto em quanto tempo (s) o ranking é remontado
+RANKING_BLOCK_SIZE = 1000        # chaves por bloco do ranking quando o sortedcontainers não está instalado
+
+# --- Constantes de Envio de Mensagens ---
+MESSAGE_LIMIT = 2000      # caracteres por mensagem no Discord
+MAX_MESSAGE_PAGES = 4     # acima disso, o texto vai como arquivo anexo em vez de várias mensagens
+SEND_BURST = 5            # mensagens seguidas que um canal pode receber de uma vez...
+SEND_RATE = 1.0           # ...e quantas por segundo depois disso (o Discord aceita ~5 a cada 5 s)
+MAX_QUEUED_MESSAGES = 50  # mensagens esperando por canal; acima disso, quem envia aguarda a fila andar
+OUTBOX_CLOSE_TIMEOUT = 5.0  # tempo para esvaziar as filas ao desligar o bot
+
+# --- Constantes de Processamento Paralelo ---
+WORKER_PROCESSES = 2            # processos para rolagens pesadas (config: "worker_processes"; 0 desliga)
+OFFLOAD_MIN_DICE = 20_000       # dados estimados a partir dos quais uma rolagem sai do event loop
+STATS_OFFLOAD_OUTCOMES = 5_000  # resultados possíveis a partir dos quais pd.roll_stats sai do event loop
+STATS_OFFLOAD_KEEP_WORK = 50_000  # idem, pelo custo estimado de kh/kl/dh/dl (~5 ms de cálculo)
+OFFLOAD_TIMEOUT = 15.0          # segundos até uma rolagem pesada ser dada como perdida
+MAX_OFFLOADED_PER_USER = 2      # rolagens pesadas simultâneas por usuário
+
+# --- Constantes de Shards ---
+SHARD_STOP_TIMEOUT = 30.0  # segundos que o lançador espera cada processo fechar antes de matá-lo
+
+# --- Constantes de Monitoramento (pd.stats) ---
+# Limites (em segundos) das faixas do histograma de latência dos comandos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5   # a cada quantos segundos o atraso do event loop é medido
+SLOW_COMMAND_MS = 1000    # comandos mais lentos que isso vão para o log (config: "slow_command_ms")
+METRICS_HOST = "127.0.0.1"  # endereço do endpoint Prometheus, ativado com "metrics_port" no config
+
+# --- Constantes de Estatística (pd.roll_stats) ---
+STATS_CACHE_SIZE = 512              # distribuições de dados, grupos e expressões mantidas em cache
+STATS_MAX_OUTCOMES = 200_000        # resultados possíveis de uma expressão (com NumPy)
+STATS_MAX_OUTCOMES_NO_NUMPY = 3_000 # idem, com as convoluções em Python puro
+STATS_MAX_KEEP_WORK = 20_000_000    # custo estimado do cálculo exato de kh/kl/dh/dl
+STATS_EPSILON = 1e-12               # probabilidades menores que isso são desprezadas
+STATS_PERCENTILES = (10, 25, 50, 75, 90)
+FFT_MIN_WORK = 250_000              # a partir desse tamanho (len(a) * len(b)) a convolução usa FFT
 
 # --- Configuração do Bot e Intents ---
+class PDBot(commands.AutoShardedBot):
+    """
+    Bot com desligamento limpo (grava os dados pendentes antes de fechar a conexão) e que
+    inicia as tarefas de monitoramento ao conectar.
+
+    Conecta com vários shards quando o Discord pede. Com `run --shards N --processes P`, cada
+    processo recebe uma faixa de shards; o estado de iniciativa fica com o processo dono do
+    canal e os perfis ficam no SQLite, compartilhado por todos (ver `launch_shard_processes`).
+    """
+
+    async def setup_hook(self):
+        self.loop_monitor = asyncio.create_task(monitor_event_loop())
+        self.initiative_sweeper = asyncio.create_task(sweep_initiative())
+        if config.get("metrics_port"):
+            # Cada processo de shards abre o endpoint numa porta própria: a base mais o primeiro shard.
+            port = int(config["metrics_port"]) + (self.shard_ids[0] if self.shard_ids else 0)
+            await start_metrics_server(config.get("metrics_host", METRICS_HOST), port)
+
+    async def on_command_error(self, ctx, error):
+        # Conta aqui, e não no after_invoke, para incluir erros de conversão e de permissão,
+        # que acontecem antes do comando rodar.
+        metrics.count_error(ctx.command.qualified_name if ctx.command else "desconhecido")
+        await super().on_command_error(ctx, error)
+
+    async def close(self):
+        worker_pool.shutdown()
+        await outbox.close()
+        await close_storage(user_store, initiative_store)
+        await super().close()
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix=commands.when_mentioned_or("pd."), intents=intents)
+bot = PDBot(command_prefix=commands.when_mentioned_or("pd."), intents=intents)
 # Remove o comando de ajuda padrão para podermos criar o nosso
 bot.remove_command('help')
 
+# ========================================================================================
+#                                      MÉTRICAS
+# ========================================================================================
+
+class Histogram:
+    """Histograma de faixas fixas (no formato do Prometheus) com soma e contagem."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # a última faixa é "acima do maior limite"
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Pares (limite, observações <= limite), terminando em (inf, total)."""
+        return list(zip(self.buckets + (math.inf,), itertools.accumulate(self.counts)))
+
+    def quantile(self, q):
+        """Estimativa do quantil q: o limite da primeira faixa que alcança essa fração das observações."""
+        for bound, seen in self.cumulative():
+            if seen >= q * self.count and seen:
+                return bound
+        return 0.0
+
+class Metrics:
+    """
+    Métricas do bot: latência e erros por comando, contadores de E/S (bytes e tempo de
+    `save_data`, do diário e de `load_data`) e o atraso do event loop. Os contadores de E/S podem
+    ser atualizados das threads de gravação, por isso passam por um lock.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.commands = collections.defaultdict(Histogram)
+        self.errors = collections.Counter()
+        self.counters = collections.Counter()
+        self.loop_lag = Histogram()
+        self.loop_lag_max = 0.0
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def count_error(self, command):
+        self.errors[command] += 1
+
+    def observe_command(self, command, elapsed):
+        self.commands[command].observe(elapsed)
+
+    def observe_loop_lag(self, lag):
+        self.loop_lag.observe(lag)
+        self.loop_lag_max = max(self.loop_lag_max, lag)
+
+metrics = Metrics()
+
+async def monitor_event_loop(interval=LOOP_LAG_INTERVAL):
+    """Mede o atraso do event loop: quanto um `sleep(interval)` demora além do pedido."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        metrics.observe_loop_lag(max(0.0, loop.time() - start - interval))
+
 # ========================================================================================
 #                               FUNÇÕES AUXILIARES
 # ========================================================================================
 
 def load_data(file_path):
-    """Carrega dados de um arquivo JSON. Retorna um dicionário vazio se não existir."""
-    if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-        with open(file_path, "r", encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+    """
+    Carrega dados de um arquivo JSON ou de um snapshot binário (o formato é detectado pelo
+    cabeçalho). Retorna um dicionário vazio se não existir.
+    """
+    return dict(iter_data(file_path))
+
+def iter_data(file_path):
+    """Percorre os pares (chave, valor) de um arquivo de dados; o snapshot binário é lido registro a registro."""
+    if not (os.path.exists(file_path) and os.path.getsize(file_path) > 0):
+        return
+    start = time.perf_counter()
+    with open(file_path, "rb") as f:
+        binary = f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+        f.seek(0)
+        if binary:
+            yield from read_snapshot(f)
+        else:
+            yield from json.load(io.TextIOWrapper(f, encoding='utf-8')).items()
+    metrics.count("load_data_calls")
+    metrics.count("load_data_bytes", os.path.getsize(file_path))
+    metrics.count("load_data_seconds", time.perf_counter() - start)
+
+def save_data(data, file_path, binary=False):
+    """
+    Salva dados em um arquivo JSON com formatação, ou no snapshot binário se `binary`.
+    `data` é um dicionário ou um iterador de pares (chave, valor), gravado par a par sem montar
+    o dicionário na memória.
+    A escrita é atômica: grava num arquivo temporário e o renomeia por cima do original,
+    então uma queda no meio da gravação nunca deixa o arquivo pela metade.
+    """
+    start = time.perf_counter()
+    temp_path = f"{file_path}.tmp"
+    f = open(temp_path, "wb") if binary else open(temp_path, "w", encoding='utf-8')
+    with f:
+        if binary:
+            write_snapshot(data.items() if isinstance(data, dict) else data, f)
+        elif isinstance(data, dict):
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        else:
+            write_json_pairs(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+        size = os.fstat(f.fileno()).st_size
+    os.replace(temp_path, file_path)
+    metrics.count("save_data_calls")
+    metrics.count("save_data_bytes", size)
+    metrics.count("save_data_seconds", time.perf_counter() - start)
+
+def write_json_pairs(items, f):
+    """Grava os pares (chave, valor) como o `json.dump(..., indent=4)` de um dicionário, um par por vez."""
+    separator = "\n"
+    f.write("{")
+    for key, value in items:
+        value = json.dumps(value, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+        f.write(f"{separator}    {json.dumps(str(key), ensure_ascii=False)}: {value}")
+        separator = ",\n"
+    f.write("}" if separator == "\n" else "\n}")
+
+# --- Snapshot binário ---
+#
+# Cabeçalho de 8 bytes: SNAPSHOT_MAGIC, versão do formato, codificação dos registros
+# (0 = JSON compacto, 1 = msgpack), compressão (0 = nenhuma, 1 = zlib) e um byte reservado.
+# Depois vem uma sequência de registros, cada um uma lista de até SNAPSHOT_BATCH pares
+# `[chave, valor]` precedida pelo seu tamanho (4 bytes, little-endian), terminada por um registro
+# de tamanho 0; com zlib, tudo o que vem depois do cabeçalho é um único fluxo comprimido. Sem o
+# marcador final o arquivo está cortado. Os pares vão em lotes porque decodificar um registro
+# por perfil custa mais, em chamadas, do que ler o JSON inteiro de uma vez.
+
+class SnapshotError(ValueError):
+    pass
+
+_SNAPSHOT_HEADER = struct.Struct("<4sBBBx")
+_RECORD_SIZE = struct.Struct("<I")
+
+def write_snapshot(items, f, compress=True):
+    """Grava os pares (chave, valor) de `items` no arquivo binário `f`, um registro por vez."""
+    encoding = 1 if msgpack is not None else 0
+    f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, encoding, int(compress)))
+    compressor = zlib.compressobj(SNAPSHOT_ZLIB_LEVEL) if compress else None
+    buffer = bytearray()
+
+    def drain():
+        f.write(compressor.compress(buffer) if compressor else buffer)
+        buffer.clear()
+
+    iterator = iter(items)
+    while True:
+        pairs = [list(pair) for pair in itertools.islice(iterator, SNAPSHOT_BATCH)]
+        if not pairs:
+            break
+        if encoding:
+            record = msgpack.packb(pairs, use_bin_type=True)
+        else:
+            record = json.dumps(pairs, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+        buffer += _RECORD_SIZE.pack(len(record))
+        buffer += record
+        if len(buffer) >= SNAPSHOT_CHUNK:
+            drain()
+    buffer += _RECORD_SIZE.pack(0)
+    drain()
+    if compressor:
+        f.write(compressor.flush())
+
+def read_snapshot(f):
+    """Percorre os pares (chave, valor) de um snapshot binário aberto em `f`, sem carregá-lo inteiro."""
+    header = f.read(_SNAPSHOT_HEADER.size)
+    if len(header) < _SNAPSHOT_HEADER.size:
+        raise SnapshotError("Snapshot binário sem cabeçalho.")
+    magic, version, encoding, compression = _SNAPSHOT_HEADER.unpack(header)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Snapshot binário em formato desconhecido (versão {version}).")
+    if encoding == 1 and msgpack is None:
+        raise SnapshotError("Este snapshot foi gravado com msgpack; instale-o com `pip install msgpack`.")
+    decompressor = zlib.decompressobj() if compression else None
+    buffer = bytearray()
+    position = 0
+    while True:
+        # Lê um bloco sempre que o buffer não tiver um registro inteiro.
+        while len(buffer) - position >= _RECORD_SIZE.size:
+            (size,) = _RECORD_SIZE.unpack_from(buffer, position)
+            if size == 0:
+                return
+            end = position + _RECORD_SIZE.size + size
+            if end > len(buffer):
+                break
+            record = bytes(buffer[position + _RECORD_SIZE.size:end])
+            pairs = msgpack.unpackb(record, raw=False, strict_map_key=False) if encoding else json.loads(record)
+            for key, value in pairs:
+                yield key, value
+            position = end
+        chunk = f.read(SNAPSHOT_CHUNK)
+        if not chunk:
+            raise SnapshotError("Snapshot binário cortado: falta o marcador de fim.")
+        del buffer[:position]
+        position = 0
+        buffer += decompressor.decompress(chunk) if decompressor else chunk
+
+def convert_data(file_path, binary):
+    """
+    Regrava um arquivo de dados (JSON ou binário) no outro formato, passando os pares direto da
+    leitura para a escrita. Retorna (bytes antes, bytes depois).
+    """
+    before = os.path.getsize(file_path)
+    save_data(iter_data(file_path), file_path, binary=binary)
+    return before, os.path.getsize(file_path)
+
+def copy_data(data):
+    """Copia uma estrutura JSON (dicts/listas aninhados) para ser serializada fora do loop."""
+    if isinstance(data, dict):
+        return {key: copy_data(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [copy_data(value) for value in data]
+    return data
+
+# ========================================================================================
+#                               MOTOR DE ROLAGEM DE DADOS
+# ========================================================================================
+
+class DiceError(ValueError):
+    """Erro de sintaxe ou de limite numa expressão de dados. A mensagem é mostrada ao usuário."""
+
+class DiceTerm:
+    """Um grupo de dados da expressão, como `4d6kh3`, `3d6!` ou `-1d4`."""
+
+    __slots__ = ("sign", "num", "sides", "explode", "keep_mode", "keep_count", "label")
+
+    def __init__(self, sign, num, sides, explode=False, keep_mode=None, keep_count=0, label=None):
+        self.sign = sign
+        self.num = num
+        self.sides = sides
+        self.explode = explode
+        self.keep_mode = keep_mode  # "kh", "kl", "dh", "dl" ou None
+        self.keep_count = keep_count
+        self.label = label or self._default_label()
+
+    def _default_label(self):
+        label = f"{self.num}d{self.sides}"
+        if self.explode:
+            label += "!"
+        if self.keep_mode:
+            label += f"{self.keep_mode}{self.keep_count}"
+        return label
+
+    def roll_batch(self, count):
+        """
+        Rola o grupo `count` vezes de uma só vez, sorteando a matriz `count × num` numa única chamada.
+        Retorna, para cada repetição, `(dados, subtotal)` com kh/kl/dh/dl já aplicados no subtotal.
+        """
+        rows = draw_dice(self.sides, count, self.num)
+        if self.explode:
+            # Viram listas de int do Python: os totais vão para o diário (JSON) e para o SQLite.
+            rows = [self._explode([int(value) for value in row]) for row in rows]
+        return list(zip(rows, self._subtotals(rows)))
+
+    def _explode(self, rolls):
+        sides = self.sides
+        pending = rolls.count(sides)
+        extra = 0
+        while pending and extra < MAX_EXPLOSIONS:
+            new_rolls = draw_dice(sides, 1, min(pending, MAX_EXPLOSIONS - extra))[0]
+            new_rolls = [int(value) for value in new_rolls]
+            rolls.extend(new_rolls)
+            extra += len(new_rolls)
+            pending = new_rolls.count(sides)
+        return rolls
+
+    def _subtotals(self, rows):
+        if np is not None and isinstance(rows, np.ndarray):
+            # Matriz cheia (sem explosões): soma e kh/kl/dh/dl feitos de uma vez pelo NumPy.
+            if not self.keep_mode:
+                return rows.sum(axis=1).tolist()
+            keep_high, keep = self._keep_rule(self.num)
+            ordered = np.sort(rows, axis=1)
+            # `[num - keep:]` e não `[-keep:]`: com keep == 0 (ex: 4d6dl4) o segundo pegaria a linha toda.
+            kept = ordered[:, self.num - keep:] if keep_high else ordered[:, :keep]
+            return kept.sum(axis=1).tolist()
+        if not self.keep_mode:
+            return [sum(row) for row in rows]
+        subtotals = []
+        for row in rows:
+            keep_high, keep = self._keep_rule(len(row))
+            ordered = sorted(row)
+            subtotals.append(sum(ordered[len(ordered) - keep:] if keep_high else ordered[:keep]))
+        return subtotals
+
+    def _keep_rule(self, pool_size):
+        """Traduz kh/kl/dh/dl para (mantém os maiores?, quantos dados mantém)."""
+        if self.keep_mode in ("kh", "kl"):
+            return self.keep_mode == "kh", self.keep_count
+        return self.keep_mode == "dl", pool_size - self.keep_count
+
+    def select(self, rolls):
+        """Marca os dados mantidos por kh/kl/dh/dl (None quando todos contam). Usado só para exibir."""
+        if not self.keep_mode:
+            return None
+        keep_high, keep = self._keep_rule(len(rolls))
+        order = sorted(range(len(rolls)), key=rolls.__getitem__, reverse=keep_high)
+        kept = [False] * len(rolls)
+        for index in order[:keep]:
+            kept[index] = True
+        return kept
+
+RollResult = collections.namedtuple("RollResult", "total dice_sum groups")
+
+_numpy_rng = np.random.default_rng() if np is not None else None
+
+def draw_dice(sides, rows, per_row):
+    """
+    Sorteia uma matriz `rows × per_row` de dados de `sides` lados numa única chamada.
+    Com NumPy devolve um array 2D; sem ele, listas montadas a partir de um único `random.choices`.
+    """
+    if np is not None:
+        return _numpy_rng.integers(1, sides + 1, size=(rows, per_row))
+    flat = random.choices(range(1, sides + 1), k=rows * per_row)
+    return [flat[start:start + per_row] for start in range(0, rows * per_row, per_row)]
+
+class DiceExpression:
+    """
+    Expressão de dados já compilada: número de repetições (`N#`), grupos de dados e modificador fixo.
+    Criada uma única vez por texto em `compile_dice()` e reaproveitada a cada rolagem.
+    """
+
+    __slots__ = ("count", "terms", "modifier", "formula")
+
+    def __init__(self, count, terms, modifier):
+        self.count = count
+        self.terms = terms
+        self.modifier = modifier
+        formula = ""
+        for term in terms:
+            if formula or term.sign < 0:
+                formula += "+" if term.sign > 0 else "-"
+            formula += term.label
+        if modifier:
+            formula += f"{modifier:+}"
+        self.formula = formula
+
+    @property
+    def cost(self):
+        """Estimativa de quantos dados uma rolagem completa sorteia (explosivos contam em dobro)."""
+        return self.count * sum(term.num * (2 if term.explode else 1) for term in self.terms)
+
+    def roll_once(self):
+        return self.roll(1)[0]
+
+    def roll(self, count=None):
+        """Rola todas as repetições da expressão, sorteando cada grupo de dados em lote."""
+        count = self.count if count is None else count
+        columns = [term.roll_batch(count) for term in self.terms]
+        results = []
+        for index in range(count):
+            groups = []
+            dice_sum = 0
+            for term, column in zip(self.terms, columns):
+                rolls, subtotal = column[index]
+                dice_sum += term.sign * subtotal
+                groups.append((term, rolls))
+            results.append(RollResult(dice_sum + self.modifier, dice_sum, groups))
+        return results
+
+_DICE_COUNT_RE = re.compile(r"(\d+)#")
+_DICE_TERM_RE = re.compile(r"([+-])(?:(\d*)d(\d+)(!)?(?:(kh|kl|dh|dl|k)(\d+)|(adv|dis))?|(\d+))")
+
+def compile_dice(roll_input: str):
+    """
+    Compila uma expressão de dados, com cache: a mesma expressão nunca é analisada duas vezes.
+
+    Sintaxe: `[N#]termo[+/-termo...]`, onde cada termo é um número ou um grupo `XdY` com sufixos
+    opcionais: `!` (dados explosivos), `khN`/`klN` (mantém os N maiores/menores), `dhN`/`dlN`
+    (descarta os N maiores/menores) ou `adv`/`dis` (vantagem/desvantagem: rola 2 e fica com o
+    maior/menor). Ex: `2d6+1d4+3`, `4d6kh3`, `3#1d20adv+5`, `6d10!-2`.
+    Levanta DiceError se a expressão for inválida ou passar dos limites.
+    """
+    return _compile_dice(roll_input.replace(" ", "").lower())
+
+@functools.lru_cache(maxsize=DICE_CACHE_SIZE)
+def _compile_dice(text):
+    count = 1
+    match = _DICE_COUNT_RE.match(text)
+    if match:
+        count = int(match.group(1))
+        text = text[match.end():]
+    if not text.startswith(("+", "-")):
+        text = "+" + text
+
+    terms = []
+    modifier = 0
+    pos = 0
+    while pos < len(text):
+        match = _DICE_TERM_RE.match(text, pos)
+        if not match:
+            raise DiceError("❌ Formato inválido.")
+        pos = match.end()
+        sign_str, num_str, sides_str, explode, keep_mode, keep_str, advantage, number_str = match.groups()
+        sign = -1 if sign_str == "-" else 1
+        if number_str is not None:
+            modifier += sign * int(number_str)
+            continue
+
+        num = int(num_str) if num_str else 1
+        sides = int(sides_str)
+        keep_count = int(keep_str) if keep_str else 0
+        label = None
+        if keep_mode == "k":
+            keep_mode = "kh"
+        if advantage:
+            if num != 1:
+                raise DiceError("❌ Vantagem/desvantagem só vale para um dado (ex: `d20adv`).")
+            label = f"1d{sides}{'!' if explode else ''}{advantage}"
+            num, keep_mode, keep_count = 2, ("kh" if advantage == "adv" else "kl"), 1
+        if num < 1 or sides < 1:
+            raise DiceError("❌ Formato inválido.")
+        if explode and sides < 2:
+            raise DiceError("❌ Dados explosivos precisam de pelo menos 2 lados.")
+        if keep_mode and not 0 < keep_count <= num:
+            raise DiceError(f"❌ Não dá para manter/descartar {keep_count} de {num} dados.")
+        terms.append(DiceTerm(sign, num, sides, bool(explode), keep_mode, keep_count, label))
+
+    if not terms:
+        raise DiceError("❌ Formato inválido.")
+    if count < 1 or count > MAX_ROLL_COUNT or len(terms) > MAX_DICE_TERMS \
+            or any(term.num > MAX_DICE or term.sides > MAX_SIDES for term in terms) \
+            or count * sum(term.num for term in terms) > MAX_TOTAL_DICE:
+        raise DiceError(f"❌ Limites excedidos (Max: {MAX_ROLL_COUNT}#{MAX_DICE}d{MAX_SIDES}, "
+                        f"{MAX_DICE_TERMS} grupos de dados, {MAX_TOTAL_DICE} dados no total).")
+    return DiceExpression(count, tuple(terms), modifier)
+
+def format_dice(term, rolls):
+    """Mostra os dados de um grupo, ou um resumo quando o grupo é grande demais para listar."""
+    if len(rolls) > MAX_SHOWN_DICE:
+        return f"*{len(rolls)} dados (menor `{min_die(rolls)}`, maior `{max_die(rolls)}`)*"
+    rolls = [int(value) for value in rolls]
+    kept = term.select(rolls)
+    shown = []
+    for index, value in enumerate(rolls):
+        text = f"`{value}`"
+        if term.explode and value == term.sides:
+            text += "💥"
+        if kept is not None and not kept[index]:
+            text = f"~~{text}~~"
+        shown.append(text)
+    return " ".join(shown)
+
+def min_die(rolls):
+    return int(rolls.min()) if np is not None and isinstance(rolls, np.ndarray) else min(rolls)
+
+def max_die(rolls):
+    return int(rolls.max()) if np is not None and isinstance(rolls, np.ndarray) else max(rolls)
+
+def format_roll(expression, result):
+    """Monta o texto de uma rolagem no formato usado por todos os comandos de dados."""
+    dice_parts = []
+    for term, rolls in result.groups:
+        group = format_dice(term, rolls)
+        if dice_parts:
+            group = ("+ " if term.sign > 0 else "- ") + group
+        elif term.sign < 0:
+            group = "- " + group
+        dice_parts.append(group)
+
+    texto_resposta = f"**Comando:** `{expression.formula}`\n🎲 **Dados:** {' '.join(dice_parts)} (Soma: `{result.dice_sum}`)\n"
+    if expression.modifier != 0: texto_resposta += f"**⚙️ Modificador:** `{expression.modifier:+}`\n"
+    texto_resposta += f"**📊 Total:** **{result.total}**"
+    return texto_resposta
+
+def format_roll_table(expression, results):
+    """Resumo de muitas repetições: uma linha com o total de cada uma, mais o total geral."""
+    lines = [f"**Comando:** `{expression.count}#{expression.formula}`"]
+    lines.extend(f"**{index}.** `{result.total}`" for index, result in enumerate(results, start=1))
+    lines.append(f"**📊 Soma das rolagens:** **{sum(result.total for result in results)}**")
+    return "\n".join(lines)
+
+def process_roll(roll_input: str):
+    """Rolagem única (sem `N#`). Retorna: status (str), mensagem (str), valor_total (int)"""
+    return process_initiative_roll(roll_input)
+
+# --- Estatísticas exatas (pd.roll_stats) ---
+
+DiceStats = collections.namedtuple("DiceStats", "minimum maximum mean std_dev percentiles tail")
+
+def _convolve(a, b):
+    """Convolução de duas listas de probabilidades (FFT para as grandes, quando há NumPy)."""
+    if np is not None:
+        if len(a) * len(b) > FFT_MIN_WORK:
+            size = len(a) + len(b) - 1
+            n = 1 << (size - 1).bit_length()
+            out = np.fft.irfft(np.fft.rfft(a, n) * np.fft.rfft(b, n), n)[:size]
+            return np.clip(out, 0.0, None)  # O FFT deixa resíduos negativos minúsculos.
+        return np.convolve(a, b)
+    out = [0.0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                out[i + j] += x * y
+    return out
+
+def _as_probs(values):
+    return np.array(values, dtype=float) if np is not None else list(values)
+
+@functools.lru_cache(maxsize=STATS_CACHE_SIZE)
+def _die_distribution(sides, explode):
+    """Distribuição de um único dado: (menor valor, probabilidades)."""
+    if not explode:
+        return 1, _as_probs([1.0 / sides] * sides)
+    # Dado explosivo: o valor final é sides*j + r (r < sides) depois de j explosões seguidas.
+    # A cadeia é cortada quando a chance de continuar fica desprezível (ou no limite de explosões).
+    probs = []
+    chain = 1.0
+    for depth in range(MAX_EXPLOSIONS + 1):
+        probs.extend([chain / sides] * (sides - 1))
+        chain /= sides
+        if chain < STATS_EPSILON or depth == MAX_EXPLOSIONS:
+            probs.append(chain)
+            break
+        probs.append(0.0)
+    return 1, _as_probs(probs)
+
+@functools.lru_cache(maxsize=STATS_CACHE_SIZE)
+def _pool_distribution(num, sides, explode):
+    """Soma de `num` dados iguais. Divide o grupo ao meio, então metades iguais saem do cache."""
+    if num == 1:
+        return _die_distribution(sides, explode)
+    half = num // 2
+    offset_a, probs_a = _pool_distribution(half, sides, explode)
+    offset_b, probs_b = _pool_distribution(num - half, sides, explode)
+    return offset_a + offset_b, _convolve(probs_a, probs_b)
+
+@functools.lru_cache(maxsize=STATS_CACHE_SIZE)
+def _keep_distribution(num, sides, keep_high, keep):
+    """
+    Soma dos `keep` maiores (ou menores) entre `num` dados.
+    Percorre as faces da melhor para a pior contando, de forma exata, quantos dados caem em cada uma;
+    assim que os `keep` dados mantidos estão definidos, os demais podem cair em qualquer face restante.
+    """
+    faces = range(sides, 0, -1) if keep_high else range(1, sides + 1)
+    states = {(0, 0): 1}  # (dados já definidos, soma dos mantidos) -> número de combinações
+    final = collections.Counter()
+    for index, face in enumerate(faces):
+        remaining_faces = sides - index - 1
+        next_states = collections.Counter()
+        for (assigned, total), ways in states.items():
+            for count in range(num - assigned + 1):
+                now_assigned = assigned + count
+                now_total = total + face * (min(keep, now_assigned) - assigned)
+                now_ways = ways * math.comb(num - assigned, count)
+                if now_assigned >= keep:
+                    rest = num - now_assigned
+                    if rest == 0:
+                        final[now_total] += now_ways
+                    elif remaining_faces:
+                        final[now_total] += now_ways * remaining_faces ** rest
+                else:
+                    next_states[(now_assigned, now_total)] += now_ways
+        states = next_states
+    offset = min(final)
+    outcomes = sides ** num
+    return offset, _as_probs([final.get(total, 0) / outcomes for total in range(offset, max(final) + 1)])
+
+def _term_distribution(term):
+    if term.keep_mode:
+        if term.explode:
+            raise DiceError("❌ Estatísticas de dados explosivos com kh/kl/dh/dl não são suportadas.")
+        keep_high, keep = term._keep_rule(term.num)
+        offset, probs = _keep_distribution(term.num, term.sides, keep_high, keep)
+    else:
+        offset, probs = _pool_distribution(term.num, term.sides, term.explode)
+    if term.sign < 0:
+        return -(offset + len(probs) - 1), probs[::-1]
+    return offset, probs
+
+def _check_stats_cost(expression):
+    """
+    Recusa expressões cujo cálculo exato seria caro demais (antes de gastar tempo nelas).
+    Retorna o custo estimado: (resultados possíveis, trabalho das contagens de kh/kl/dh/dl).
+    """
+    outcomes = 1
+    keep_work = 0
+    for term in expression.terms:
+        if term.keep_mode:
+            keep = term._keep_rule(term.num)[1]
+            work = term.sides ** 2 * keep ** 2 * term.num
+            if work > STATS_MAX_KEEP_WORK:
+                raise DiceError("❌ Essa combinação de kh/kl/dh/dl é pesada demais para calcular.")
+            keep_work += work
+            outcomes += keep * (term.sides - 1)
+        elif term.explode:
+            outcomes += term.num * len(_die_distribution(term.sides, True)[1])
+        else:
+            outcomes += term.num * (term.sides - 1)
+    limit = STATS_MAX_OUTCOMES if np is not None else STATS_MAX_OUTCOMES_NO_NUMPY
+    if outcomes > limit:
+        raise DiceError(f"❌ Expressão grande demais para calcular as chances (máx. {limit} resultados possíveis).")
+    return outcomes, keep_work
+
+@functools.lru_cache(maxsize=STATS_CACHE_SIZE)
+def dice_statistics(formula):
+    """
+    Distribuição exata de uma rolagem (uma repetição) e seus números principais.
+    Chamada fora do loop de eventos; o resultado fica em cache por fórmula.
+    """
+    expression = compile_dice(formula)
+    _check_stats_cost(expression)
+    offset, probs = expression.modifier, [1.0]
+    for term in expression.terms:
+        term_offset, term_probs = _term_distribution(term)
+        offset += term_offset
+        probs = _convolve(probs, term_probs)
+
+    probs = [float(p) for p in probs]
+    total = sum(probs)
+    probs = [p / total for p in probs]
+    # Corta as pontas com chance desprezível (caudas das explosões, resíduos numéricos).
+    start = next(i for i, p in enumerate(probs) if p > STATS_EPSILON)
+    end = max(i for i, p in enumerate(probs) if p > STATS_EPSILON)
+
+    mean = sum((offset + i) * p for i, p in enumerate(probs))
+    variance = sum((offset + i - mean) ** 2 * p for i, p in enumerate(probs))
+    percentiles = {}
+    cumulative = 0.0
+    wanted = iter(STATS_PERCENTILES)
+    next_percentile = next(wanted)
+    for i, p in enumerate(probs):
+        cumulative += p
+        while next_percentile is not None and cumulative >= next_percentile / 100 - STATS_EPSILON:
+            percentiles[next_percentile] = offset + i
+            next_percentile = next(wanted, None)
+    # tail[i] = P(total >= offset + start + i)
+    tail = list(itertools.accumulate(reversed(probs[start:end + 1])))[::-1]
+    return DiceStats(offset + start, offset + end, mean, math.sqrt(variance), percentiles, tail)
+
+def chance_at_least(stats, target):
+    """P(total >= target) a partir das estatísticas em cache, sem percorrer a distribuição."""
+    if target <= stats.minimum:
+        return 1.0
+    if target > stats.maximum:
+        return 0.0
+    return min(1.0, stats.tail[target - stats.minimum])
+
+_STATS_TARGET_RE = re.compile(r"(.+?)\s*(?:>=|≥)\s*(-?\d+)\s*")
+
+def split_stats_target(entrada):
+    """
+    Separa `3d6+2 >= 15` (ou `3d6+2 15`) em expressão e alvo. O alvo é opcional. Sem o `>=`, só um
+    número sem sinal no fim vale como alvo: em `1d20 -5` o `-5` é modificador, não alvo.
+    """
+    match = _STATS_TARGET_RE.fullmatch(entrada)
+    if match:
+        return match.group(1), int(match.group(2))
+    expression_text, _, last = entrada.strip().rpartition(" ")
+    if expression_text and re.fullmatch(r"\d+", last):
+        try:
+            compile_dice(expression_text)
+            return expression_text, int(last)
+        except DiceError:
+            pass
+    return entrada, None
+
+# ========================================================================================
+#                               ARMAZENAMENTO DE DADOS
+# ========================================================================================
+
+# Campos simples do perfil, que podem ser alterados por `update()` (e colunas da tabela `profiles`)
+PROFILE_COLUMNS = ("name", "money", "hp_atual", "hp_max")
+PROFILE_JSON_KEYS = frozenset(PROFILE_COLUMNS + ("inventory", "attributes", "macros"))
+
+class Profile:
+    """
+    Perfil de um jogador na memória.
+
+    Usa `__slots__` em vez de um dicionário por perfil, e os nomes de itens e atributos passam
+    por `sys.intern()`: uma "Poção" repetida em milhares de inventários vira uma única string.
+    A conversão de e para o formato do database.json (`from_json`/`to_json`) não perde nada:
+    campos que a classe não conhece ficam em `extra` e voltam na gravação. As macros de rolagem
+    (`{nome: expressão}`) ficam em None enquanto o jogador não cria nenhuma, como `extra`.
+    """
+
+    __slots__ = ("name", "money", "hp_atual", "hp_max", "inventory", "attributes", "macros", "extra")
+
+    def __init__(self, name="", money=0, hp_atual=10, hp_max=10, inventory=None, attributes=None, extra=None, macros=None):
+        self.name = name
+        self.money = money
+        self.hp_atual = hp_atual
+        self.hp_max = hp_max
+        self.inventory = {sys.intern(item): quantity for item, quantity in (inventory or {}).items()}
+        self.attributes = {sys.intern(attr): value for attr, value in (attributes or {}).items()}
+        self.macros = dict(macros) if macros else None
+        self.extra = extra  # campos desconhecidos do JSON, ou None
+
+    @classmethod
+    def from_json(cls, data):
+        extra = {key: value for key, value in data.items() if key not in PROFILE_JSON_KEYS}
+        return cls(
+            data.get("name", ""), data.get("money", 0), data.get("hp_atual", 10), data.get("hp_max", 10),
+            data.get("inventory"), data.get("attributes"), extra or None, data.get("macros"),
+        )
+
+    def to_json(self):
+        """Dicionário no formato do database.json (uma cópia: pode ser serializado fora do loop)."""
+        data = {
+            "name": self.name, "money": self.money, "inventory": dict(self.inventory),
+            "hp_atual": self.hp_atual, "hp_max": self.hp_max, "attributes": dict(self.attributes),
+        }
+        if self.macros:
+            data["macros"] = dict(self.macros)
+        if self.extra:
+            data.update(copy_data(self.extra))
+        return data
+
+    def copy(self):
+        """
+        Cópia para edição, sem passar pelo formato JSON: os dicionários são copiados e as strings já
+        internadas são reaproveitadas. `extra` é compartilhado (nenhuma operação o altera).
+        """
+        clone = object.__new__(Profile)
+        clone.name, clone.money, clone.hp_atual, clone.hp_max = self.name, self.money, self.hp_atual, self.hp_max
+        clone.inventory = dict(self.inventory)
+        clone.attributes = dict(self.attributes)
+        clone.macros = dict(self.macros) if self.macros else None
+        clone.extra = self.extra
+        return clone
+
+    def update(self, fields):
+        for field, value in fields.items():
+            if field not in PROFILE_COLUMNS:
+                raise ValueError(f"Campo de perfil desconhecido: {field}")
+            setattr(self, field, value)
+
+    def set_item(self, item_name, quantity):
+        if quantity > 0:
+            self.inventory[sys.intern(item_name)] = quantity
+        else:
+            self.inventory.pop(item_name, None)
+
+    def set_attribute(self, attr_name, value):
+        if value is None:
+            self.attributes.pop(attr_name, None)
+        else:
+            self.attributes[sys.intern(attr_name)] = value
+
+    def set_macro(self, macro_name, expression):
+        if expression is not None:
+            if self.macros is None:
+                self.macros = {}
+            self.macros[macro_name] = expression
+        elif self.macros:
+            self.macros.pop(macro_name, None)
+            if not self.macros:
+                self.macros = None
+
+class UserStore:
+    """
+    Interface de armazenamento dos perfis de jogadores.
+
+    Os perfis são objetos `Profile`, indexados pelo ID (inteiro) do usuário. O perfil devolvido
+    por `get()` é só para leitura: toda alteração passa pelos métodos abaixo, para que cada
+    backend grave apenas o que mudou.
+
+    Cada alteração também avança a versão do perfil (`version()`), um contador mantido só na
+    memória que permite reaproveitar o que foi calculado a partir do perfil enquanto ele não mudar.
+    """
+
+    _versions = None  # user_id -> número de alterações desde que o bot iniciou
+
+    def version(self, user_id):
+        return self._versions.get(user_id, 0) if self._versions else 0
+
+    def _touch(self, user_id):
+        if self._versions is None:
+            self._versions = {}
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def get(self, user_id):
+        """Retorna o perfil do usuário, ou None se ele não estiver registrado."""
+        raise NotImplementedError
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def items(self):
+        """Percorre todos os pares (user_id, perfil). Usado por migrações e índices."""
+        raise NotImplementedError
+
+    def inventory_items(self):
+        """Percorre todos os itens de todos os inventários como (user_id, item, quantidade)."""
+        for user_id, profile in self.items():
+            for item_name, quantity in profile.inventory.items():
+                yield user_id, item_name, quantity
+
+    def balances(self):
+        """Percorre o saldo de todos os jogadores como (user_id, dinheiro)."""
+        for user_id, profile in self.items():
+            yield user_id, profile.money
+
+    def shared_version(self):
+        """
+        Número que muda quando outro processo altera os perfis, para quem guarda dados derivados
+        deles (índices) saber quando refazê-los. None nos backends usados por um processo só.
+        """
+        return None
+
+    def create(self, user_id, profile):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def update(self, user_id, **fields):
+        """Define campos simples do perfil (name, money, hp_atual, hp_max)."""
+        raise NotImplementedError
+
+    def set_item(self, user_id, item_name, quantity):
+        """Define a quantidade de um item; quantidade 0 remove o item do inventário."""
+        raise NotImplementedError
+
+    def set_attribute(self, user_id, attr_name, value):
+        """Define um atributo; valor None remove o atributo."""
+        raise NotImplementedError
+
+    def set_macro(self, user_id, macro_name, expression):
+        """Define a expressão de uma macro de rolagem; expressão None remove a macro."""
+        raise NotImplementedError
+
+    def transaction(self):
+        """Context manager que aplica todas as alterações do bloco de uma vez."""
+        raise NotImplementedError
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+class InitiativeStore:
+    """
+    Interface de armazenamento das listas de iniciativa.
+    Cada canal tem um dicionário `{entry_id: {"name", "score", "modifier", "seq"}}` e um turno atual
+    (id de quem está agindo e número da rodada).
+    """
+
+    def get(self, channel_id):
+        """Retorna as entradas do canal (dicionário vazio se não houver lista)."""
+        raise NotImplementedError
+
+    def __contains__(self, channel_id):
+        return bool(self.get(channel_id))
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def items(self):
+        raise NotImplementedError
+
+    def set_entry(self, channel_id, entry_id, entry):
+        raise NotImplementedError
+
+    def clear(self, channel_id):
+        """Apaga a lista inteira do canal, incluindo o turno."""
+        raise NotImplementedError
+
+    def get_turn(self, channel_id):
+        """Retorna (entry_id de quem está agindo ou None, rodada)."""
+        raise NotImplementedError
+
+    def set_turn(self, channel_id, entry_id, round_number):
+        raise NotImplementedError
+
+    def touch(self, channel_id, timestamp):
+        """Grava o horário (Unix) do último uso da lista do canal, se ela existir."""
+        raise NotImplementedError
+
+    def touched(self, channel_id):
+        """Horário gravado do último uso da lista do canal, ou None."""
+        raise NotImplementedError
+
+    def activity(self):
+        """Percorre (channel_id, horário do último uso ou None) de todos os canais com lista."""
+        raise NotImplementedError
+
+    def transaction(self):
+        raise NotImplementedError
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+class WriteBehind:
+    """
+    Base dos stores que gravam em segundo plano (write-behind).
+
+    Cada alteração agenda um `flush()` para daqui a `delay` segundos, agrupando numa só
+    gravação tudo o que mudar nesse intervalo. Subclasses implementam `flush()` e `_has_pending()`.
+    """
+
+    delay = SAVE_DELAY
+    _flush_task = None
+
+    def _schedule_flush(self):
+        """Agenda uma gravação. Retorna False se não há loop rodando (quem chamou deve gravar na hora)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._delayed_flush())
+        return True
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.delay)
+        # O shield garante que um cancelamento (ex: no desligamento) não interrompa uma escrita no meio.
+        await asyncio.shield(self.flush())
+        if self._has_pending():
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+
+    def _has_pending(self):
+        raise NotImplementedError
+
+    async def flush(self):
+        raise NotImplementedError
+
+    async def close(self):
+        """Cancela a gravação agendada e grava imediatamente o que estiver pendente."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+class DataStore(WriteBehind):
+    """
+    Mantém um dicionário em memória e persiste suas alterações em segundo plano.
+
+    Cada alteração é uma operação pequena (ex: `["update", "123", {"money": 10}]`) aplicada na
+    memória e anotada numa linha de um diário (journal) só de acréscimo. As linhas são agrupadas
+    e gravadas numa thread após `delay` segundos, então uma escrita custa o tamanho da alteração,
+    e não o do banco inteiro. Na inicialização, o diário é reaplicado sobre o último snapshot lido
+    por `load_data()`. Quando o diário passa de `compact_size` bytes, um novo snapshot é gravado
+    (de forma atômica) e o diário é zerado.
+
+    As operações guardam sempre o valor final, nunca a diferença, e ignoram registros que não
+    existem mais: reaplicar um trecho do diário sobre um snapshot que já o contém (mesmo um que
+    já reflita um `delete` posterior) não altera nada. Por isso uma queda entre gravar o snapshot
+    e zerar o diário, ou uma operação anotada durante a compactação, não corrompe os dados.
+
+    Subclasses definem as operações como métodos `_op_<nome>(*args)`.
+    """
+
+    def __init__(self, file_path, delay=SAVE_DELAY, compact_size=JOURNAL_COMPACT_SIZE, binary=False):
+        self.file_path = file_path
+        self.journal_path = os.path.splitext(file_path)[0] + ".journal"
+        self.delay = delay
+        self.compact_size = compact_size
+        self.binary = binary  # formato dos snapshots gravados; a leitura aceita os dois
+        self.data = self._upgrade(iter_data(file_path))
+        self._pending = []
+        self._batch = None
+        self._journal_size = 0
+        self._flush_lock = asyncio.Lock()
+        if not self._replay():
+            # O diário terminou numa linha cortada: consolida tudo num snapshot limpo
+            # para que as próximas linhas não sejam escritas depois do lixo.
+            self._write_snapshot(self._snapshot())
+            self._journal_size = 0
+
+    def _replay(self):
+        """Reaplica o diário sobre o snapshot. Retorna False se encontrar uma linha incompleta."""
+        if not os.path.exists(self.journal_path):
+            return True
+        with open(self.journal_path, "r", encoding='utf-8') as f:
+            for line in f:
+                try:
+                    op, *args = json.loads(line)
+                except ValueError:
+                    return False
+                self._apply(op, args)
+                if not line.endswith("\n"):
+                    return False
+        self._journal_size = os.path.getsize(self.journal_path)
+        return True
+
+    def _upgrade(self, items):
+        """Monta os dados da memória a partir dos pares (chave, valor) do snapshot (subclasses sobrescrevem)."""
+        return dict(items)
+
+    def _snapshot(self):
+        """Cópia dos dados no formato do arquivo, para ser gravada fora do loop."""
+        return copy_data(self.data)
+
+    def _apply(self, op, args):
+        getattr(self, f"_op_{op}")(*args)
+
+    def _op_batch(self, operations):
+        for op, *args in operations:
+            self._apply(op, args)
+
+    def record(self, op, *args):
+        """Aplica uma operação na memória e a anota no diário para ser gravada em segundo plano."""
+        self._apply(op, args)
+        if self._batch is not None:
+            self._batch.append([op, *args])
+            return
+        self._write_later([op, *args])
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Agrupa as operações do bloco numa única linha do diário.
+        Se o bot cair no meio da escrita, a linha inteira é descartada na reaplicação:
+        ou todas as operações do bloco valem, ou nenhuma.
+        """
+        if self._batch is not None:
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+        finally:
+            batch, self._batch = self._batch, None
+            if len(batch) == 1:
+                self._write_later(batch[0])
+            elif batch:
+                self._write_later(["batch", batch])
+
+    def _write_later(self, operation):
+        self._pending.append(json.dumps(operation, ensure_ascii=False) + "\n")
+        if not self._schedule_flush():
+            # Fora do loop (scripts, testes): grava na hora.
+            self._append_journal("".join(self._pending))
+            self._pending = []
+
+    def _has_pending(self):
+        return bool(self._pending)
+
+    async def flush(self):
+        """Grava agora as operações pendentes e compacta o diário se ele estiver grande."""
+        async with self._flush_lock:
+            if self._pending:
+                lines, self._pending = "".join(self._pending), []
+                try:
+                    await asyncio.to_thread(self._append_journal, lines)
+                except Exception:
+                    self._pending.insert(0, lines)
+                    raise
+            if self._journal_size >= self.compact_size:
+                await self.compact()
+
+    async def compact(self):
+        """Grava um novo snapshot com o estado atual e zera o diário."""
+        # A cópia é feita no loop (nenhum comando mexe nos dados durante ela);
+        # o trabalho pesado de serializar e escrever fica com a thread.
+        snapshot = self._snapshot()
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+        self._journal_size = 0
+
+    def _append_journal(self, lines):
+        encoded = lines.encode('utf-8')
+        with open(self.journal_path, "ab") as f:
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_size += len(encoded)
+        metrics.count("journal_bytes", len(encoded))
+
+    def _write_snapshot(self, snapshot):
+        save_data(snapshot, self.file_path, binary=self.binary)
+        open(self.journal_path, "w").close()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        return self.data.items()
+
+class JsonUserStore(DataStore, UserStore):
+    """
+    Perfis guardados em database.json + database.journal.
+    Na memória, os perfis são objetos `Profile` indexados pelo ID inteiro; no arquivo e no diário,
+    seguem o formato JSON de sempre (IDs como texto).
+    """
+
+    def _upgrade(self, items):
+        return {int(user_id): Profile.from_json(profile) for user_id, profile in items}
+
+    def _snapshot(self):
+        return {str(user_id): profile.to_json() for user_id, profile in self.data.items()}
+
+    def create(self, user_id, profile):
+        self.record("create", user_id, profile.to_json())
+        self._touch(user_id)
+
+    def delete(self, user_id):
+        self.record("delete", user_id)
+        self._touch(user_id)
+
+    def update(self, user_id, **fields):
+        self.record("update", user_id, fields)
+        self._touch(user_id)
+
+    def set_item(self, user_id, item_name, quantity):
+        self.record("item", user_id, item_name, quantity)
+        self._touch(user_id)
+
+    def set_attribute(self, user_id, attr_name, value):
+        self.record("attribute", user_id, attr_name, value)
+        self._touch(user_id)
+
+    def set_macro(self, user_id, macro_name, expression):
+        self.record("macro", user_id, macro_name, expression)
+        self._touch(user_id)
+
+    # Diários antigos guardam o ID como texto, por isso as operações o convertem com int().
+    # Reaplicado sobre um snapshot mais novo, o diário pode alterar um perfil que o snapshot já
+    # mostra apagado (o `delete` vem mais adiante no diário): essas alterações são ignoradas.
+
+    def _op_create(self, user_id, profile):
+        self.data[int(user_id)] = Profile.from_json(profile)
+
+    def _op_delete(self, user_id):
+        self.data.pop(int(user_id), None)
+
+    def _op_update(self, user_id, fields):
+        profile = self.data.get(int(user_id))
+        if profile is not None:
+            profile.update(fields)
+
+    def _op_item(self, user_id, item_name, quantity):
+        profile = self.data.get(int(user_id))
+        if profile is not None:
+            profile.set_item(item_name, quantity)
+
+    def _op_attribute(self, user_id, attr_name, value):
+        profile = self.data.get(int(user_id))
+        if profile is not None:
+            profile.set_attribute(attr_name, value)
+
+    def _op_macro(self, user_id, macro_name, expression):
+        profile = self.data.get(int(user_id))
+        if profile is not None:
+            profile.set_macro(macro_name, expression)
+
+class JsonInitiativeStore(DataStore, InitiativeStore):
+    """
+    Listas de iniciativa guardadas em initiative.json + initiative.journal.
+    Cada canal é guardado como `{"entries": {...}, "turn": entry_id, "round": n}`.
+    """
+
+    def _upgrade(self, items):
+        # Formato antigo: o canal era direto o dicionário de entradas.
+        return {channel_id: channel if "entries" in channel else {"entries": channel, "turn": None, "round": 0}
+                for channel_id, channel in items}
+
+    def _channel(self, channel_id):
+        return self.data.setdefault(channel_id, {"entries": {}, "turn": None, "round": 0})
+
+    def get(self, channel_id):
+        channel = self.data.get(channel_id)
+        return channel["entries"] if channel else {}
+
+    def __contains__(self, channel_id):
+        return bool(self.get(channel_id))
+
+    def items(self):
+        for channel_id, channel in self.data.items():
+            yield channel_id, channel["entries"]
+
+    def get_turn(self, channel_id):
+        channel = self.data.get(channel_id)
+        return (channel["turn"], channel["round"]) if channel else (None, 0)
+
+    def set_entry(self, channel_id, entry_id, entry):
+        self.record("entry", channel_id, entry_id, entry)
+
+    def clear(self, channel_id):
+        self.record("clear", channel_id)
+
+    def set_turn(self, channel_id, entry_id, round_number):
+        self.record("turn", channel_id, entry_id, round_number)
+
+    def touch(self, channel_id, timestamp):
+        if channel_id in self.data:
+            self.record("touch", channel_id, timestamp)
+
+    def touched(self, channel_id):
+        channel = self.data.get(channel_id)
+        return channel.get("touched") if channel else None
+
+    def activity(self):
+        for channel_id, channel in self.data.items():
+            yield channel_id, channel.get("touched")
+
+    def _op_entry(self, channel_id, entry_id, entry):
+        self._channel(channel_id)["entries"][entry_id] = entry
+
+    def _op_clear(self, channel_id):
+        self.data.pop(channel_id, None)
+
+    def _op_turn(self, channel_id, entry_id, round_number):
+        channel = self._channel(channel_id)
+        channel["turn"] = entry_id
+        channel["round"] = round_number
+
+    def _op_touch(self, channel_id, timestamp):
+        if channel_id in self.data:
+            self.data[channel_id]["touched"] = timestamp
+
+class ShardedUserStore(WriteBehind, UserStore):
+    """
+    Perfis guardados um por arquivo (`profiles/<balde>/<user_id>.json`), carregados sob demanda.
+
+    Nada é lido na inicialização: cada perfil é lido do disco no primeiro acesso e fica num
+    cache LRU limitado a `cache_bytes` (medido pelo tamanho do JSON de cada perfil). Quando o
+    cache passa do limite, os perfis usados há mais tempo são descartados, mas só os "limpos":
+    os alterados ficam na memória até serem gravados em segundo plano. Assim o tempo de
+    inicialização e a memória usada não crescem junto com o número de jogadores.
+
+    Os arquivos são divididos em `PROFILE_BUCKETS` pastas para nenhuma delas ficar enorme.
+    Cada perfil é gravado de forma atômica; um bloco `transaction()` não é atômico entre perfis
+    diferentes, mas suas alterações vão juntas na mesma gravação.
+    """
+
+    def __init__(self, directory, cache_bytes=PROFILE_CACHE_BYTES, delay=SAVE_DELAY):
+        self.directory = directory
+        self.cache_bytes = cache_bytes
+        self.delay = delay
+        # user_id -> perfil, do menos para o mais recentemente usado.
+        # None marca um usuário que não existe (ou foi apagado e ainda não saiu do disco).
+        self._cache = collections.OrderedDict()
+        self._sizes = {}
+        self._used_bytes = 0
+        self._dirty = set()
+        self._writing = set()
+        self._flush_lock = asyncio.Lock()
+        self._count = None  # perfis existentes; None até uma varredura completa (items() ou len())
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id):
+        bucket = f"{int(user_id) % PROFILE_BUCKETS:03d}"
+        return os.path.join(self.directory, bucket, f"{user_id}.json")
+
+    def get(self, user_id):
+        if user_id in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(user_id)
+            return self._cache[user_id]
+        self.misses += 1
+        profile, size = self._read(user_id)
+        self._remember(user_id, profile, size)
+        return profile
+
+    def _read(self, user_id):
+        try:
+            with open(self._path(user_id), "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None, MISSING_PROFILE_SIZE
+        return Profile.from_json(json.loads(raw)), len(raw)
+
+    def _remember(self, user_id, profile, size, dirty=False):
+        if dirty:
+            # Marca antes de aplicar o limite, para o próprio perfil novo não ser descartado.
+            self._dirty.add(user_id)
+        self._used_bytes += size - self._sizes.get(user_id, 0)
+        self._sizes[user_id] = size
+        self._cache[user_id] = profile
+        self._cache.move_to_end(user_id)
+        self._evict()
+
+    def _evict(self):
+        """Descarta os perfis limpos menos usados até o cache voltar ao limite."""
+        while self._used_bytes > self.cache_bytes:
+            for user_id in self._cache:
+                if user_id not in self._dirty and user_id not in self._writing:
+                    break
+            else:
+                return  # Só sobraram perfis com alterações pendentes.
+            del self._cache[user_id]
+            self._used_bytes -= self._sizes.pop(user_id)
+
+    def _changed(self, user_id):
+        self._dirty.add(user_id)
+        self._touch(user_id)
+        if not self._schedule_flush():
+            # Fora do loop (scripts, migrações): grava na hora.
+            self._flush_now()
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __len__(self):
+        """
+        Número de perfis. Vem da contagem mantida na memória desde a última varredura completa
+        (a de `build_indexes()`, na inicialização); sem ela, percorre as pastas do disco.
+        """
+        if self._count is None:
+            self._flush_now()
+            total = 0
+            for bucket in os.scandir(self.directory):
+                if bucket.is_dir():
+                    total += sum(1 for entry in os.scandir(bucket.path) if entry.name.endswith(".json"))
+            self._count = total
+        return self._count
+
+    def items(self):
+        """Percorre todos os perfis, lendo do disco os que não estão no cache (sem colocá-los no cache)."""
+        self._flush_now()
+        total = 0
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                user_id = int(entry.name[:-len(".json")])
+                if user_id in self._cache:
+                    profile = self._cache[user_id]
+                else:
+                    profile = self._read(user_id)[0]
+                if profile is not None:
+                    total += 1
+                    yield user_id, profile
+        self._count = total
+
+    def create(self, user_id, profile):
+        if self._count is not None and self.get(user_id) is None:
+            self._count += 1
+        self._remember(user_id, profile, len(json.dumps(profile.to_json(), ensure_ascii=False)), dirty=True)
+        self._changed(user_id)
+
+    def delete(self, user_id):
+        if self._count is not None and self.get(user_id) is not None:
+            self._count -= 1
+        self._remember(user_id, None, MISSING_PROFILE_SIZE, dirty=True)
+        self._changed(user_id)
+
+    def _profile_for_update(self, user_id):
+        profile = self.get(user_id)
+        if profile is None:
+            raise KeyError(user_id)
+        return profile
+
+    def update(self, user_id, **fields):
+        self._profile_for_update(user_id).update(fields)
+        self._changed(user_id)
+
+    def set_item(self, user_id, item_name, quantity):
+        self._profile_for_update(user_id).set_item(item_name, quantity)
+        self._changed(user_id)
+
+    def set_attribute(self, user_id, attr_name, value):
+        self._profile_for_update(user_id).set_attribute(attr_name, value)
+        self._changed(user_id)
+
+    def set_macro(self, user_id, macro_name, expression):
+        self._profile_for_update(user_id).set_macro(macro_name, expression)
+        self._changed(user_id)
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+    def _has_pending(self):
+        return bool(self._dirty)
+
+    def _take_dirty(self):
+        batch = {}
+        for user_id in self._dirty:
+            profile = self._cache[user_id]
+            batch[user_id] = profile.to_json() if profile is not None else None
+        self._dirty = set()
+        return batch
+
+    def _write_profiles(self, batch):
+        """Grava (ou apaga) os arquivos dos perfis. Retorna o novo tamanho de cada um."""
+        sizes = {}
+        for user_id, profile in batch.items():
+            path = self._path(user_id)
+            if profile is None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_data(profile, path)
+            sizes[user_id] = os.path.getsize(path)
+        return sizes
+
+    def _flush_now(self):
+        if self._dirty and not self._writing:
+            self._write_profiles(self._take_dirty())
+            self._evict()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch = self._take_dirty()
+            self._writing = set(batch)
+            try:
+                sizes = await asyncio.to_thread(self._write_profiles, batch)
+            except Exception:
+                self._dirty.update(batch)
+                raise
+            finally:
+                self._writing = set()
+            for user_id, size in sizes.items():
+                if user_id in self._cache and user_id not in self._dirty:
+                    self._remember(user_id, self._cache[user_id], size)
+            self._evict()
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id  INTEGER PRIMARY KEY,
+    name     TEXT    NOT NULL,
+    money    INTEGER NOT NULL DEFAULT 0,
+    hp_atual INTEGER NOT NULL DEFAULT 10,
+    hp_max   INTEGER NOT NULL DEFAULT 10,
+    version  INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS inventory (
+    user_id  INTEGER NOT NULL,
+    item     TEXT    NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (user_id, item)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS attributes (
+    user_id INTEGER NOT NULL,
+    name    TEXT    NOT NULL,
+    value   INTEGER NOT NULL,
+    PRIMARY KEY (user_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS macros (
+    user_id    INTEGER NOT NULL,
+    name       TEXT    NOT NULL,
+    expression TEXT    NOT NULL,
+    PRIMARY KEY (user_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS initiative (
+    channel_id INTEGER NOT NULL,
+    entry_id   TEXT    NOT NULL,
+    name       TEXT    NOT NULL,
+    score      INTEGER NOT NULL,
+    modifier   INTEGER NOT NULL DEFAULT 0,
+    seq        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel_id, entry_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS initiative_turns (
+    channel_id INTEGER PRIMARY KEY,
+    entry_id   TEXT,
+    round      INTEGER NOT NULL DEFAULT 0,
+    touched    INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+class SqliteDatabase:
+    """
+    Conexão SQLite compartilhada pelos stores de perfis e de iniciativa.
+
+    Usa o modo WAL (leituras não bloqueiam a escrita) com `synchronous=NORMAL`, em que um
+    commit só acrescenta ao arquivo de WAL, sem fsync, então as escritas de cada comando
+    são rápidas o bastante para rodar direto no loop. O sqlite3 guarda em cache as
+    instruções já preparadas, já que o SQL de cada operação é sempre o mesmo texto.
+
+    É o único backend que vários processos podem abrir ao mesmo tempo (modo com shards): as
+    transações usam `BEGIN IMMEDIATE`, então duas escritas nunca se intercalam, e quem encontra
+    o banco ocupado espera até SQLITE_BUSY_TIMEOUT_MS em vez de falhar.
+    """
+
+    def __init__(self, file_path):
+        self.conn = sqlite3.connect(file_path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._upgrade_schema()
+        self._depth = 0
+
+    def _upgrade_schema(self):
+        """Acrescenta colunas criadas depois da primeira versão do banco."""
+        for table, added in (("initiative", ("modifier", "seq")), ("profiles", ("version",)), ("initiative_turns", ("touched",))):
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            for column in added:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Abre uma transação (ou reaproveita a que já está aberta) e faz commit ao final do bloco."""
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._depth = 1
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        else:
+            self.conn.execute("COMMIT")
+        finally:
+            self._depth = 0
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+class SqliteUserStore(UserStore):
+    """Perfis guardados no SQLite, uma linha por perfil, item, atributo e macro."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, user_id):
+        conn = self.db.conn
+        key = int(user_id)
+        row = conn.execute("SELECT name, money, hp_atual, hp_max FROM profiles WHERE user_id = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return self._build_profile(key, row)
+
+    def _build_profile(self, key, row):
+        conn = self.db.conn
+        name, money, hp_atual, hp_max = row
+        inventory = dict(conn.execute("SELECT item, quantity FROM inventory WHERE user_id = ?", (key,)))
+        attributes = dict(conn.execute("SELECT name, value FROM attributes WHERE user_id = ?", (key,)))
+        macros = dict(conn.execute("SELECT name, expression FROM macros WHERE user_id = ?", (key,)))
+        return Profile(name, money, hp_atual, hp_max, inventory, attributes, macros=macros)
+
+    def __contains__(self, user_id):
+        return self.db.conn.execute("SELECT 1 FROM profiles WHERE user_id = ?", (int(user_id),)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def items(self):
+        rows = self.db.conn.execute("SELECT user_id, name, money, hp_atual, hp_max FROM profiles").fetchall()
+        for key, *row in rows:
+            yield key, self._build_profile(key, row)
+
+    def version(self, user_id):
+        """
+        Versão guardada no próprio banco (o momento da última alteração, em ns), para que um
+        processo perceba as alterações feitas pelos outros. None se o perfil não existe.
+        """
+        row = self.db.conn.execute("SELECT version FROM profiles WHERE user_id = ?", (int(user_id),)).fetchone()
+        return row[0] if row is not None else None
+
+    def inventory_items(self):
+        return self.db.conn.execute("SELECT user_id, item, quantity FROM inventory").fetchall()
+
+    def balances(self):
+        return self.db.conn.execute("SELECT user_id, money FROM profiles").fetchall()
+
+    def shared_version(self):
+        # O data_version só muda com commits de outras conexões, não com os desta.
+        return self.db.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _bump(self, key):
+        self.db.conn.execute("UPDATE profiles SET version = ? WHERE user_id = ?", (time.time_ns(), key))
+
+    def create(self, user_id, profile):
+        key = int(user_id)
+        with self.db.transaction():
+            conn = self.db.conn
+            conn.execute(
+                "INSERT OR REPLACE INTO profiles (user_id, name, money, hp_atual, hp_max, version) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, profile.name, profile.money, profile.hp_atual, profile.hp_max, time.time_ns()),
+            )
+            conn.execute("DELETE FROM inventory WHERE user_id = ?", (key,))
+            conn.execute("DELETE FROM attributes WHERE user_id = ?", (key,))
+            conn.execute("DELETE FROM macros WHERE user_id = ?", (key,))
+            conn.executemany("INSERT INTO inventory (user_id, item, quantity) VALUES (?, ?, ?)",
+                             [(key, item, qtd) for item, qtd in profile.inventory.items()])
+            conn.executemany("INSERT INTO attributes (user_id, name, value) VALUES (?, ?, ?)",
+                             [(key, name, value) for name, value in profile.attributes.items()])
+            conn.executemany("INSERT INTO macros (user_id, name, expression) VALUES (?, ?, ?)",
+                             [(key, name, expression) for name, expression in (profile.macros or {}).items()])
+
+    def delete(self, user_id):
+        key = int(user_id)
+        with self.db.transaction():
+            conn = self.db.conn
+            conn.execute("DELETE FROM profiles WHERE user_id = ?", (key,))
+            conn.execute("DELETE FROM inventory WHERE user_id = ?", (key,))
+            conn.execute("DELETE FROM attributes WHERE user_id = ?", (key,))
+            conn.execute("DELETE FROM macros WHERE user_id = ?", (key,))
+
+    def update(self, user_id, **fields):
+        for column in fields:
+            if column not in PROFILE_COLUMNS:
+                raise ValueError(f"Campo de perfil desconhecido: {column}")
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        self.db.conn.execute(f"UPDATE profiles SET {assignments}, version = ? WHERE user_id = ?",
+                             (*fields.values(), time.time_ns(), int(user_id)))
+
+    def set_item(self, user_id, item_name, quantity):
+        key = int(user_id)
+        with self.db.transaction():
+            if quantity > 0:
+                self.db.conn.execute(
+                    "INSERT INTO inventory (user_id, item, quantity) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id, item) DO UPDATE SET quantity = excluded.quantity",
+                    (key, item_name, quantity),
+                )
+            else:
+                self.db.conn.execute("DELETE FROM inventory WHERE user_id = ? AND item = ?", (key, item_name))
+            self._bump(key)
+
+    def set_attribute(self, user_id, attr_name, value):
+        key = int(user_id)
+        with self.db.transaction():
+            if value is not None:
+                self.db.conn.execute(
+                    "INSERT INTO attributes (user_id, name, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id, name) DO UPDATE SET value = excluded.value",
+                    (key, attr_name, value),
+                )
+            else:
+                self.db.conn.execute("DELETE FROM attributes WHERE user_id = ? AND name = ?", (key, attr_name))
+            self._bump(key)
+
+    def set_macro(self, user_id, macro_name, expression):
+        key = int(user_id)
+        with self.db.transaction():
+            if expression is not None:
+                self.db.conn.execute(
+                    "INSERT INTO macros (user_id, name, expression) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id, name) DO UPDATE SET expression = excluded.expression",
+                    (key, macro_name, expression),
+                )
+            else:
+                self.db.conn.execute("DELETE FROM macros WHERE user_id = ? AND name = ?", (key, macro_name))
+            self._bump(key)
+
+    def transaction(self):
+        return self.db.transaction()
+
+    async def close(self):
+        self.db.close()
+
+class SqliteInitiativeStore(InitiativeStore):
+    """Listas de iniciativa guardadas no SQLite, uma linha por participante."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, channel_id):
+        rows = self.db.conn.execute(
+            "SELECT entry_id, name, score, modifier, seq FROM initiative WHERE channel_id = ? ORDER BY seq",
+            (int(channel_id),),
+        )
+        return {entry_id: {"name": name, "score": score, "modifier": modifier, "seq": seq}
+                for entry_id, name, score, modifier, seq in rows}
+
+    def __len__(self):
+        return self.db.conn.execute("SELECT COUNT(DISTINCT channel_id) FROM initiative").fetchone()[0]
+
+    def items(self):
+        channels = {}
+        rows = self.db.conn.execute("SELECT channel_id, entry_id, name, score, modifier, seq FROM initiative ORDER BY seq")
+        for channel_id, entry_id, name, score, modifier, seq in rows:
+            channels.setdefault(str(channel_id), {})[entry_id] = {"name": name, "score": score, "modifier": modifier, "seq": seq}
+        return channels.items()
+
+    def get_turn(self, channel_id):
+        row = self.db.conn.execute("SELECT entry_id, round FROM initiative_turns WHERE channel_id = ?", (int(channel_id),)).fetchone()
+        return tuple(row) if row else (None, 0)
+
+    def set_entry(self, channel_id, entry_id, entry):
+        self.db.conn.execute(
+            "INSERT OR REPLACE INTO initiative (channel_id, entry_id, name, score, modifier, seq) VALUES (?, ?, ?, ?, ?, ?)",
+            (int(channel_id), entry_id, entry["name"], entry["score"], entry.get("modifier", 0), entry.get("seq", 0)),
+        )
+
+    def clear(self, channel_id):
+        with self.db.transaction():
+            self.db.conn.execute("DELETE FROM initiative WHERE channel_id = ?", (int(channel_id),))
+            self.db.conn.execute("DELETE FROM initiative_turns WHERE channel_id = ?", (int(channel_id),))
+
+    def set_turn(self, channel_id, entry_id, round_number):
+        self.db.conn.execute(
+            "INSERT INTO initiative_turns (channel_id, entry_id, round) VALUES (?, ?, ?) "
+            "ON CONFLICT (channel_id) DO UPDATE SET entry_id = excluded.entry_id, round = excluded.round",
+            (int(channel_id), entry_id, round_number),
+        )
+
+    def touch(self, channel_id, timestamp):
+        # A linha de turno guarda também o horário; o WHERE evita criá-la para um canal sem lista.
+        self.db.conn.execute(
+            "INSERT INTO initiative_turns (channel_id, touched) "
+            "SELECT ?1, ?2 WHERE EXISTS (SELECT 1 FROM initiative WHERE channel_id = ?1) "
+            "ON CONFLICT (channel_id) DO UPDATE SET touched = excluded.touched",
+            (int(channel_id), timestamp),
+        )
+
+    def touched(self, channel_id):
+        row = self.db.conn.execute("SELECT touched FROM initiative_turns WHERE channel_id = ?", (int(channel_id),)).fetchone()
+        return row[0] or None if row else None
+
+    def activity(self):
+        rows = self.db.conn.execute(
+            "SELECT DISTINCT i.channel_id, t.touched FROM initiative i LEFT JOIN initiative_turns t USING (channel_id)"
+        ).fetchall()
+        return [(str(channel_id), touched or None) for channel_id, touched in rows]
+
+    def transaction(self):
+        return self.db.transaction()
+
+    async def close(self):
+        self.db.close()
+
+def open_storage(backend):
+    """Abre os stores de perfis e de iniciativa do backend escolhido ("json", "sharded" ou "sqlite")."""
+    binary = config.get("snapshot_format", "json") == "binary"
+    if backend == "json":
+        return JsonUserStore(USER_DATA_FILE, binary=binary), JsonInitiativeStore(INITIATIVE_FILE, binary=binary)
+    if backend == "sharded":
+        cache_bytes = int(config.get("profile_cache_mb", PROFILE_CACHE_BYTES / 2**20) * 2**20)
+        return ShardedUserStore(PROFILES_DIR, cache_bytes=cache_bytes), JsonInitiativeStore(INITIATIVE_FILE, binary=binary)
+    if backend == "sqlite":
+        db = SqliteDatabase(SQLITE_FILE)
+        return SqliteUserStore(db), SqliteInitiativeStore(db)
+    raise ValueError(f"Backend de armazenamento desconhecido: {backend}")
+
+def migrate_json(backend):
+    """Copia database.json / initiative.json (com seus diários) para outro backend de armazenamento."""
+    json_users = JsonUserStore(USER_DATA_FILE)
+    json_initiative = JsonInitiativeStore(INITIATIVE_FILE)
+    users, initiative = open_storage(backend)
+    with users.transaction(), initiative.transaction():
+        for user_id, profile in json_users.items():
+            users.create(user_id, profile)
+        if not isinstance(initiative, JsonInitiativeStore):
+            for channel_id, entries in json_initiative.items():
+                for entry_id, entry in entries.items():
+                    initiative.set_entry(channel_id, entry_id, entry)
+                initiative.set_turn(channel_id, *json_initiative.get_turn(channel_id))
+    asyncio.run(close_storage(users, initiative))
+    print(f"✅ Migrados {len(json_users)} perfis e {len(json_initiative)} listas de iniciativa para o backend '{backend}'.")
+
+async def close_storage(*stores):
+    for store in stores:
+        await store.close()
+
+# ========================================================================================
+#                                   CONCORRÊNCIA
+# ========================================================================================
+
+class KeyedLocks:
+    """
+    Locks do asyncio divididos em listras por chave (ID de usuário ou de canal).
+
+    Comandos sobre a mesma chave rodam um de cada vez, do início ao fim; chaves diferentes só
+    esperam uma pela outra se caírem na mesma listra, o que com LOCK_STRIPES listras é raro.
+    O número de locks é fixo, então a memória não cresce com a quantidade de usuários.
+    """
+
+    def __init__(self, name, stripes=LOCK_STRIPES):
+        self.name = name
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.hot_keys = collections.Counter()  # chave -> tempo total esperado (s)
+
+    def _stripe(self, key):
+        return hash(key) % len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *keys):
+        """Segura os locks de uma ou mais chaves, sempre em ordem de listra para evitar deadlocks."""
+        stripes = sorted({self._stripe(key) for key in keys})
+        contended = any(self._locks[index].locked() for index in stripes)
+        start = time.perf_counter()
+        acquired = []
+        try:
+            for index in stripes:
+                await self._locks[index].acquire()
+                acquired.append(index)
+            self._record(keys, contended, time.perf_counter() - start)
+            yield
+        finally:
+            for index in reversed(acquired):
+                self._locks[index].release()
+
+    def _record(self, keys, contended, waited):
+        self.acquisitions += 1
+        if not contended:
+            return
+        self.contended += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        for key in keys:
+            self.hot_keys[key] += waited
+        if len(self.hot_keys) > LOCK_HOT_KEYS * 2:
+            self.hot_keys = collections.Counter(dict(self.hot_keys.most_common(LOCK_HOT_KEYS)))
+
+    def snapshot(self, top=5):
+        """Resumo da contenção: quantas aquisições esperaram, por quanto tempo e em quais chaves."""
+        return {
+            "name": self.name,
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "avg_wait_ms": self.total_wait / self.contended * 1000 if self.contended else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "hot_keys": [(key, waited * 1000) for key, waited in self.hot_keys.most_common(top)],
+        }
+
+user_locks = KeyedLocks("user")
+channel_locks = KeyedLocks("channel")
+
+async def edit_profile(user_id, change, *args):
+    """
+    Roda `change(*args)`, que lê o perfil, confere e altera, segurando o lock do usuário e dentro
+    de uma transação do store, e devolve a resposta que ela montou. A função é síncrona de
+    propósito: no SQLite a transação é um `BEGIN IMMEDIATE` que segura os outros processos (shards),
+    então nada pode ser aguardado com ela aberta e a mensagem só é enviada depois, por quem chamou.
+    """
+    async with user_locks.hold(user_id):
+        with user_store.transaction():
+            return change(*args)
+
+class BatchError(ValueError):
+    """Operação inválida dentro de um ProfileBatch; a mensagem é a resposta mostrada ao usuário."""
+
+class ProfileBatch:
+    """
+    Alterações em um ou mais perfis, feitas sobre cópias e gravadas juntas por `commit()`.
+
+    Cada operação lê as cópias, então enxerga o que as anteriores mudaram (`pd.gear -1 Corda, -1
+    Corda` confere o saldo duas vezes). Uma operação inválida levanta BatchError antes de qualquer
+    gravação, e o lote inteiro é descartado: ou tudo entra, ou nada. `commit()` grava só os campos,
+    itens, atributos e macros que mudaram e atualiza o índice de inventário, o ranking e o cache
+    de macros.
+    """
+
+    def __init__(self):
+        self._profiles = {}  # user_id -> cópia de trabalho do perfil
+        self._fields = collections.defaultdict(dict)
+        self._items = collections.defaultdict(dict)
+        self._attributes = collections.defaultdict(dict)
+        self._macros = collections.defaultdict(dict)
+
+    def profile(self, user_id, name=None):
+        """Cópia de trabalho do perfil. `name` é quem aparece no aviso de não registrado (None: o autor)."""
+        profile = self._profiles.get(user_id)
+        if profile is None:
+            stored = user_store.get(user_id)
+            if stored is None:
+                if name is None:
+                    raise BatchError("⚠️ Você não está registrado. Use `pd.register` primeiro.")
+                raise BatchError(f"⚠️ {name} não está registrado(a).")
+            profile = self._profiles[user_id] = stored.copy()
+        return profile
+
+    def update(self, user_id, **fields):
+        self._profiles[user_id].update(fields)
+        self._fields[user_id].update(fields)
+
+    def set_item(self, user_id, item_name, quantity):
+        self._profiles[user_id].set_item(item_name, quantity)
+        self._items[user_id][item_name] = quantity
+
+    def set_attribute(self, user_id, attr_name, value):
+        self._profiles[user_id].set_attribute(attr_name, value)
+        self._attributes[user_id][attr_name] = value
+
+    def set_macro(self, user_id, macro_name, expression):
+        self._profiles[user_id].set_macro(macro_name, expression)
+        self._macros[user_id][macro_name] = expression
+
+    def commit(self):
+        """Grava as alterações numa única transação (a de quem chamou, se já houver uma aberta)."""
+        with user_store.transaction():
+            for user_id in self._profiles:
+                if user_id in self._fields:
+                    user_store.update(user_id, **self._fields[user_id])
+                for item_name, quantity in self._items.get(user_id, {}).items():
+                    user_store.set_item(user_id, item_name, quantity)
+                for attr_name, value in self._attributes.get(user_id, {}).items():
+                    user_store.set_attribute(user_id, attr_name, value)
+                for macro_name, expression in self._macros.get(user_id, {}).items():
+                    user_store.set_macro(user_id, macro_name, expression)
+        for user_id, fields in self._fields.items():
+            if "money" in fields:
+                money_ranking.update(user_id, fields["money"])
+        for user_id, items in self._items.items():
+            for item_name in items:
+                inventory_index.item_changed(user_id, item_name)
+        for user_id, attributes in self._attributes.items():
+            for attr_name in attributes:
+                macro_cache.attribute_changed(user_id, attr_name)
+        for user_id, macros in self._macros.items():
+            for macro_name in macros:
+                macro_cache.macro_changed(user_id, macro_name)
+
+async def edit_profiles(user_ids, build, *args):
+    """
+    Como `edit_profile`, para alterações que passam por um ProfileBatch: `build(batch, *args)`
+    acumula as operações e devolve a resposta, e o lote é gravado de uma vez. Os locks de todos os
+    `user_ids` são tomados numa só aquisição (em ordem, sem risco de deadlock entre dois lotes), e
+    um BatchError descarta o lote e vira a resposta.
+    """
+    async with user_locks.hold(*user_ids):
+        with user_store.transaction():
+            batch = ProfileBatch()
+            try:
+                reply = build(batch, *args)
+            except BatchError as error:
+                return str(error)
+            batch.commit()
+            return reply
+
+# ========================================================================================
+#                               PROCESSAMENTO PARALELO
+# ========================================================================================
+
+def _init_worker():
+    """Os processos nascem por fork com o mesmo estado do sorteio do pai: cada um ganha sementes novas."""
+    global _numpy_rng
+    random.seed()
+    if np is not None:
+        _numpy_rng = np.random.default_rng()
+
+class WorkerPool:
+    """
+    Pool de processos para rolagens e estatísticas pesadas, que assim não travam o event loop.
+
+    Os processos são criados por fork em `start()`, antes de o bot conectar (enquanto o processo
+    ainda tem uma única thread), e herdam o motor de dados já carregado. Onde não há fork, ou com
+    "worker_processes": 0, o trabalho pesado vai para uma thread. Se um processo morrer, o pool não
+    é recriado com o bot rodando (seria um fork do processo já com várias threads, bloqueando o
+    loop): ele é marcado como quebrado e as rolagens pesadas vão para threads até o bot reiniciar.
+
+    Cada usuário pode ter no máximo MAX_OFFLOADED_PER_USER tarefas no pool ao mesmo tempo, e uma
+    tarefa que passa de OFFLOAD_TIMEOUT segundos é dada como perdida (o processo termina o
+    trabalho, mas o resultado é descartado).
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.size = 0
+        self.broken = False
+        self._running = collections.Counter()
+        self.offloaded = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def start(self, size):
+        if size <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+            return
+        self.executor = ProcessPoolExecutor(size, mp_context=multiprocessing.get_context("fork"), initializer=_init_worker)
+        # Com fork, o executor cria todos os processos na primeira tarefa: força isso agora.
+        self.executor.submit(int).result()
+        self.size = size
+
+    async def run(self, user_id, function, *args):
+        """Executa `function(*args)` fora do loop. Erros de limite chegam como DiceError."""
+        if self._running[user_id] >= MAX_OFFLOADED_PER_USER:
+            self.rejected += 1
+            raise DiceError("⏳ Você já tem rolagens pesadas em andamento. Espere uma delas terminar.")
+        self._running[user_id] += 1
+        self.offloaded += 1
+        try:
+            if self.executor is None:
+                future = asyncio.to_thread(function, *args)
+            else:
+                future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            return await asyncio.wait_for(future, OFFLOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise DiceError("⌛ A rolagem demorou demais e foi cancelada.") from None
+        except BrokenProcessPool:
+            # Um processo morreu (ex: falta de memória): as próximas rolagens vão para threads.
+            self._mark_broken()
+            raise DiceError("❌ Não foi possível completar a rolagem. Tente de novo.") from None
+        finally:
+            self._running[user_id] -= 1
+            if not self._running[user_id]:
+                del self._running[user_id]
+
+    def _mark_broken(self):
+        if self.executor is None:
+            return  # outra rolagem já tratou a quebra
+        print("⚠️ Um processo do pool de rolagens morreu; rolagens pesadas vão para threads até o bot reiniciar.")
+        self.shutdown()
+        self.size = 0
+        self.broken = True
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+worker_pool = WorkerPool()
+
+# ========================================================================================
+#                                 ENVIO DE MENSAGENS
+# ========================================================================================
+
+def split_message(text, limit=MESSAGE_LIMIT, separators=("\n\n", "\n", " ")):
+    """
+    Divide um texto em páginas de até `limit` caracteres. O corte é feito de preferência entre
+    rolagens (linha em branco), depois entre linhas e depois entre palavras; só um trecho sem
+    nenhum desses separadores é cortado no meio.
+    """
+    if len(text) <= limit:
+        return [text]
+    if not separators:
+        return [text[start:start + limit] for start in range(0, len(text), limit)]
+    separator, finer = separators[0], separators[1:]
+    pages, current = [], ""
+    for block in text.split(separator):
+        for piece in split_message(block, limit, finer):
+            candidate = f"{current}{separator}{piece}" if current else piece
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                pages.append(current)
+                current = piece
+    if current:
+        pages.append(current)
+    return pages
+
+class TokenBucket:
+    """Limitador de taxa: permite rajadas de até `capacity` envios e depois `rate` por segundo."""
+
+    def __init__(self, rate=SEND_RATE, capacity=SEND_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self):
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+    def time_to_full(self):
+        self._refill()
+        return (self.capacity - self.tokens) / self.rate
+
+class _OutboxLane:
+    """Fila de mensagens de um destino (canal ou DM), com seu próprio limitador."""
+
+    def __init__(self, destination, bucket):
+        self.destination = destination
+        self.queue = collections.deque()  # (texto, arquivo ou None)
+        self.bucket = bucket
+        self.space = asyncio.Event()
+        self.task = None
+
+class Outbox:
+    """
+    Entrega de mensagens com fila por destino.
+
+    Textos longos são divididos em páginas de até 2000 caracteres, ou vão como anexo quando
+    passariam de MAX_MESSAGE_PAGES páginas. Cada destino tem uma fila consumida por uma tarefa
+    própria, que respeita um token bucket: numa rajada de comandos, as mensagens esperam a vez em
+    vez de esbarrar no limite do Discord (erro 429), e as que se acumulam na fila são juntadas numa
+    só mensagem sempre que couberem. Destinos diferentes não esperam uns pelos outros.
+    """
+
+    def __init__(self, rate=SEND_RATE, burst=SEND_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._lanes = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.attachments = 0
+        self.failed = 0
+
+    async def send(self, destination, text, filename="resultado.txt"):
+        """Coloca um texto na fila do destino. Só espera se a fila estiver cheia."""
+        pages = split_message(text)
+        if len(pages) > MAX_MESSAGE_PAGES:
+            header = text.split("\n", 1)[0][:MESSAGE_LIMIT - 100]
+            attachment = discord.File(io.BytesIO(text.encode("utf-8")), filename=filename)
+            self.attachments += 1
+            items = [(f"{header}\n📎 O resultado é longo demais para o chat e foi enviado em anexo.", attachment)]
+        else:
+            items = [(page, None) for page in pages]
+
+        lane = self._lanes.get(destination.id)
+        if lane is None:
+            lane = self._lanes[destination.id] = _OutboxLane(destination, TokenBucket(self.rate, self.burst))
+        for item in items:
+            while len(lane.queue) >= MAX_QUEUED_MESSAGES:
+                lane.space.clear()
+                await lane.space.wait()
+            lane.queue.append(item)
+        if lane.task is None:
+            lane.task = asyncio.create_task(self._run(destination.id, lane))
+
+    def _next_message(self, lane):
+        """Tira a próxima mensagem da fila, juntando a ela os textos seguintes que couberem."""
+        content, attachment = lane.queue.popleft()
+        while attachment is None and lane.queue and lane.queue[0][1] is None:
+            merged = f"{content}\n\n{lane.queue[0][0]}"
+            if len(merged) > MESSAGE_LIMIT:
+                break
+            content = merged
+            lane.queue.popleft()
+            self.coalesced += 1
+        lane.space.set()
+        return content, attachment
+
+    async def _run(self, key, lane):
+        try:
+            while True:
+                while lane.queue:
+                    await lane.bucket.take()
+                    content, attachment = self._next_message(lane)
+                    try:
+                        if attachment is None:
+                            await lane.destination.send(content)
+                        else:
+                            await lane.destination.send(content, file=attachment)
+                        self.sent += 1
+                    except discord.HTTPException as error:
+                        # Inclui discord.Forbidden (DM fechada): a falha não é anunciada no chat,
+                        # para não expor, por exemplo, que uma rolagem secreta não chegou.
+                        self.failed += 1
+                        print(f"ERRO: Não foi possível enviar mensagem para {lane.destination}: {error}")
+                # A fila só é descartada com o limitador cheio, para que um destino que acabou de
+                # receber uma rajada não ganhe uma nova cota ao ser recriado.
+                await asyncio.sleep(lane.bucket.time_to_full())
+                if not lane.queue:
+                    break
+        finally:
+            lane.task = None
+            if not lane.queue and self._lanes.get(key) is lane:
+                del self._lanes[key]
+
+    async def close(self, timeout=OUTBOX_CLOSE_TIMEOUT):
+        """Espera as filas esvaziarem (por até `timeout` segundos) e cancela o que sobrar."""
+        tasks = [lane.task for lane in self._lanes.values() if lane.task is not None]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+outbox = Outbox()
+
+# ========================================================================================
+#                                 CARREGAMENTO DE DADOS
+# ========================================================================================
+
+config = load_data(CONFIG_FILE)
+user_store, initiative_store = open_storage(config.get("storage", "json"))
+
+# ========================================================================================
+#                                   CACHE DE EMBEDS
+# ========================================================================================
+
+class EmbedCache:
+    """
+    Embeds de perfil já montados, indexados por (usuário, tela, versão do perfil, apelido).
+
+    Como a versão do perfil muda a cada alteração, uma entrada nunca fica desatualizada: as
+    versões antigas apenas deixam de ser pedidas e saem pelo LRU quando o cache enche.
+    """
+
+    def __init__(self, max_size=EMBED_CACHE_SIZE):
+        self.max_size = max_size
+        self._embeds = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        embed = self._embeds.get(key)
+        if embed is None:
+            self.misses += 1
+            return None
+        self._embeds.move_to_end(key)
+        self.hits += 1
+        return embed
+
+    def put(self, key, embed):
+        self._embeds[key] = embed
+        self._embeds.move_to_end(key)
+        while len(self._embeds) > self.max_size:
+            self._embeds.popitem(last=False)
+
+embed_cache = EmbedCache()
+
+def profile_embed(member, view, render):
+    """
+    Devolve o embed `view` do perfil de `member`, montando-o com `render(member, profile)` só
+    quando o perfil mudou desde a última exibição. Retorna None se o membro não estiver registrado.
+    """
+    user_id = member.id
+    key = (user_id, view, user_store.version(user_id), member.display_name)
+    embed = embed_cache.get(key)
+    if embed is None:
+        profile = user_store.get(user_id)
+        if profile is None:
+            return None
+        embed = render(member, profile)
+        embed_cache.put(key, embed)
+    return embed
+
+# ========================================================================================
+#                               ÍNDICE DE INVENTÁRIO
+# ========================================================================================
+
+@functools.lru_cache(maxsize=4096)
+def canonical_item(item_name):
+    """Chave de comparação de um item: sem acentos, sem diferença de maiúsculas e de espaços."""
+    decomposed = unicodedata.normalize("NFKD", item_name)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+class ItemTrie:
+    """
+    Árvore de prefixos das chaves canônicas dos itens. Cada nó é um dicionário letra -> nó; a
+    chave completa fica guardada em `""` no nó onde termina.
+
+    Serve para completar um começo de nome e para achar nomes parecidos: a busca com erros
+    calcula a distância de edição (Levenshtein) uma linha por nó, descendo só pelos ramos que
+    ainda podem ficar dentro do limite, sem comparar a palavra com cada item conhecido.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, key):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = key
+
+    def remove(self, key):
+        path = [self.root]
+        for char in key:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].pop("", None)
+        # Apaga os nós que ficaram vazios, de baixo para cima.
+        for char, parent in zip(reversed(key), reversed(path[:-1])):
+            if parent[char]:
+                break
+            del parent[char]
+
+    def with_prefix(self, prefix, limit):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            if "" in node:
+                found.append(node[""])
+            stack.extend(child for char, child in node.items() if char)
+        return sorted(found)
+
+    def similar(self, word, max_distance, limit):
+        """Chaves a até `max_distance` edições de `word`, das mais próximas para as mais distantes."""
+        found = []
+        first_row = list(range(len(word) + 1))
+        stack = [(self.root, first_row)]
+        while stack:
+            node, previous = stack.pop()
+            for char, child in node.items():
+                if not char:
+                    continue
+                row = [previous[0] + 1]
+                for column in range(1, len(word) + 1):
+                    cost = 0 if word[column - 1] == char else 1
+                    row.append(min(row[column - 1] + 1, previous[column] + 1, previous[column - 1] + cost))
+                if "" in child and row[-1] <= max_distance:
+                    found.append((row[-1], child[""]))
+                if min(row) <= max_distance:
+                    stack.append((child, row))
+        return [key for _, key in sorted(found)[:limit]]
+
+class InventoryIndex:
+    """
+    Índice invertido item -> portadores, para responder "quem tem corda?" sem ler todos os perfis.
+
+    É montado por `build_indexes()` antes de o bot conectar (ou no primeiro uso, em scripts) e,
+    depois disso, atualizado a cada alteração de inventário (`item_changed`/`user_removed`). Os
+    itens são agrupados pela chave canônica, então "Poção", "pocao" e "POÇÃO" são o mesmo item; o
+    nome mostrado é o primeiro que o índice viu. No SQLite com vários processos, o índice é
+    remontado quando outro processo gravou no banco, no máximo a cada INVENTORY_REFRESH_INTERVAL
+    segundos.
+    """
+
+    def __init__(self):
+        self.holders = None  # chave -> {user_id: quantidade}; None até ser montado
+        self.names = {}      # chave -> nome para exibição
+        self.trie = ItemTrie()
+        self._shared_version = None
+        self._built_at = 0.0
+
+    def _ensure(self):
+        if self.holders is None:
+            return self.rebuild()
+        # Qualquer commit de outro processo (até numa lista de iniciativa) muda a versão: sem o
+        # intervalo mínimo, cada consulta depois de uma escrita alheia remontaria o índice inteiro.
+        shared_version = user_store.shared_version()
+        if shared_version != self._shared_version and time.monotonic() - self._built_at >= INVENTORY_REFRESH_INTERVAL:
+            self.rebuild()
+
+    def rebuild(self):
+        self._shared_version = user_store.shared_version()
+        self._built_at = time.monotonic()
+        self.holders, self.names, self.trie = {}, {}, ItemTrie()
+        for user_id, item_name, quantity in user_store.inventory_items():
+            self._add(canonical_item(item_name), item_name, user_id, quantity)
+        metrics.count("inventory_index_rebuilds")
+
+    def _add(self, key, item_name, user_id, quantity):
+        holders = self.holders.get(key)
+        if holders is None:
+            holders = self.holders[key] = {}
+            self.names[key] = item_name
+            self.trie.add(key)
+        holders[user_id] = holders.get(user_id, 0) + quantity
+
+    def _discard(self, key, user_id):
+        holders = self.holders.get(key)
+        if holders is None:
+            return
+        holders.pop(user_id, None)
+        if not holders:
+            del self.holders[key], self.names[key]
+            self.trie.remove(key)
+
+    def item_changed(self, user_id, item_name):
+        """Atualiza o índice depois que o store alterou um item do usuário."""
+        if self.holders is None:
+            return  # Ainda não montado: quando for, lerá o estado atual.
+        key = canonical_item(item_name)
+        self._discard(key, user_id)
+        profile = user_store.get(user_id)
+        # Um inventário antigo pode ter o mesmo item com grafias diferentes: soma todas.
+        for name, quantity in profile.inventory.items():
+            if canonical_item(name) == key:
+                self._add(key, name, user_id, quantity)
+
+    def user_removed(self, user_id, inventory):
+        if self.holders is None:
+            return
+        for item_name in inventory:
+            self._discard(canonical_item(item_name), user_id)
+
+    def find(self, item_name):
+        """Retorna (nome, {user_id: quantidade}) do item, ou None se ninguém o tem."""
+        self._ensure()
+        key = canonical_item(item_name)
+        if key not in self.holders:
+            return None
+        return self.names[key], self.holders[key]
+
+    def suggest(self, item_name, limit=ITEM_SUGGESTIONS):
+        """Nomes que começam com o texto dado ou que diferem dele por poucas letras."""
+        self._ensure()
+        key = canonical_item(item_name)
+        keys = self.trie.with_prefix(key, limit) if key else []
+        for similar in self.trie.similar(key, ITEM_MAX_TYPOS, limit):
+            if len(keys) >= limit:
+                break
+            if similar not in keys:
+                keys.append(similar)
+        return [self.names[key] for key in keys]
+
+inventory_index = InventoryIndex()
+
+# ========================================================================================
+#                                       RANKING
+# ========================================================================================
+
+class _SortedKeys:
+    """
+    Lista ordenada com a parte da interface de `SortedList` usada pelo ranking, para quando o
+    sortedcontainers (opcional) não está instalado.
+
+    As chaves ficam em blocos ordenados de até 2 * RANKING_BLOCK_SIZE, como no SortedList: o
+    bloco certo é achado por bisect nos maiores valores de cada bloco, e inserir ou remover só
+    desloca aquele bloco. Assim `add`/`remove` custam O(log n + RANKING_BLOCK_SIZE), e
+    `bisect_left` e as fatias custam O(log n + n / RANKING_BLOCK_SIZE), em vez de O(n).
+    """
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._blocks = [keys[i:i + RANKING_BLOCK_SIZE] for i in range(0, len(keys), RANKING_BLOCK_SIZE)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(keys)
+
+    def add(self, key):
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+        else:
+            index = min(bisect.bisect_left(self._maxes, key), len(self._blocks) - 1)
+            block = self._blocks[index]
+            bisect.insort(block, key)
+            self._maxes[index] = block[-1]
+            if len(block) > 2 * RANKING_BLOCK_SIZE:
+                self._blocks[index:index + 1] = [block[:RANKING_BLOCK_SIZE], block[RANKING_BLOCK_SIZE:]]
+                self._maxes[index:index + 1] = [block[RANKING_BLOCK_SIZE - 1], block[-1]]
+        self._len += 1
+
+    def remove(self, key):
+        index = bisect.bisect_left(self._maxes, key)
+        block = self._blocks[index]
+        del block[bisect.bisect_left(block, key)]
+        if block:
+            self._maxes[index] = block[-1]
+        else:
+            del self._blocks[index]
+            del self._maxes[index]
+        self._len -= 1
+
+    def bisect_left(self, key):
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._blocks):
+            return self._len
+        return sum(map(len, self._blocks[:index])) + bisect.bisect_left(self._blocks[index], key)
+
+    def __getitem__(self, index):
+        """Só fatias (`keys[a:b]`), que é como o pd.leaderboard lê uma página."""
+        start, stop, _ = index.indices(self._len)
+        keys = []
+        for block in self._blocks:
+            if stop <= 0:
+                break
+            if start < len(block):
+                keys.extend(block[max(start, 0):stop])
+            start -= len(block)
+            stop -= len(block)
+        return keys
+
+    def __len__(self):
+        return self._len
+
+class MoneyRanking:
+    """
+    Ranking de saldos, mantido ordenado por (-dinheiro, user_id): a posição de um jogador e
+    uma página do pd.leaderboard saem de uma busca binária e de uma fatia, sem ordenar todos os
+    perfis a cada consulta.
+
+    É montado por `build_indexes()` antes de o bot conectar (ou no primeiro uso, em scripts) e
+    atualizado a cada alteração de saldo (`update`/`remove`). Com vários processos no mesmo SQLite, as alterações feitas pelos outros
+    só entram quando o ranking é remontado, no máximo a cada RANKING_REFRESH_INTERVAL segundos.
+    """
+
+    def __init__(self):
+        self.keys = None     # (-dinheiro, user_id), em ordem; None até ser montado
+        self.balances = {}   # user_id -> dinheiro, para achar a chave antiga ao atualizar
+        self._shared_version = None
+        self._built_at = 0.0
+
+    def _ensure(self):
+        if self.keys is None:
+            return self.rebuild()
+        shared_version = user_store.shared_version()
+        if shared_version != self._shared_version and time.monotonic() - self._built_at >= RANKING_REFRESH_INTERVAL:
+            self.rebuild()
+
+    def rebuild(self):
+        self._shared_version = user_store.shared_version()
+        self._built_at = time.monotonic()
+        self.balances = dict(user_store.balances())
+        keys = [(-money, user_id) for user_id, money in self.balances.items()]
+        self.keys = SortedList(keys) if SortedList is not None else _SortedKeys(keys)
+        metrics.count("ranking_rebuilds")
+
+    def update(self, user_id, money):
+        """Registra o novo saldo de um jogador (ou um jogador novo)."""
+        if self.keys is None:
+            return  # Ainda não montado: quando for, lerá o estado atual.
+        old = self.balances.get(user_id)
+        if old == money:
+            return
+        if old is not None:
+            self.keys.remove((-old, user_id))
+        self.keys.add((-money, user_id))
+        self.balances[user_id] = money
+
+    def remove(self, user_id):
+        if self.keys is None:
+            return
+        old = self.balances.pop(user_id, None)
+        if old is not None:
+            self.keys.remove((-old, user_id))
+
+    def rank(self, user_id):
+        """Retorna (posição começando em 1, total de jogadores), ou None se não estiver registrado."""
+        self._ensure()
+        money = self.balances.get(user_id)
+        if money is None:
+            return None
+        return self.keys.bisect_left((-money, user_id)) + 1, len(self.keys)
+
+    def page(self, number, size=LEADERBOARD_PAGE_SIZE):
+        """Jogadores da página `number` (começando em 1) como [(posição, user_id, dinheiro)]."""
+        self._ensure()
+        start = (number - 1) * size
+        return [(start + offset + 1, user_id, -negative_money)
+                for offset, (negative_money, user_id) in enumerate(self.keys[start:start + size])]
+
+    def __len__(self):
+        self._ensure()
+        return len(self.keys)
+
+money_ranking = MoneyRanking()
+
+# ========================================================================================
+#                                  MACROS DE ROLAGEM
+# ========================================================================================
+
+_MACRO_NAME_RE = re.compile(r"[a-z0-9_]{1,32}")
+_MACRO_TERM_RE = re.compile(r"([+-])([^+-]+)")
+_ATTRIBUTE_NAME_RE = re.compile(r"[a-z_]+")
+
+MacroTemplate = collections.namedtuple("MacroTemplate", "dice refs")
+
+@functools.lru_cache(maxsize=DICE_CACHE_SIZE)
+def parse_macro(text):
+    """
+    Separa uma macro em dados e atributos: `1d20+for+2` vira a expressão `+1d20+2` e os atributos
+    citados com o sinal de cada um, `(("for", 1),)`. Todo termo só com letras e `_` que não seja um
+    dado é um atributo. Levanta DiceError se o que sobra não for uma expressão de dados válida.
+    """
+    text = text.replace(" ", "").lower()
+    prefix = ""
+    match = _DICE_COUNT_RE.match(text)
+    if match:
+        prefix, text = match.group(0), text[match.end():]
+    if not text.startswith(("+", "-")):
+        text = "+" + text
+
+    dice = []
+    refs = []
+    pos = 0
+    for match in _MACRO_TERM_RE.finditer(text):
+        if match.start() != pos:
+            raise DiceError("❌ Formato inválido.")
+        pos = match.end()
+        sign, body = match.groups()
+        if _ATTRIBUTE_NAME_RE.fullmatch(body) and not _DICE_TERM_RE.fullmatch(match.group(0)):
+            refs.append((body, -1 if sign == "-" else 1))
+        else:
+            dice.append(match.group(0))
+    if pos != len(text):
+        raise DiceError("❌ Formato inválido.")
+
+    template = MacroTemplate(prefix + "".join(dice), tuple(refs))
+    compile_dice(template.dice)
+    return template
+
+def compile_macro(text, attributes):
+    """
+    Compila uma macro com os atributos de um jogador: a DiceExpression devolvida já tem os
+    atributos somados ao modificador. Levanta DiceError se faltar algum atributo citado.
+    """
+    template = parse_macro(text)
+    expression = compile_dice(template.dice)
+    bonus = 0
+    for attr_name, sign in template.refs:
+        value = attributes.get(attr_name)
+        if value is None:
+            raise DiceError(f"❌ A macro usa `{attr_name.upper()}`, que não está na sua ficha. "
+                            f"Use `pd.attribute_push {attr_name}=<valor>`.")
+        bonus += sign * value
+    return DiceExpression(expression.count, expression.terms, expression.modifier + bonus)
+
+CompiledMacro = collections.namedtuple("CompiledMacro", "text refs values expression version")
+
+class MacroCache:
+    """
+    Macros já compiladas com os atributos de cada jogador, para que `pd.m` só precise rolar.
+
+    Uma entrada sai do cache apenas quando muda a própria macro ou um atributo que ela cita:
+    `attribute_changed` acha as macros afetadas pelo índice inverso (jogador, atributo) -> macros,
+    e mexer em HP, itens ou atributos que nenhuma macro usa não custa nada. As alterações de outros
+    processos (shards no SQLite) não passam por aqui; nesses backends cada entrada guarda a versão
+    do perfil e, quando ela muda, os valores citados são conferidos e a macro só é recompilada se
+    algum deles (ou o texto) mudou.
+    """
+
+    def __init__(self, max_size=MACRO_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()  # (user_id, macro) -> CompiledMacro
+        self._readers = {}  # (user_id, atributo) -> nomes das macros em cache que o citam
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id, macro_name):
+        """
+        DiceExpression pronta da macro, ou None se o jogador não tem essa macro.
+        Levanta DiceError se a macro cita um atributo que o jogador não tem.
+        """
+        key = (user_id, macro_name)
+        entry = self._entries.get(key)
+        if entry is not None and (entry.version is None or entry.version == user_store.version(user_id)):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.expression
+
+        self.misses += 1
+        self._drop(key)
+        profile = user_store.get(user_id)
+        text = profile.macros.get(macro_name) if profile is not None and profile.macros else None
+        if text is None:
+            return None
+        template = parse_macro(text)
+        values = tuple(profile.attributes.get(attr_name) for attr_name, _ in template.refs)
+        if entry is not None and entry.text == text and entry.values == values:
+            expression = entry.expression  # outro processo mexeu no perfil, mas não no que a macro usa
+        else:
+            expression = compile_macro(text, profile.attributes)
+        version = user_store.version(user_id) if user_store.shared_version() is not None else None
+        self._put(key, CompiledMacro(text, template.refs, values, expression, version))
+        return expression
+
+    def _put(self, key, entry):
+        user_id, macro_name = key
+        self._entries[key] = entry
+        for attr_name, _ in entry.refs:
+            self._readers.setdefault((user_id, attr_name), set()).add(macro_name)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
 
-def save_data(data, file_path):
-    """Salva dados em um arquivo JSON com formatação."""
-    with open(file_path, "w", encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id, macro_name = key
+        for attr_name, _ in entry.refs:
+            readers = self._readers.get((user_id, attr_name))
+            if readers is not None:
+                readers.discard(macro_name)
+                if not readers:
+                    del self._readers[(user_id, attr_name)]
 
-def process_roll(roll_input: str):
-    pattern = r"(\d+#)?(\d*)d(\d+)([+-]\d+)?"
-    match = re.fullmatch(pattern, roll_input.replace(" ", ""))
-    if not match: return "error", "❌ Formato inválido.", None
-    
-    count_str, num_dice_str, dice_sides_str, modifier_str = match.groups()
-    count = int(count_str[:-1]) if count_str else 1
-    num_dice = int(num_dice_str) if num_dice_str else 1
-    dice_sides = int(dice_sides_str)
-    modifier = int(modifier_str) if modifier_str else 0
-    
-    if count > 1: return "error", "❌ O comando de iniciativa só suporta uma rolagem por vez (ex: 1d20+3).", None
+    def attribute_changed(self, user_id, attr_name):
+        for macro_name in tuple(self._readers.get((user_id, attr_name), ())):
+            self._drop((user_id, macro_name))
 
-    rolls = [random.randint(1, dice_sides) for _ in range(num_dice)]
-    soma_dados = sum(rolls)
-    total_final = soma_dados + modifier
-    
-    mod_string = f"{modifier:+}" if modifier != 0 else ""
-    formula_str = f"{num_dice}d{dice_sides}{mod_string}"
-    rolls_str = " ".join(f"`{r}`" for r in rolls)
-    texto_resposta = f"**Comando:** `{formula_str}`\n🎲 **Dados:** {rolls_str} (Soma: `{soma_dados}`)\n"
-    if modifier != 0: texto_resposta += f"**⚙️ Modificador:** `{modifier:+}`\n"
-    texto_resposta += f"**📊 Total:** **{total_final}**"
-    
-    return "success", texto_resposta, total_final
+    def macro_changed(self, user_id, macro_name):
+        self._drop((user_id, macro_name))
 
-# ========================================================================================
-#                                 CARREGAMENTO DE DADOS
-# ========================================================================================
+    def user_removed(self, user_id):
+        for key in [key for key in self._entries if key[0] == user_id]:
+            self._drop(key)
 
-user_data = load_data(USER_DATA_FILE)
-initiative_data = load_data(INITIATIVE_FILE)
+macro_cache = MacroCache()
 
 # ========================================================================================
 #                                   EVENTOS DO BOT
@@ -84,17 +2895,29 @@ async def on_ready():
     """Evento executado quando o bot está online e pronto."""
     print("----------------------------------------")
     print(f"🤖 Bot conectado como {bot.user}!")
-    print(f"📊 {len(user_data)} perfis de usuários carregados.")
-    print(f"⚔️ {len(initiative_data)} listas de iniciativa carregadas.")
+    print(f"📊 {len(user_store)} perfis de usuários carregados.")
+    print(f"⚔️ {len(initiative_store)} listas de iniciativa carregadas.")
     print("----------------------------------------")
 
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_metrics(ctx):
+    """Registra a latência de cada comando e põe no log os que passarem de "slow_command_ms"."""
+    elapsed = time.perf_counter() - ctx.started_at
+    metrics.observe_command(ctx.command.qualified_name, elapsed)
+    if elapsed * 1000 >= config.get("slow_command_ms", SLOW_COMMAND_MS):
+        metrics.count("slow_commands")
+        print(f"🐢 Comando lento ({elapsed * 1000:.0f} ms) de {ctx.author} em #{ctx.channel}: {ctx.message.content!r}")
+
 # ========================================================================================
 #                              COMANDOS: GESTÃO E AJUDA
 # ========================================================================================
 
-@bot.command(name="help")
-async def help_command(ctx):
-    """Mostra esta mensagem de ajuda."""
+def build_help_embed():
+    """Monta o embed de ajuda. Ele não muda, então é criado uma vez só, ao iniciar o bot."""
     embed = discord.Embed(
         title="🤖 Comandos do pd.BOT",
         description="Aqui está a lista de todos os comandos disponíveis.",
@@ -108,37 +2931,55 @@ async def help_command(ctx):
               "`pd.attribute_push <attr=valor>` - Adiciona/atualiza atributos.\n"
               "`pd.attribute_remove <attr>` - Remove atributos.\n"
               "`pd.gear` - Mostra seu inventário.\n"
-              "`pd.gear +/-<qtd> <item>` - Adiciona/remove itens.\n"
+              "`pd.gear +/-<qtd> <item>, +/-<qtd> <item>` - Adiciona/remove um ou vários itens (cada um com sinal).\n"
+              "`pd.gear_find <item>` - Mostra quem tem um item.\n"
+              "`pd.party_gear [@membros]` - Soma os inventários do grupo.\n"
               "`pd.hp` - Mostra sua vida atual.\n"
-              "`pd.hp +/-<valor>` - Cura ou causa dano.\n"
-              "`pd.hp set <valor>` - Define sua vida máxima.",
+              "`pd.hp +/-<valor> [@jogadores]` - Cura ou causa dano (em outros, só o mestre).\n"
+              "`pd.hp set <valor>` - Define sua vida máxima.\n"
+              "`pd.batch` - Várias alterações de uma vez, uma por linha (`hp`, `gear`, `add_money`...).",
         inline=False
     )
     embed.add_field(
         name="💰 Finanças",
         value="`pd.money [@usuario]` - Mostra seu saldo ou de outra pessoa.\n"
               "`pd.add_money <valor>` - Adiciona dinheiro à sua conta.\n"
-              "`pd.pop_money <valor>` - Remove dinheiro da sua conta.",
+              "`pd.pop_money <valor>` - Remove dinheiro da sua conta.\n"
+              "`pd.rank [@usuario]` - Mostra a posição no ranking de moedas.\n"
+              "`pd.leaderboard [página]` - Mostra quem tem mais moedas.",
         inline=False
     )
     embed.add_field(
         name="⚔️ Ações e Combate",
         value="`pd.roll <dado>` - Rola um ou mais dados (ex: `pd.roll 2#d20+3`).\n"
+              "↳ Também aceita `2d6+1d4+3`, `4d6kh3` (mantém os 3 maiores), `3d6!` (explosivos) e `d20adv`/`d20dis`.\n"
               "`pd.sroll <dado>` - Faz uma rolagem secreta para você.\n"
+              "`pd.roll_stats <dado> [>= alvo]` - Mostra as chances exatas de uma rolagem.\n"
+              "`pd.macro set <nome> <rolagem>` - Salva uma rolagem com atributos (ex: `1d20+for+2`).\n"
+              "`pd.m <nome>` - Rola uma macro salva (`pd.macro` lista, `pd.macro remove` apaga).\n"
               "`pd.init <rolagem>` - Rola e entra na lista de iniciativa.\n"
+              "`pd.init_npc <nome> [xN] <rolagem>, ...` - Coloca vários NPCs na iniciativa.\n"
               "`pd.init_list` - Mostra a ordem de iniciativa.\n"
+              "`pd.init_next` / `pd.init_prev` - Avança ou volta o turno.\n"
               "`pd.init_clear` - Limpa a lista de iniciativa.",
         inline=False
     )
     embed.set_footer(text=f"Use o prefixo 'pd.' antes de cada comando.")
-    await ctx.send(embed=embed)
+    return embed
+
+HELP_EMBED = build_help_embed()
+
+@bot.command(name="help")
+async def help_command(ctx):
+    """Mostra esta mensagem de ajuda."""
+    await ctx.send(embed=HELP_EMBED)
 
 @bot.command(name="register")
 async def register(ctx, action: str = None):
     """Registra você ou remove seu perfil do bot."""
-    user_id = str(ctx.author.id)
+    user_id = ctx.author.id
     if action and action.lower() == 'remover':
-        if user_id not in user_data:
+        if user_id not in user_store:
             return await ctx.send("🤔 Você não está registrado, então não há nada para remover.")
         
         await ctx.send(f"⚠️ **Atenção, {ctx.author.mention}!** Esta ação é **irreversível**.\nDigite `sim` para confirmar.")
@@ -146,177 +2987,321 @@ async def register(ctx, action: str = None):
             return message.author == ctx.author and message.channel == ctx.channel
         try:
             confirmation_msg = await bot.wait_for('message', timeout=30.0, check=check)
-            if confirmation_msg.content.lower() == 'sim':
-                del user_data[user_id]
-                save_data(user_data, USER_DATA_FILE) 
-                await ctx.send("✅ Seus dados foram removidos com sucesso.")
-            else:
-                await ctx.send("❌ Remoção cancelada.")
         except asyncio.TimeoutError:
-            await ctx.send("⏰ Tempo esgotado. A remoção foi cancelada.")
-        return
+            return await ctx.send("⏰ Tempo esgotado. A remoção foi cancelada.")
+        if confirmation_msg.content.lower() != 'sim':
+            return await ctx.send("❌ Remoção cancelada.")
+        # A confirmação é esperada fora do lock, para não travar os outros comandos do usuário
+        # por até 30 segundos; por isso o perfil é conferido de novo antes de apagar.
+        return await ctx.send(await edit_profile(user_id, _delete_profile, user_id))
 
-    if user_id in user_data:
-        await ctx.send("✅ Você já está registrado!")
-    else:
-        user_data[user_id] = {"name": ctx.author.name, "money": 0, "inventory": {}, "hp_atual": 10, "hp_max": 10, "attributes": {}}
-        save_data(user_data, USER_DATA_FILE) # Passando o caminho do arquivo
-        await ctx.send(f"🎉 Bem-vindo, {ctx.author.mention}! Você foi registrado. Use `pd.hp set <valor>`.")
+    await ctx.send(await edit_profile(user_id, _create_profile, ctx.author))
+
+def _delete_profile(user_id):
+    profile = user_store.get(user_id)
+    if profile is None:
+        return "🤔 Seu perfil já tinha sido removido."
+    user_store.delete(user_id)
+    inventory_index.user_removed(user_id, profile.inventory)
+    money_ranking.remove(user_id)
+    macro_cache.user_removed(user_id)
+    return "✅ Seus dados foram removidos com sucesso."
+
+def _create_profile(author):
+    if author.id in user_store:
+        return "✅ Você já está registrado!"
+    user_store.create(author.id, Profile(name=author.name, money=0, hp_atual=10, hp_max=10))
+    money_ranking.update(author.id, 0)
+    return f"🎉 Bem-vindo, {author.mention}! Você foi registrado. Use `pd.hp set <valor>`."
 
 # ========================================================================================
 #                         COMANDOS: ATRIBUTOS E PERSONAGEM
 # ========================================================================================
 
+def render_attributes_embed(member, profile):
+    attributes = profile.attributes
+    embed = discord.Embed(title=f"📜 Atributos de {member.display_name}", color=discord.Color.blue())
+    if not attributes:
+        embed.description = "Nenhum atributo definido."
+    else:
+        embed.description = "\n".join([f"**{name.upper()}:** {value}" for name, value in attributes.items()])
+    return embed
+
 @bot.command(name="attribute")
 async def attribute_list(ctx, member: discord.Member = None):
     """Mostra seus atributos ou os de outro membro."""
     target_user = member or ctx.author
-    user_id = str(target_user.id)
-    if user_id not in user_data:
+    embed = profile_embed(target_user, "attributes", render_attributes_embed)
+    if embed is None:
         return await ctx.send(f"⚠️ {target_user.display_name} não está registrado(a).")
-
-    attributes = user_data[user_id].get("attributes", {})
-    embed = discord.Embed(title=f"📜 Atributos de {target_user.display_name}", color=discord.Color.blue())
-    if not attributes:
-        embed.description = "Nenhum atributo definido."
-    else:
-        embed.description = "\n".join([f"**{name.upper()}:** {value}" for name, value in attributes.items()])
     await ctx.send(embed=embed)
 
 @bot.command(name="attribute_push")
 async def attribute_push(ctx, *, args: str):
     """Adiciona ou atualiza atributos na sua ficha. Ex: for=10, des=14"""
-    user_id = str(ctx.author.id)
-    if user_id not in user_data:
-        return await ctx.send("⚠️ Você não está registrado. Use `pd.register` primeiro.")
+    await ctx.send(await edit_profiles((ctx.author.id,), _push_attributes, ctx.author.id, args))
 
+def _push_attributes(batch, user_id, args):
+    batch.profile(user_id)
     attributes_to_add = re.findall(r'([a-zA-Z_]+)\s*=\s*(-?\d+)', args)
     if not attributes_to_add:
-        return await ctx.send("❌ Formato inválido. Use `pd.attribute_push nome=valor, outro=valor`.")
+        raise BatchError("❌ Formato inválido. Use `pd.attribute_push nome=valor, outro=valor`.")
 
-    if "attributes" not in user_data[user_id]:
-        user_data[user_id]["attributes"] = {}
-    
     added_feedback = [f"`{name.upper()}`=`{val}`" for name, val in attributes_to_add]
     for attr_name, attr_value in attributes_to_add:
-        user_data[user_id]["attributes"][attr_name.lower()] = int(attr_value)
-    
-    save_data(user_data, USER_DATA_FILE)
-    await ctx.send(f"✅ Atributos atualizados: {', '.join(added_feedback)}")
+        batch.set_attribute(user_id, attr_name.lower(), int(attr_value))
+    return f"✅ Atributos atualizados: {', '.join(added_feedback)}"
 
 @bot.command(name="attribute_remove")
 async def attribute_remove(ctx, *, args: str):
     """Remove atributos da sua ficha. Ex: for, des"""
-    user_id = str(ctx.author.id)
-    if user_id not in user_data or "attributes" not in user_data.get(user_id, {}):
-        return await ctx.send("⚠️ Você não tem atributos para remover.")
-    
+    await ctx.send(await edit_profiles((ctx.author.id,), _remove_attributes, ctx.author.id, args))
+
+def _remove_attributes(batch, user_id, args):
+    profile = batch.profile(user_id)
+    if not profile.attributes:
+        raise BatchError("⚠️ Você não tem atributos para remover.")
+
     attributes_to_remove = [attr.strip().lower() for attr in args.split(',')]
     removed_feedback = []
     for attr_name in attributes_to_remove:
-        if attr_name in user_data[user_id]["attributes"]:
-            del user_data[user_id]["attributes"][attr_name]
+        if attr_name in profile.attributes:
+            batch.set_attribute(user_id, attr_name, None)
             removed_feedback.append(f"`{attr_name.upper()}`")
-    
+
     if not removed_feedback:
-        return await ctx.send("🤔 Nenhum dos atributos mencionados foi encontrado na sua ficha.")
-        
-    save_data(user_data, USER_DATA_FILE)
-    await ctx.send(f"🗑️ Atributos removidos: {', '.join(removed_feedback)}")
+        raise BatchError("🤔 Nenhum dos atributos mencionados foi encontrado na sua ficha.")
+    return f"🗑️ Atributos removidos: {', '.join(removed_feedback)}"
     
+def render_hp_embed(member, profile):
+    hp_atual = profile.hp_atual
+    hp_max = profile.hp_max
+    health_percentage = hp_atual / hp_max
+    filled_blocks = int(health_percentage * 10)
+    empty_blocks = 10 - filled_blocks
+    health_bar = f"[`{'█' * filled_blocks}{'░' * empty_blocks}`]"
+    return discord.Embed(
+        title=f"❤️ Pontos de Vida de {member.display_name}",
+        description=f"**{hp_atual} / {hp_max}**\n{health_bar}",
+        color=discord.Color.red()
+    )
+
+_MENTION_RE = re.compile(r"<@!?(\d+)>")
+
+def mentioned_targets(ctx, text):
+    """
+    Separa as menções de `text`. Devolve os membros mencionados (na ordem, sem repetição) e o
+    texto que sobra sem elas: `-12 @a @b` vira ([a, b], "-12").
+    """
+    members = {member.id: member for member in ctx.message.mentions}
+    targets = {}
+    for user_id in _MENTION_RE.findall(text):
+        member = members.get(int(user_id))
+        if member is None:
+            raise BatchError("❌ Não encontrei um dos membros mencionados neste servidor.")
+        targets[member.id] = member
+    return list(targets.values()), _MENTION_RE.sub(" ", text).strip()
+
+def check_targets(ctx, targets):
+    """Só o mestre (quem pode gerenciar mensagens no canal) altera a ficha de outros jogadores."""
+    if len(targets) > MAX_BATCH_OPERATIONS:
+        raise BatchError(f"❌ No máximo {MAX_BATCH_OPERATIONS} alterações por comando.")
+    if any(member.id != ctx.author.id for member in targets) \
+            and not ctx.channel.permissions_for(ctx.author).manage_messages:
+        raise BatchError("❌ Só o mestre (quem pode gerenciar mensagens no canal) altera a ficha de outros jogadores.")
+
+def run_operations(batch, title, color, operations):
+    """
+    Aplica `operations`, uma lista de (rótulo, função, args), ao lote e monta o embed com uma
+    linha de resposta por operação. Se uma falhar, o erro diz qual foi e o lote não é gravado.
+    """
+    lines = []
+    for label, change, args in operations:
+        try:
+            lines.append(change(batch, *args))
+        except BatchError as error:
+            raise BatchError(f"{error}\n↳ Em `{label}`. Nada foi alterado.") from None
+    embed = discord.Embed(title=title, description="\n".join(lines), color=color)
+    embed.set_footer(text=f"{len(lines)} alteração(ões) gravada(s) de uma vez")
+    return embed
+
+async def send_reply(ctx, reply):
+    """Envia a resposta de `edit_profiles`: o embed consolidado de um lote ou um aviso em texto."""
+    if isinstance(reply, discord.Embed):
+        return await ctx.send(embed=reply)
+    return await ctx.send(reply)
+
 @bot.command(name="hp")
 async def hp_command(ctx, *, args: str = None):
-    """Gerencia seus Pontos de Vida. Use pd.hp, pd.hp set <valor>, pd.hp +/-<valor>."""
-    user_id = str(ctx.author.id)
-    if user_id not in user_data:
-        return await ctx.send(f"⚠️ Você não está registrado. Use `pd.register` primeiro.")
-
-    profile = user_data[user_id]
-    
+    """Gerencia Pontos de Vida. Use pd.hp, pd.hp set <valor>, pd.hp +/-<valor> [@jogadores]."""
+    user_id = ctx.author.id
     if args is None:
-        hp_atual = profile.get("hp_atual", 0)
-        hp_max = profile.get("hp_max", 1)
-        health_percentage = hp_atual / hp_max
-        filled_blocks = int(health_percentage * 10)
-        empty_blocks = 10 - filled_blocks
-        health_bar = f"[`{'█' * filled_blocks}{'░' * empty_blocks}`]"
-        embed = discord.Embed(
-            title=f"❤️ Pontos de Vida de {ctx.author.display_name}",
-            description=f"**{hp_atual} / {hp_max}**\n{health_bar}",
-            color=discord.Color.red()
-        )
+        embed = profile_embed(ctx.author, "hp", render_hp_embed)
+        if embed is None:
+            return await ctx.send(f"⚠️ Você não está registrado. Use `pd.register` primeiro.")
         return await ctx.send(embed=embed)
 
+    try:
+        targets, args = mentioned_targets(ctx, args)
+        check_targets(ctx, targets)
+    except BatchError as error:
+        return await ctx.send(str(error))
+    if not targets:
+        return await ctx.send(await edit_profiles((user_id,), _change_hp, ctx.author, args, ctx.author))
+
+    # Dano em área: todos os alvos mudam juntos, numa gravação e numa resposta.
+    operations = [(member.display_name, _change_hp, (member, args, ctx.author)) for member in targets]
+    reply = await edit_profiles([member.id for member in targets], run_operations,
+                                "❤️ Pontos de Vida", discord.Color.red(), operations)
+    await send_reply(ctx, reply)
+
+def _change_hp(batch, member, args, author):
+    user_id = member.id
+    profile = batch.profile(user_id, None if user_id == author.id else member.display_name)
+
     match_set = re.match(r"(set|max)\s+(\d+)", args, re.IGNORECASE)
     if match_set:
         valor = int(match_set.group(2))
         if valor <= 0:
-            return await ctx.send("❌ O HP máximo deve ser maior que zero.")
-        profile["hp_max"] = valor
-        profile["hp_atual"] = valor
-        save_data(user_data, USER_DATA_FILE) # CORRIGIDO
-        return await ctx.send(f"✅ HP máximo de {ctx.author.mention} definido para **{valor}**! Você foi curado.")
+            raise BatchError("❌ O HP máximo deve ser maior que zero.")
+        batch.update(user_id, hp_max=valor, hp_atual=valor)
+        healed = "Você foi curado." if user_id == author.id else f"{member.display_name} foi curado(a)."
+        return f"✅ HP máximo de {member.mention} definido para **{valor}**! {healed}"
 
     try:
         valor = int(args.replace(" ", ""))
-        hp_atual = profile.get("hp_atual", 0)
-        hp_max = profile.get("hp_max", hp_atual)
-        novo_hp = max(0, min(hp_max, hp_atual + valor))
-        profile["hp_atual"] = novo_hp
-        save_data(user_data, USER_DATA_FILE) # CORRIGIDO
-        acao = "curou" if novo_hp > hp_atual else "recebeu"
-        diferenca = abs(novo_hp - hp_atual)
-        await ctx.send(f"❤️ {ctx.author.mention} {acao} **{diferenca}** de dano/cura.\nSua vida agora é **{novo_hp} / {hp_max}**.")
     except ValueError:
-        await ctx.send("❌ Comando de HP inválido. Use `pd.hp`, `pd.hp set <valor>`, ou `pd.hp +/-<valor>`.")
-        
+        raise BatchError("❌ Comando de HP inválido. Use `pd.hp`, `pd.hp set <valor>`, ou `pd.hp +/-<valor>`.") from None
+    hp_atual = profile.hp_atual
+    hp_max = profile.hp_max
+    novo_hp = max(0, min(hp_max, hp_atual + valor))
+    batch.update(user_id, hp_atual=novo_hp)
+    acao = "curou" if novo_hp > hp_atual else "recebeu"
+    diferenca = abs(novo_hp - hp_atual)
+    return f"❤️ {member.mention} {acao} **{diferenca}** de dano/cura.\nSua vida agora é **{novo_hp} / {hp_max}**."
+
+def render_gear_embed(member, profile):
+    inventory = profile.inventory
+    embed = discord.Embed(title=f"🎒 Inventário de {member.display_name}", color=discord.Color.dark_gold())
+    if not inventory:
+        embed.description = "Seu inventário está vazio."
+    else:
+        embed.description = "\n".join([f"**{item}**: `x{qtd}`" for item, qtd in inventory.items()])
+    return embed
+
+# Só uma vírgula seguida de sinal separa itens (`+3 Flecha, -1 Corda`): nomes antigos com vírgula,
+# como "Poção de cura, grande", continuam sendo um item só.
+_GEAR_SPLIT_RE = re.compile(r",\s*(?=[+-])")
+
+def split_gear_specs(args):
+    """Divide `+3 Flecha, +1 Corda, -2 Poção` em uma alteração de item por parte."""
+    return [spec.strip() for spec in _GEAR_SPLIT_RE.split(args) if spec.strip()]
+
 @bot.command(name="gear")
 async def gear(ctx, *, args: str = None):
-    """Gerencia seu inventário. Use sem argumentos para ver, ou +/-<qtd> <item> para modificar."""
-    user_id = str(ctx.author.id)
-    if user_id not in user_data:
-        return await ctx.send(f"⚠️ Você não está registrado. Use `pd.register` primeiro.")
-
+    """Gerencia seu inventário. Use sem argumentos para ver, ou +/-<qtd> <item>[, ...] para modificar."""
+    user_id = ctx.author.id
     # Se nenhum argumento for dado, mostra o inventário
     if args is None:
-        inventory = user_data[user_id].get("inventory", {})
-        embed = discord.Embed(title=f"🎒 Inventário de {ctx.author.display_name}", color=discord.Color.dark_gold())
-        if not inventory:
-            embed.description = "Seu inventário está vazio."
-        else:
-            embed.description = "\n".join([f"**{item}**: `x{qtd}`" for item, qtd in inventory.items()])
+        embed = profile_embed(ctx.author, "gear", render_gear_embed)
+        if embed is None:
+            return await ctx.send(f"⚠️ Você não está registrado. Use `pd.register` primeiro.")
         return await ctx.send(embed=embed)
 
+    specs = split_gear_specs(args)
+    if len(specs) <= 1:
+        return await ctx.send(await edit_profiles((user_id,), _change_gear, user_id, args))
+    if len(specs) > MAX_BATCH_OPERATIONS:
+        return await ctx.send(f"❌ No máximo {MAX_BATCH_OPERATIONS} alterações por comando.")
+
+    # Vários itens (+3 Flecha, -2 Poção): ou todos mudam, ou nenhum.
+    operations = [(spec, _change_gear, (user_id, spec)) for spec in specs]
+    reply = await edit_profiles((user_id,), run_operations, "🎒 Inventário atualizado", discord.Color.dark_gold(), operations)
+    await send_reply(ctx, reply)
+
+def _change_gear(batch, user_id, args):
+    profile = batch.profile(user_id)
+
     # Regex para extrair o sinal (+/-), a quantidade e o nome do item
     match = re.match(r"\s*([+-])?\s*(\d+)?\s*(.+)", args.strip())
     if not match:
-        return await ctx.send("❌ Formato inválido. Use `pd.gear`, `pd.gear +1 Poção` ou `pd.gear -1 Flecha`.")
+        raise BatchError("❌ Formato inválido. Use `pd.gear`, `pd.gear +1 Poção` ou `pd.gear -1 Flecha`.")
 
     sign, quantity_str, item_name = match.groups()
     item_name = item_name.strip().capitalize()
     if not item_name:
-        return await ctx.send("❌ Você precisa especificar o nome do item.")
+        raise BatchError("❌ Você precisa especificar o nome do item.")
+    # "pocao" e "Poção" são o mesmo item: usa a grafia que já está no inventário.
+    key = canonical_item(item_name)
+    item_name = next((name for name in profile.inventory if canonical_item(name) == key), item_name)
 
     quantity = int(quantity_str) if quantity_str else 1
-    inventory = user_data[user_id].get("inventory", {})
-    current_quantity = inventory.get(item_name, 0)
+    current_quantity = profile.inventory.get(item_name, 0)
 
     if sign == '-':
         if current_quantity < quantity:
-            return await ctx.send(f"🤔 Você não tem **{quantity} {item_name}** para remover. Você possui apenas `{current_quantity}`.")
-        inventory[item_name] = current_quantity - quantity
-        if inventory[item_name] == 0:
-            del inventory[item_name]
+            raise BatchError(f"🤔 Você não tem **{quantity} {item_name}** para remover. Você possui apenas `{current_quantity}`.")
+        new_quantity = current_quantity - quantity
         action_text = f"🗑️ Removido `{quantity} {item_name}`."
     else: # Adicionar é o padrão se não houver sinal
-        inventory[item_name] = current_quantity + quantity
+        new_quantity = current_quantity + quantity
         action_text = f"✅ Adicionado `{quantity} {item_name}`."
 
-    user_data[user_id]["inventory"] = inventory
-    save_data(user_data, USER_DATA_FILE)
+    batch.set_item(user_id, item_name, new_quantity)
+    return f"{action_text} Novo total: `{new_quantity}`."
 
-    new_quantity = inventory.get(item_name, 0)
-    await ctx.send(f"{action_text} Novo total: `{new_quantity}`.")
+@bot.command(name="gear_find")
+async def gear_find(ctx, *, item: str):
+    """Mostra quem tem um item. Ex: pd.gear_find corda"""
+    found = inventory_index.find(item)
+    if found is None:
+        suggestions = inventory_index.suggest(item)
+        if not suggestions:
+            return await ctx.send(f"🤔 Ninguém tem **{item}**.")
+        return await ctx.send(f"🤔 Ninguém tem **{item}**. Você quis dizer: {', '.join(f'`{name}`' for name in suggestions)}?")
+
+    item_name, holders = found
+    ranked = sorted(holders.items(), key=lambda holder: holder[1], reverse=True)
+    lines = []
+    for user_id, quantity in ranked[:GEAR_FIND_MAX_LINES]:
+        profile = user_store.get(user_id)
+        lines.append(f"**{profile.name if profile else user_id}**: `x{quantity}`")
+    if len(ranked) > GEAR_FIND_MAX_LINES:
+        lines.append(f"... e mais {len(ranked) - GEAR_FIND_MAX_LINES}.")
+    embed = discord.Embed(title=f"🔎 Quem tem {item_name}", description="\n".join(lines), color=discord.Color.dark_gold())
+    embed.set_footer(text=f"{len(holders)} portador(es), {sum(holders.values())} no total")
+    await ctx.send(embed=embed)
+
+@bot.command(name="party_gear")
+async def party_gear(ctx, members: commands.Greedy[discord.Member] = None):
+    """Soma os inventários do grupo: os membros mencionados ou os jogadores na iniciativa do canal."""
+    if members:
+        party = {member.id: member.display_name for member in members}
+    else:
+        async with channel_locks.hold(str(ctx.channel.id)):
+            tracker = get_tracker(str(ctx.channel.id))
+            party = {int(entry_id): entry["name"] for entry_id, entry in tracker.entries.items() if entry_id.isdigit()}
+    if not party:
+        return await ctx.send("🤔 Mencione os membros do grupo (`pd.party_gear @a @b`) ou entrem na iniciativa com `pd.init`.")
+
+    totals = {}  # chave canônica -> [nome, quantidade, portadores]
+    for user_id in party:
+        profile = user_store.get(user_id)
+        if profile is None:
+            continue
+        for item_name, quantity in profile.inventory.items():
+            total = totals.setdefault(canonical_item(item_name), [item_name, 0, 0])
+            total[1] += quantity
+            total[2] += 1
+
+    embed = discord.Embed(title="🎒 Inventário do grupo", color=discord.Color.dark_gold())
+    if not totals:
+        embed.description = "O grupo não tem nenhum item."
+    else:
+        embed.description = "\n".join(f"**{name}**: `x{quantity}` ({holders} portador(es))"
+                                      for name, quantity, holders in sorted(totals.values()))
+    embed.set_footer(text=", ".join(party.values()))
+    await ctx.send(embed=embed)
 
 # ========================================================================================
 #                              COMANDOS: FINANÇAS
@@ -326,44 +3311,393 @@ async def gear(ctx, *, args: str = None):
 async def money(ctx, member: discord.Member = None):
     """Mostra o seu saldo ou o de outro membro."""
     target_user = member or ctx.author
-    user_id = str(target_user.id)
-    if user_id not in user_data:
+    user_id = target_user.id
+    profile = user_store.get(user_id)
+    if profile is None:
         return await ctx.send(f"⚠️ {target_user.display_name} não está registrado(a).")
 
-    balance = user_data[user_id].get("money", 0)
+    balance = profile.money
     await ctx.send(f"💰 O saldo de **{target_user.display_name}** é de **{balance}** moedas.")
 
 @bot.command(name="add_money")
 async def add_money(ctx, amount: int):
     """Adiciona dinheiro à sua própria conta."""
-    user_id = str(ctx.author.id)
-    if user_id not in user_data:
-        return await ctx.send(f"⚠️ Você não está registrado. Use `pd.register` primeiro.")
+    await ctx.send(await edit_profiles((ctx.author.id,), _add_money, ctx.author.id, amount))
+
+def _add_money(batch, user_id, amount):
+    profile = batch.profile(user_id)
     if amount <= 0:
-        return await ctx.send("❌ O valor para adicionar deve ser um número positivo.")
+        raise BatchError("❌ O valor para adicionar deve ser um número positivo.")
 
-    user_data[user_id]["money"] = user_data[user_id].get("money", 0) + amount
-    save_data(user_data, USER_DATA_FILE)
-    new_balance = user_data[user_id]["money"]
-    await ctx.send(f"💸 Adicionado **{amount}** moedas. Seu novo saldo é: **{new_balance}**.")
+    new_balance = profile.money + amount
+    batch.update(user_id, money=new_balance)
+    return f"💸 Adicionado **{amount}** moedas. Seu novo saldo é: **{new_balance}**."
 
 @bot.command(name="pop_money")
 async def pop_money(ctx, amount: int):
     """Remove dinheiro da sua própria conta."""
-    user_id = str(ctx.author.id)
-    if user_id not in user_data:
-        return await ctx.send(f"⚠️ Você não está registrado. Use `pd.register` primeiro.")
+    await ctx.send(await edit_profiles((ctx.author.id,), _pop_money, ctx.author.id, amount))
+
+def _pop_money(batch, user_id, amount):
+    profile = batch.profile(user_id)
     if amount <= 0:
-        return await ctx.send("❌ O valor para remover deve ser um número positivo.")
+        raise BatchError("❌ O valor para remover deve ser um número positivo.")
 
-    current_balance = user_data[user_id].get("money", 0)
+    current_balance = profile.money
     if current_balance < amount:
-        return await ctx.send(f"🤔 Você não pode remover **{amount}** moedas. Seu saldo é de apenas **{current_balance}**.")
+        raise BatchError(f"🤔 Você não pode remover **{amount}** moedas. Seu saldo é de apenas **{current_balance}**.")
+
+    new_balance = current_balance - amount
+    batch.update(user_id, money=new_balance)
+    return f"💸 Removido **{amount}** moedas. Seu novo saldo é: **{new_balance}**."
+
+@bot.command(name="rank")
+async def rank(ctx, member: discord.Member = None):
+    """Mostra a sua posição no ranking de moedas ou a de outro membro."""
+    target_user = member or ctx.author
+    position = money_ranking.rank(target_user.id)
+    if position is None:
+        return await ctx.send(f"⚠️ {target_user.display_name} não está registrado(a).")
+    place, total = position
+    balance = money_ranking.balances[target_user.id]
+    await ctx.send(f"🏆 **{target_user.display_name}** está em **#{place}** de {total} com **{balance}** moedas.")
+
+@bot.command(name="leaderboard")
+async def leaderboard(ctx, page: int = 1):
+    """Mostra os jogadores com mais moedas, 10 por página. Ex: pd.leaderboard 2"""
+    pages = max(1, math.ceil(len(money_ranking) / LEADERBOARD_PAGE_SIZE))
+    if not 1 <= page <= pages:
+        return await ctx.send(f"❌ Página inválida. O ranking tem {pages} página(s).")
+
+    lines = []
+    for place, user_id, balance in money_ranking.page(page):
+        profile = user_store.get(user_id)
+        lines.append(f"**#{place}** {profile.name if profile else user_id}: `{balance}` moedas")
+    embed = discord.Embed(title="🏆 Ranking de Moedas", color=discord.Color.gold(),
+                          description="\n".join(lines) or "Ninguém registrado ainda.")
+    embed.set_footer(text=f"Página {page} de {pages}")
+    await ctx.send(embed=embed)
+
+# ========================================================================================
+#                              COMANDOS: EM LOTE
+# ========================================================================================
+
+def parse_batch(ctx, text):
+    """
+    Lê as linhas de um pd.batch e devolve as operações, no formato de `run_operations`, e os IDs
+    de todos os perfis que elas tocam. Erros de formato saem aqui, antes de qualquer lock.
+    """
+    author = ctx.author
+    operations = []
+    user_ids = {author.id}
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        name, _, args = line.removeprefix("pd.").partition(" ")
+        name, args = name.lower(), args.strip()
+        label = f"linha {number}: {line}"
+
+        if name == "hp":
+            targets, args = mentioned_targets(ctx, args)
+            check_targets(ctx, targets)
+            for member in targets or [author]:
+                operations.append((label, _change_hp, (member, args, author)))
+                user_ids.add(member.id)
+        elif name == "gear":
+            operations.extend((label, _change_gear, (author.id, spec)) for spec in split_gear_specs(args))
+        elif name in ("add_money", "pop_money"):
+            try:
+                amount = int(args)
+            except ValueError:
+                raise BatchError(f"❌ Linha {number}: `{name}` precisa de um valor inteiro.") from None
+            operations.append((label, _add_money if name == "add_money" else _pop_money, (author.id, amount)))
+        elif name == "attribute_push":
+            operations.append((label, _push_attributes, (author.id, args)))
+        elif name == "attribute_remove":
+            operations.append((label, _remove_attributes, (author.id, args)))
+        else:
+            raise BatchError(f"❌ Linha {number}: `{name}` não pode ser usado em lote. Use `hp`, `gear`, "
+                             "`add_money`, `pop_money`, `attribute_push` ou `attribute_remove`.")
+
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise BatchError(f"❌ No máximo {MAX_BATCH_OPERATIONS} alterações por comando.")
+    if not operations:
+        raise BatchError("❌ Escreva uma operação por linha. Ex:\n```\npd.batch\nhp -12 @Ana @Bia\ngear +3 Flecha, -1 Poção\nadd_money 50\n```")
+    return operations, user_ids
+
+@bot.command(name="batch")
+async def batch_command(ctx, *, args: str = ""):
+    """Aplica várias alterações de uma vez, uma por linha: hp, gear, add_money, pop_money e attribute_push/remove."""
+    try:
+        operations, user_ids = parse_batch(ctx, args)
+    except BatchError as error:
+        return await ctx.send(str(error))
+    reply = await edit_profiles(user_ids, run_operations, "📦 Lote aplicado", discord.Color.purple(), operations)
+    await send_reply(ctx, reply)
+
+# ========================================================================================
+#                               RASTREADOR DE INICIATIVA
+# ========================================================================================
+
+class InitiativeTracker:
+    """
+    Ordem de iniciativa de um canal, mantida sempre ordenada.
+
+    As entradas ficam numa lista de chaves `(-valor, -modificador, ordem de chegada, id)`, então o
+    bisect acha a posição de cada inserção ou remoção em O(log n), sem reordenar a lista toda.
+    Empates são resolvidos pelo maior modificador e depois por quem entrou primeiro. O turno atual
+    é guardado pelo id de quem está agindo, então não se perde quando alguém entra no meio da
+    rodada. O embed da lista fica em cache até a ordem ou o turno mudarem.
+    """
+
+    def __init__(self, channel_id, store):
+        self.channel_id = channel_id
+        self.store = store
+        self.entries = {}   # entry_id -> {"name", "score", "modifier", "seq"}
+        self._order = []    # chaves ordenadas
+        self._keys = {}     # entry_id -> chave
+        self._next_seq = 0
+        self.version = 0
+        self._embed = None
+        self._embed_version = -1
+        for entry_id, entry in store.get(channel_id).items():
+            # Entradas antigas não têm "seq": a ordem em que foram gravadas serve de desempate.
+            self._insert(entry_id, {"modifier": 0, "seq": self._next_seq, **entry})
+        self.turn, self.round = store.get_turn(channel_id)
+        if self.turn not in self.entries:
+            self.turn = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _insert(self, entry_id, entry):
+        key = (-entry["score"], -entry["modifier"], entry["seq"], entry_id)
+        bisect.insort(self._order, key)
+        self._keys[entry_id] = key
+        self.entries[entry_id] = entry
+        self._next_seq = max(self._next_seq, entry["seq"] + 1)
+
+    def _remove(self, entry_id):
+        key = self._keys.pop(entry_id)
+        del self._order[bisect.bisect_left(self._order, key)]
+        del self.entries[entry_id]
+
+    def add(self, entry_id, name, score, modifier=0):
+        """Coloca (ou recoloca, se já estiver na lista) um participante na posição certa."""
+        if entry_id in self.entries:
+            self._remove(entry_id)
+        entry = {"name": name, "score": score, "modifier": modifier, "seq": self._next_seq}
+        self._insert(entry_id, entry)
+        self.store.set_entry(self.channel_id, entry_id, entry)
+        self.version += 1
+
+    def add_many(self, participants):
+        """Adiciona vários participantes `(entry_id, name, score, modifier)` numa única gravação."""
+        with self.store.transaction():
+            for participant in participants:
+                self.add(*participant)
+
+    def clear(self):
+        self.store.clear(self.channel_id)
+        self.entries.clear()
+        self._order.clear()
+        self._keys.clear()
+        self.turn, self.round = None, 0
+        self.version += 1
+
+    def ordered(self):
+        return [(entry_id, self.entries[entry_id]) for *_, entry_id in self._order]
+
+    def advance(self, step):
+        """Passa o turno para o próximo (step=1) ou volta para o anterior (step=-1)."""
+        if self.turn is None:
+            index, self.round = (0, 1) if step > 0 else (len(self._order) - 1, 1)
+        else:
+            index = bisect.bisect_left(self._order, self._keys[self.turn]) + step
+            if index >= len(self._order):
+                index, self.round = 0, self.round + 1
+            elif index < 0:
+                if self.round <= 1:
+                    index = 0
+                else:
+                    index, self.round = len(self._order) - 1, self.round - 1
+        self.turn = self._order[index][-1]
+        self.store.set_turn(self.channel_id, self.turn, self.round)
+        self.version += 1
+        return self.entries[self.turn]
+
+    def embed(self):
+        if self._embed_version != self.version:
+            lines = []
+            for position, (entry_id, participant) in enumerate(self.ordered(), start=1):
+                marker = "▶️ " if entry_id == self.turn else ""
+                lines.append(f"{marker}**{position}.** {participant['name']} - `{participant['score']}`")
+            self._embed = discord.Embed(
+                title="⚔️ Ordem de Iniciativa ⚔️",
+                description="\n".join(lines),
+                color=discord.Color.dark_red()
+            )
+            if self.turn is not None:
+                self._embed.set_footer(text=f"Rodada {self.round}")
+            self._embed_version = self.version
+        return self._embed
+
+class InitiativeActivity:
+    """
+    Horário (Unix) do último uso de cada canal com lista de iniciativa, do menos para o mais
+    recentemente usado. É com ele que as listas abandonadas são apagadas: pela varredura
+    periódica, quando ficam paradas mais que o TTL, ou na hora, quando há mais canais que o
+    limite (sai o menos usado, como num LRU).
+
+    O horário também vai para o store, no máximo a cada INITIATIVE_TOUCH_PERSIST segundos por
+    canal: assim ele sobrevive a reinícios e, com vários processos, um processo confere o horário
+    gravado (`used_elsewhere`) antes de apagar uma lista que outro pode estar usando.
+
+    Só um processo que atende todos os shards começa com todos os canais do store (e assim apaga
+    as listas abandonadas antes de um reinício). Com os shards divididos entre processos, o store
+    também tem os canais dos outros, que este processo não pode apagar: aqui só contam os canais
+    em que ele mesmo montou um rastreador.
+    """
+
+    def __init__(self):
+        self.last_used = None  # canal -> horário, em ordem de uso; None até ser lido do store
+        self._persisted = {}   # canal -> horário gravado no store
+
+    def _ensure(self):
+        if self.last_used is not None:
+            return
+        if bot.shard_ids is not None and len(bot.shard_ids) < (bot.shard_count or 0):
+            self.last_used, self._persisted = collections.OrderedDict(), {}
+            return
+        now = time.time()
+        known = sorted((touched or now, channel_id) for channel_id, touched in initiative_store.activity())
+        self.last_used = collections.OrderedDict((channel_id, touched) for touched, channel_id in known)
+        self._persisted = dict(self.last_used)
+
+    def __len__(self):
+        self._ensure()
+        return len(self.last_used)
+
+    def touch(self, channel_id, persist):
+        """Marca o uso do canal; `persist` diz se há uma lista no store onde gravar o horário."""
+        self._ensure()
+        now = time.time()
+        self.last_used[channel_id] = now
+        self.last_used.move_to_end(channel_id)
+        if persist and now - self._persisted.get(channel_id, 0) >= INITIATIVE_TOUCH_PERSIST:
+            initiative_store.touch(channel_id, int(now))
+            self._persisted[channel_id] = now
+
+    def forget(self, channel_id):
+        self._ensure()
+        self.last_used.pop(channel_id, None)
+        self._persisted.pop(channel_id, None)
 
-    user_data[user_id]["money"] = current_balance - amount
-    save_data(user_data, USER_DATA_FILE)
-    new_balance = user_data[user_id]["money"]
-    await ctx.send(f"💸 Removido **{amount}** moedas. Seu novo saldo é: **{new_balance}**.")
+    def idle(self, ttl):
+        """Canais sem uso há mais de `ttl` segundos, pelo que este processo sabe."""
+        self._ensure()
+        limit = time.time() - ttl
+        return [channel_id for channel_id, last in self.last_used.items() if last <= limit]
+
+    def least_used(self, count):
+        self._ensure()
+        return list(itertools.islice(self.last_used, max(0, count)))
+
+    def used_elsewhere(self, channel_id):
+        """
+        Confere no store se outro processo usou o canal depois do último uso que este conhece.
+        Se usou, adota o horário gravado e põe o canal no fim da fila.
+        """
+        touched = initiative_store.touched(channel_id)
+        if touched is None or touched <= self.last_used.get(channel_id, 0):
+            return False
+        self.last_used[channel_id] = self._persisted[channel_id] = touched
+        self.last_used.move_to_end(channel_id)
+        return True
+
+    def still_idle(self, channel_id, ttl):
+        """Confere (também no store) se o canal continua sem uso há mais de `ttl` segundos."""
+        self.used_elsewhere(channel_id)
+        last = self.last_used.get(channel_id)
+        return last is not None and time.time() - last > ttl
+
+initiative_activity = InitiativeActivity()
+initiative_trackers = {}
+
+def get_tracker(channel_id, adding=False):
+    """
+    Retorna o rastreador do canal, montando-o a partir do armazenamento no primeiro acesso, e
+    marca o uso do canal. Um canal sem lista só fica na memória se `adding` (o comando vai pôr
+    alguém nela): consultar um canal vazio não ocupa lugar no limite de canais. Ao guardar um
+    rastreador novo, apaga as listas menos usadas que passarem desse limite.
+    """
+    tracker = initiative_trackers.get(channel_id)
+    created = tracker is None
+    if created:
+        tracker = InitiativeTracker(channel_id, initiative_store)
+        if not tracker.entries and not adding:
+            return tracker
+        initiative_trackers[channel_id] = tracker
+    initiative_activity.touch(channel_id, persist=bool(tracker.entries))
+    if created:
+        max_channels = int(config.get("max_initiative_channels", MAX_INITIATIVE_CHANNELS))
+        for old_channel_id in initiative_activity.least_used(len(initiative_activity) - max_channels):
+            # Estes canais não estão com nenhum comando em andamento: os comandos de iniciativa
+            # pegam o rastreador e o alteram sem await no meio, e quem o pegou já foi para o fim.
+            if old_channel_id != channel_id and not initiative_activity.used_elsewhere(old_channel_id):
+                evict_initiative(old_channel_id, "evicted")
+    return tracker
+
+def forget_tracker(channel_id):
+    initiative_trackers.pop(channel_id, None)
+    initiative_activity.forget(channel_id)
+
+def evict_initiative(channel_id, reason):
+    """
+    Apaga a lista de iniciativa do canal e a esquece na memória. `reason` é "expired" (passou do
+    TTL) ou "evicted" (passou do limite de canais); só listas com participantes contam nas métricas.
+    """
+    tracker = initiative_trackers.get(channel_id)
+    had_entries = bool(tracker.entries) if tracker is not None else channel_id in initiative_store
+    forget_tracker(channel_id)
+    if not had_entries:
+        return
+    initiative_store.clear(channel_id)
+    metrics.count(f"initiative_{reason}")
+    print(f"🧹 Lista de iniciativa do canal {channel_id} apagada ({'sem uso' if reason == 'expired' else 'limite de canais'}).")
+
+async def sweep_initiative(interval=INITIATIVE_SWEEP_INTERVAL):
+    """Tarefa de fundo: apaga as listas de iniciativa paradas há mais de "initiative_ttl_hours"."""
+    while True:
+        await asyncio.sleep(interval)
+        ttl = float(config.get("initiative_ttl_hours", INITIATIVE_TTL_HOURS)) * 3600
+        for channel_id in initiative_activity.idle(ttl):
+            async with channel_locks.hold(channel_id):
+                # Confere de novo: um comando pode ter usado o canal enquanto esperávamos o lock.
+                if initiative_activity.still_idle(channel_id, ttl):
+                    evict_initiative(channel_id, "expired")
+
+_NPC_SPEC_RE = re.compile(r"(.+?)\s*(?:x(\d+))?\s+(\S+)", re.IGNORECASE)
+
+def parse_npc_specs(args):
+    """
+    Lê `Goblin x3 1d20+2, Orc 1d20+1` como uma lista de (nome, quantidade, expressão compilada).
+    Levanta DiceError com uma mensagem para o usuário se algo estiver errado.
+    """
+    specs = []
+    for part in args.split(","):
+        match = _NPC_SPEC_RE.fullmatch(part.strip())
+        if not match:
+            raise DiceError(f"❌ Não entendi `{part.strip()}`. Use `Nome [xN] rolagem`, ex: `Goblin x3 1d20+2`.")
+        name, quantity_str, roll_input = match.groups()
+        expression = compile_dice(roll_input)
+        if expression.count > 1:
+            raise DiceError("❌ Cada NPC rola uma iniciativa só (ex: `1d20+2`, sem `N#`).")
+        specs.append((name.strip(), int(quantity_str) if quantity_str else 1, expression))
+    if sum(quantity for _, quantity, _ in specs) > MAX_NPCS_PER_COMMAND:
+        raise DiceError(f"❌ No máximo {MAX_NPCS_PER_COMMAND} NPCs por comando.")
+    return specs
 
 # ========================================================================================
 #                            COMANDOS: AÇÃO E COMBATE
@@ -382,56 +3716,86 @@ async def initiative_roll(ctx, *, roll_input: str):
         await ctx.send(f"{user.mention} {resultado}")
         return
 
-    if channel_id not in initiative_data:
-        initiative_data[channel_id] = {}
-
-    initiative_data[channel_id][str(user.id)] = {
-        "name": user.display_name,
-        "score": total_final
-    }
-    
-    save_data(initiative_data, INITIATIVE_FILE)
+    # O modificador desempata iniciativas iguais (a expressão já está no cache do compilador).
+    modifier = compile_dice(roll_input).modifier
+    async with channel_locks.hold(channel_id):
+        get_tracker(channel_id, adding=True).add(str(user.id), user.display_name, total_final, modifier)
     
     await ctx.send(f"✅ **{user.display_name}** entrou na iniciativa com o valor **{total_final}**.\n> {resultado.replace(chr(10), chr(10)+'> ')}")
 
+@bot.command(name="init_npc")
+async def initiative_npc(ctx, *, args: str):
+    """Adiciona vários NPCs de uma vez. Ex: pd.init_npc Goblin x3 1d20+2, Orc 1d20+1"""
+    channel_id = str(ctx.channel.id)
+    try:
+        specs = parse_npc_specs(args)
+    except DiceError as error:
+        return await ctx.send(f"{ctx.author.mention} {error}")
+
+    participants = []
+    for name, quantity, expression in specs:
+        results = expression.roll(quantity)
+        for number, result in enumerate(results, start=1):
+            npc_name = f"{name} {number}" if quantity > 1 else name
+            participants.append((f"npc:{npc_name.lower()}", npc_name, result.total, expression.modifier))
+
+    # As respostas são enviadas depois de soltar o lock: um envio lento (ou segurado pelo limite
+    # do Discord) não pode travar os outros comandos de iniciativa do canal.
+    async with channel_locks.hold(channel_id):
+        tracker = get_tracker(channel_id, adding=True)
+        full = len(tracker) + len(participants) > MAX_INITIATIVE_ENTRIES
+        if not full:
+            tracker.add_many(participants)
+    if full:
+        return await ctx.send(f"❌ A lista de iniciativa comporta no máximo {MAX_INITIATIVE_ENTRIES} participantes.")
+
+    added = ", ".join(f"{name} (`{score}`)" for _, name, score, _ in participants)
+    await ctx.send(f"👹 NPCs na iniciativa: {added}")
+
 @bot.command(name="init_list")
 async def initiative_list(ctx):
     """Mostra a ordem de iniciativa para o canal atual."""
-    channel_id = str(ctx.channel.id)
+    tracker = get_tracker(str(ctx.channel.id))
 
-    if channel_id not in initiative_data or not initiative_data[channel_id]:
+    if not tracker.entries:
         await ctx.send("⚔️ A lista de iniciativa está vazia. Use `pd.init <rolagem>` para começar!")
         return
 
-    sorted_initiatives = sorted(
-        initiative_data[channel_id].values(),
-        key=lambda x: x["score"],
-        reverse=True
-    )
+    await ctx.send(embed=tracker.embed())
 
-    embed = discord.Embed(
-        title="⚔️ Ordem de Iniciativa ⚔️",
-        color=discord.Color.dark_red()
-    )
+async def _advance_turn(ctx, step):
+    channel_id = str(ctx.channel.id)
+    async with channel_locks.hold(channel_id):
+        tracker = get_tracker(channel_id)
+        if tracker.entries:
+            participant = tracker.advance(step)
+            message = f"▶️ Vez de **{participant['name']}** (`{participant['score']}`) — Rodada {tracker.round}."
+        else:
+            message = "⚔️ A lista de iniciativa está vazia. Use `pd.init <rolagem>` para começar!"
+    await ctx.send(message)
 
-    description = ""
-    for i, participant in enumerate(sorted_initiatives):
-        description += f"**{i+1}.** {participant['name']} - `{participant['score']}`\n"
+@bot.command(name="init_next")
+async def initiative_next(ctx):
+    """Passa o turno para o próximo da iniciativa."""
+    await _advance_turn(ctx, 1)
 
-    embed.description = description
-    await ctx.send(embed=embed)
+@bot.command(name="init_prev")
+async def initiative_prev(ctx):
+    """Volta o turno para o participante anterior."""
+    await _advance_turn(ctx, -1)
 
 @bot.command(name="init_clear")
 async def initiative_clear(ctx):
     """Limpa a lista de iniciativa do canal atual."""
     channel_id = str(ctx.channel.id)
-
-    if channel_id in initiative_data:
-        del initiative_data[channel_id]
-        save_data(initiative_data, INITIATIVE_FILE)
-        await ctx.send("✅ A lista de iniciativa foi limpa com sucesso!")
-    else:
-        await ctx.send("🤔 Não há nenhuma lista de iniciativa para limpar neste canal.")
+    async with channel_locks.hold(channel_id):
+        if channel_id in initiative_store:
+            get_tracker(channel_id).clear()
+            forget_tracker(channel_id)
+            message = "✅ A lista de iniciativa foi limpa com sucesso!"
+        else:
+            message = "🤔 Não há nenhuma lista de iniciativa para limpar neste canal."
+    await ctx.send(message)
 
 # ========================================================================================
 #                            COMANDOS: ROLAGEM DE DADOS
@@ -442,80 +3806,72 @@ def process_initiative_roll(roll_input: str):
     Processa uma rolagem de dados ESPECÍFICA para iniciativa.
     Retorna: status (str), mensagem (str), valor_total (int)
     """
-    pattern = r"(\d+#)?(\d*)d(\d+)([+-]\d+)?"
-    match = re.fullmatch(pattern, roll_input.replace(" ", ""))
-    if not match: return "error", "❌ Formato inválido.", None
-    
-    count_str, num_dice_str, dice_sides_str, modifier_str = match.groups()
-    count = int(count_str[:-1]) if count_str else 1
-    num_dice = int(num_dice_str) if num_dice_str else 1
-    dice_sides = int(dice_sides_str)
-    modifier = int(modifier_str) if modifier_str else 0
-    
+    try:
+        expression = compile_dice(roll_input)
+    except DiceError as error:
+        return "error", str(error), None
+
     # Validação específica para iniciativa
-    if count > 1: return "error", "❌ O comando de iniciativa só suporta uma rolagem por vez (ex: 1d20+3).", None
+    if expression.count > 1: return "error", "❌ O comando de iniciativa só suporta uma rolagem por vez (ex: 1d20+3).", None
 
-    rolls = [random.randint(1, dice_sides) for _ in range(num_dice)]
-    soma_dados = sum(rolls)
-    total_final = soma_dados + modifier
-    
-    mod_string = f"{modifier:+}" if modifier != 0 else ""
-    formula_str = f"{num_dice}d{dice_sides}{mod_string}"
-    rolls_str = " ".join(f"`{r}`" for r in rolls)
-    texto_resposta = f"**Comando:** `{formula_str}`\n🎲 **Dados:** {rolls_str} (Soma: `{soma_dados}`)\n"
-    if modifier != 0: texto_resposta += f"**⚙️ Modificador:** `{modifier:+}`\n"
-    texto_resposta += f"**📊 Total:** **{total_final}**"
-    
-    return "success", texto_resposta, total_final
+    result = expression.roll_once()
+    return "success", format_roll(expression, result), result.total
 
 def process_general_roll(roll_input: str):
     """
     Processa rolagens de dados GERAIS (pode ter múltiplas rolagens).
     Retorna: status (str), mensagem_completa (str)
     """
-    pattern = r"(\d+#)?(\d*)d(\d+)([+-]\d+)?"
-    match = re.fullmatch(pattern, roll_input.replace(" ", ""))
-    if not match: return "error", "❌ Formato inválido."
-    
-    count_str, num_dice_str, dice_sides_str, modifier_str = match.groups()
-    count = int(count_str[:-1]) if count_str else 1
-    num_dice = int(num_dice_str) if num_dice_str else 1
-    dice_sides = int(dice_sides_str)
-    modifier = int(modifier_str) if modifier_str else 0
-    
-    if count > 20 or num_dice > 100 or dice_sides > 1000: return "error", "❌ Limites excedidos (Max: 20#100d1000)."
-    
-    resultados = []
-    for _ in range(count):
-        rolls = [random.randint(1, dice_sides) for _ in range(num_dice)]
-        soma_dados = sum(rolls)
-        total_final = soma_dados + modifier
-        mod_string = f"{modifier:+}" if modifier != 0 else ""
-        formula_str = f"{num_dice}d{dice_sides}{mod_string}"
-        rolls_str = " ".join(f"`{r}`" for r in rolls)
-        texto_resposta = f"**Comando:** `{formula_str}`\n🎲 **Dados:** {rolls_str} (Soma: `{soma_dados}`)\n"
-        if modifier != 0: texto_resposta += f"**⚙️ Modificador:** `{modifier:+}`\n"
-        texto_resposta += f"**📊 Total:** **{total_final}**"
-        resultados.append(texto_resposta)
-        
-    return "success", "\n\n".join(resultados)
+    try:
+        expression = compile_dice(roll_input)
+    except DiceError as error:
+        return "error", str(error)
+    return "success", roll_expression(expression)
+
+def roll_expression(expression):
+    """Rola todas as repetições de uma expressão já compilada e monta o texto do resultado."""
+    results = expression.roll()
+    if len(results) > MAX_DETAILED_ROLLS:
+        return format_roll_table(expression, results)
+    resultados = [format_roll(expression, result) for result in results]
+    return "\n\n".join(resultados)
+
+async def run_general_roll(user_id, roll_input: str):
+    """
+    Igual a `process_general_roll`, mas as rolagens com mais de OFFLOAD_MIN_DICE dados
+    (estimados) rodam no pool de processos. As baratas continuam no event loop.
+    """
+    try:
+        expression = compile_dice(roll_input)
+    except DiceError as error:
+        return "error", str(error)
+    return await run_expression_roll(user_id, expression)
+
+async def run_expression_roll(user_id, expression):
+    """Rola uma expressão já compilada; as pesadas vão para o pool de processos, que recebe o texto."""
+    if expression.cost < OFFLOAD_MIN_DICE:
+        return "success", roll_expression(expression)
+    try:
+        return await worker_pool.run(user_id, process_general_roll, f"{expression.count}#{expression.formula}")
+    except DiceError as error:
+        return "error", str(error)
 
 # --- COMANDOS ---
 @bot.command(name="roll")
 async def public_roll(ctx, *, entrada: str):
     """Rola um ou mais dados publicamente."""
    
-    status, resultado = process_general_roll(entrada)
+    status, resultado = await run_general_roll(ctx.author.id, entrada)
     if status == "error":
-        await ctx.send(f"{ctx.author.mention} {resultado}")
+        await outbox.send(ctx.channel, f"{ctx.author.mention} {resultado}")
     else:
-        await ctx.send(f"**{ctx.author.display_name} rolou:**\n{resultado}")
+        await outbox.send(ctx.channel, f"**{ctx.author.display_name} rolou:**\n{resultado}", filename="rolagem.txt")
 
 @bot.command(name="sroll")
 async def secret_roll(ctx, *, entrada: str):
     """Faz uma rolagem 100% secreta, enviando o resultado APENAS na DM."""
     
-    status, resultado = process_general_roll(entrada) 
+    status, resultado = await run_general_roll(ctx.author.id, entrada)
     
     try:
         
@@ -523,42 +3879,368 @@ async def secret_roll(ctx, *, entrada: str):
     except (discord.Forbidden, discord.NotFound):
         pass # Ignora se o bot não tiver permissão para apagar mensagens.
         
+    # As DMs passam pela mesma fila dos canais; se a DM estiver fechada, a falha só vai para o
+    # log, o que evita expor no chat público que uma rolagem secreta falhou ao ser enviada.
     if status == "error":
-        try:
-            # Se der erro, envia o aviso de erro na DM.
-            await ctx.author.send(f"⚠️ Erro na sua rolagem secreta: {resultado}")
-        except discord.Forbidden:
-            # Se não puder enviar a DM, não faz nada para manter o sigilo.
-            pass
+        await outbox.send(ctx.author, f"⚠️ Erro na sua rolagem secreta: {resultado}")
     else:
-        try:
-            await ctx.author.send(f"**Sua rolagem secreta:**\n{resultado}")
-            
-            
-        except discord.Forbidden:
-            # Se não for possível enviar a DM com o resultado, o bot não fará nada.
-            # Isso evita expor no chat público que uma rolagem secreta falhou ao ser enviada.
-            print(f"ERRO: Não foi possível enviar DM para o usuário {ctx.author.name}.")
+        await outbox.send(ctx.author, f"**Sua rolagem secreta:**\n{resultado}", filename="rolagem_secreta.txt")
+
+@bot.command(name="roll_stats")
+async def roll_stats(ctx, *, entrada: str):
+    """Calcula as chances exatas de uma rolagem. Ex: pd.roll_stats 3d6+2 >= 15"""
+    expression_text, target = split_stats_target(entrada)
+    try:
+        expression = compile_dice(expression_text)
+        # Expressões pesadas são calculadas no pool de processos, sem travar os outros comandos.
+        outcomes, keep_work = _check_stats_cost(expression)
+        if outcomes >= STATS_OFFLOAD_OUTCOMES or keep_work >= STATS_OFFLOAD_KEEP_WORK:
+            stats = await worker_pool.run(ctx.author.id, dice_statistics, expression.formula)
+        else:
+            stats = dice_statistics(expression.formula)
+    except DiceError as error:
+        return await ctx.send(f"{ctx.author.mention} {error}")
+
+    embed = discord.Embed(title=f"📈 Estatísticas de `{expression.formula}`", color=discord.Color.teal())
+    embed.add_field(name="Média", value=f"`{stats.mean:.2f}`")
+    embed.add_field(name="Desvio padrão", value=f"`{stats.std_dev:.2f}`")
+    embed.add_field(name="Mín / Máx", value=f"`{stats.minimum}` / `{stats.maximum}`")
+    embed.add_field(
+        name="Percentis",
+        value=" ".join(f"p{p}: `{value}`" for p, value in stats.percentiles.items()),
+        inline=False
+    )
+    if target is not None:
+        embed.add_field(name=f"🎯 Chance de tirar {target} ou mais", value=f"**{chance_at_least(stats, target):.2%}**", inline=False)
+    if expression.count > 1:
+        embed.set_footer(text="Estatísticas de uma única rolagem (o N# foi ignorado).")
+    await ctx.send(embed=embed)
         
+def render_macros_embed(member, profile):
+    macros = profile.macros or {}
+    embed = discord.Embed(title=f"🧙 Macros de {member.display_name}", color=discord.Color.blue())
+    if not macros:
+        embed.description = "Nenhuma macro definida. Use `pd.macro set <nome> <rolagem>`."
+    else:
+        embed.description = "\n".join(f"**{name}:** `{expression}`" for name, expression in sorted(macros.items()))
+    return embed
+
+@bot.command(name="macro")
+async def macro_command(ctx, action: str = None, name: str = None, *, expression: str = None):
+    """Gerencia suas macros de rolagem. Ex: pd.macro set ataque 1d20+for+2, pd.macro remove ataque"""
+    user_id = ctx.author.id
+    if action is None:
+        embed = profile_embed(ctx.author, "macros", render_macros_embed)
+        if embed is None:
+            return await ctx.send("⚠️ Você não está registrado. Use `pd.register` primeiro.")
+        return await ctx.send(embed=embed)
+
+    action = action.lower()
+    if action == "set" and name and expression:
+        return await ctx.send(await edit_profiles((user_id,), _set_macro, user_id, name.lower(), expression))
+    if action in ("remove", "remover") and name:
+        return await ctx.send(await edit_profiles((user_id,), _set_macro, user_id, name.lower(), None))
+    await ctx.send("❌ Use `pd.macro`, `pd.macro set <nome> <rolagem>` ou `pd.macro remove <nome>`.")
+
+def _set_macro(batch, user_id, macro_name, expression):
+    profile = batch.profile(user_id)
+    macros = profile.macros or {}
+    if expression is None:
+        if macro_name not in macros:
+            raise BatchError(f"🤔 Você não tem a macro `{macro_name}`.")
+        batch.set_macro(user_id, macro_name, None)
+        return f"🗑️ Macro `{macro_name}` removida."
+
+    if not _MACRO_NAME_RE.fullmatch(macro_name):
+        raise BatchError("❌ Nome de macro inválido. Use até 32 letras, números ou `_` (ex: `ataque`).")
+    if macro_name not in macros and len(macros) >= MAX_MACROS:
+        raise BatchError(f"❌ Você já tem {MAX_MACROS} macros. Remova uma com `pd.macro remove <nome>`.")
+    expression = expression.replace(" ", "").lower()
+    if len(expression) > MAX_MACRO_LENGTH:
+        raise BatchError(f"❌ A macro pode ter no máximo {MAX_MACRO_LENGTH} caracteres.")
+    try:
+        template = parse_macro(expression)
+    except DiceError as error:
+        raise BatchError(str(error)) from None
+
+    batch.set_macro(user_id, macro_name, expression)
+    reply = f"✅ Macro `{macro_name}` salva: `{expression}`. Role com `pd.m {macro_name}`."
+    missing = [attr_name for attr_name, _ in template.refs if attr_name not in profile.attributes]
+    if missing:
+        reply += f"\n⚠️ Ainda não estão na sua ficha: {', '.join(f'`{attr_name.upper()}`' for attr_name in missing)}."
+    return reply
+
+@bot.command(name="m")
+async def macro_roll(ctx, name: str):
+    """Rola uma das suas macros. Ex: pd.m ataque"""
+    try:
+        expression = macro_cache.get(ctx.author.id, name.lower())
+    except DiceError as error:
+        return await outbox.send(ctx.channel, f"{ctx.author.mention} {error}")
+    if expression is None:
+        return await outbox.send(ctx.channel, f"🤔 Você não tem a macro `{name}`. Veja as suas com `pd.macro`.")
+
+    status, resultado = await run_expression_roll(ctx.author.id, expression)
+    if status == "error":
+        await outbox.send(ctx.channel, f"{ctx.author.mention} {resultado}")
+    else:
+        await outbox.send(ctx.channel, f"**{ctx.author.display_name} rolou `{name.lower()}`:**\n{resultado}", filename="rolagem.txt")
+
+# ========================================================================================
+#                             COMANDOS: MONITORAMENTO
+# ========================================================================================
+
+def cache_stats():
+    """Acertos e falhas de cada cache do bot: {nome: (acertos, falhas)}."""
+    caches = {
+        "embeds": (embed_cache.hits, embed_cache.misses),
+        "macros": (macro_cache.hits, macro_cache.misses),
+        "dados": _compile_dice.cache_info()[:2],
+        "estatisticas": dice_statistics.cache_info()[:2],
+    }
+    if isinstance(user_store, ShardedUserStore):
+        caches["perfis"] = (user_store.hits, user_store.misses)
+    return caches
+
+def lock_stats():
+    return [user_locks.snapshot(), channel_locks.snapshot()]
+
+def _format_seconds(bound):
+    return "> 10 s" if bound == math.inf else f"≤ {bound * 1000:g} ms"
+
+@bot.command(name="stats")
+@commands.is_owner()
+async def stats_command(ctx):
+    """Mostra as métricas internas do bot (só para o dono)."""
+    embed = discord.Embed(title="📊 Métricas do pd.BOT", color=discord.Color.dark_grey())
+
+    busiest = sorted(metrics.commands.items(), key=lambda item: item[1].count, reverse=True)[:8]
+    lines = [
+        f"`{name}`: {histogram.count}x, p50 {_format_seconds(histogram.quantile(0.5))}, "
+        f"p99 {_format_seconds(histogram.quantile(0.99))}, erros {metrics.errors[name]}"
+        for name, histogram in busiest
+    ]
+    total = sum(histogram.count for histogram in metrics.commands.values())
+    lines.append(f"Total: **{total}** comandos, **{sum(metrics.errors.values())}** erros, "
+                 f"**{metrics.counters['slow_commands']}** lentos")
+    embed.add_field(name="⏱️ Comandos", value="\n".join(lines), inline=False)
+
+    counters = metrics.counters
+    embed.add_field(
+        name="💾 Persistência",
+        value=f"save_data: {counters['save_data_calls']}x, {counters['save_data_bytes'] / 2**20:.1f} MB em {counters['save_data_seconds']:.2f} s\n"
+              f"Diário: {counters['journal_bytes'] / 2**20:.1f} MB\n"
+              f"load_data: {counters['load_data_calls']}x em {counters['load_data_seconds']:.2f} s",
+        inline=False
+    )
+    embed.add_field(
+        name="🗃️ Caches",
+        value="\n".join(f"{name}: {hits / (hits + misses):.0%} de acertos ({hits + misses} consultas)" if hits + misses else f"{name}: sem consultas"
+                        for name, (hits, misses) in cache_stats().items()),
+        inline=False
+    )
+    embed.add_field(
+        name="🔁 Event loop",
+        value=f"Atraso p50 {_format_seconds(metrics.loop_lag.quantile(0.5))}, p99 {_format_seconds(metrics.loop_lag.quantile(0.99))}, "
+              f"máx {metrics.loop_lag_max * 1000:.0f} ms",
+        inline=False
+    )
+    embed.add_field(
+        name="🔒 Locks",
+        value="\n".join(f"{lock['name']}: {lock['contended']}/{lock['acquisitions']} esperaram, média {lock['avg_wait_ms']:.1f} ms, máx {lock['max_wait_ms']:.1f} ms"
+                        for lock in lock_stats()),
+        inline=False
+    )
+    embed.add_field(
+        name="📤 Envio",
+        value=f"{outbox.sent} enviadas, {outbox.coalesced} agrupadas, {outbox.attachments} anexos, {outbox.failed} falhas",
+        inline=False
+    )
+    embed.add_field(
+        name="⚔️ Iniciativa",
+        value=f"{len(initiative_activity)} canais acompanhados, {counters['initiative_expired']} listas expiradas, "
+              f"{counters['initiative_evicted']} removidas pelo limite",
+        inline=False
+    )
+    embed.add_field(
+        name="🧮 Rolagens pesadas",
+        value=f"{worker_pool.offloaded} fora do loop ({worker_pool.size or 'sem'} processos"
+              f"{', pool quebrado: usando threads' if worker_pool.broken else ''}), "
+              f"{worker_pool.timeouts} estouraram o tempo, {worker_pool.rejected} recusadas pelo limite por usuário",
+        inline=False
+    )
+    uptime = int(time.time() - metrics.started)
+    embed.set_footer(text=f"Online há {uptime // 3600}h{uptime % 3600 // 60:02d}m")
+    await ctx.send(embed=embed)
+
+def render_prometheus():
+    """Métricas no formato de texto do Prometheus."""
+    lines = [
+        "# HELP pdbot_command_duration_seconds Latência dos comandos.",
+        "# TYPE pdbot_command_duration_seconds histogram",
+    ]
+    for name, histogram in sorted(metrics.commands.items()):
+        for bound, seen in histogram.cumulative():
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            lines.append(f'pdbot_command_duration_seconds_bucket{{command="{name}",le="{le}"}} {seen}')
+        lines.append(f'pdbot_command_duration_seconds_sum{{command="{name}"}} {histogram.sum}')
+        lines.append(f'pdbot_command_duration_seconds_count{{command="{name}"}} {histogram.count}')
+    lines.append("# TYPE pdbot_command_errors_total counter")
+    lines.extend(f'pdbot_command_errors_total{{command="{name}"}} {count}' for name, count in sorted(metrics.errors.items()))
+    for name, value in sorted(metrics.counters.items()):
+        lines.append(f"# TYPE pdbot_{name}_total counter")
+        lines.append(f"pdbot_{name}_total {value}")
+    caches = cache_stats()
+    for index, kind in enumerate(("hits", "misses")):
+        lines.append(f"# TYPE pdbot_cache_{kind}_total counter")
+        lines.extend(f'pdbot_cache_{kind}_total{{cache="{name}"}} {counts[index]}' for name, counts in caches.items())
+    lines.append("# TYPE pdbot_event_loop_lag_seconds histogram")
+    for bound, seen in metrics.loop_lag.cumulative():
+        le = "+Inf" if bound == math.inf else f"{bound:g}"
+        lines.append(f'pdbot_event_loop_lag_seconds_bucket{{le="{le}"}} {seen}')
+    lines.append(f"pdbot_event_loop_lag_seconds_sum {metrics.loop_lag.sum}")
+    lines.append(f"pdbot_event_loop_lag_seconds_count {metrics.loop_lag.count}")
+    for metric, key in (("acquisitions", "acquisitions"), ("contended", "contended")):
+        lines.append(f"# TYPE pdbot_lock_{metric}_total counter")
+        lines.extend(f'pdbot_lock_{metric}_total{{lock="{lock["name"]}"}} {lock[key]}' for lock in lock_stats())
+    lines.append("# TYPE pdbot_lock_wait_seconds_total counter")
+    lines.extend(f'pdbot_lock_wait_seconds_total{{lock="{locks.name}"}} {locks.total_wait}' for locks in (user_locks, channel_locks))
+    lines.append("# TYPE pdbot_outbox_messages_total counter")
+    for result in ("sent", "coalesced", "attachments", "failed"):
+        lines.append(f'pdbot_outbox_messages_total{{result="{result}"}} {getattr(outbox, result)}')
+    lines.append("# TYPE pdbot_initiative_channels gauge")
+    lines.append(f"pdbot_initiative_channels {len(initiative_activity)}")
+    lines.append("# TYPE pdbot_offloaded_tasks_total counter")
+    for result in ("offloaded", "timeouts", "rejected"):
+        lines.append(f'pdbot_offloaded_tasks_total{{result="{result}"}} {getattr(worker_pool, result)}')
+    return "\n".join(lines) + "\n"
+
+async def _serve_metrics(reader, writer):
+    """Responde um GET /metrics com o texto do Prometheus; qualquer outro caminho recebe 404."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass  # ignora os cabeçalhos
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_prometheus().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"use /metrics\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host, port):
+    """Sobe o endpoint HTTP de métricas. Por padrão só escuta em 127.0.0.1."""
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    print(f"📈 Métricas disponíveis em http://{host}:{port}/metrics")
+    return server
+
 # ========================================================================================
 #                                EXECUÇÃO DO BOT
 # ========================================================================================
 
-def run_bot():
+def build_indexes():
+    """
+    Monta o índice de inventário e o ranking de moedas. A primeira montagem lê todos os perfis (no
+    backend "sharded", todos os arquivos do disco); feita antes de o bot conectar, ela não trava o
+    event loop no primeiro pd.gear_find ou pd.rank.
+    """
+    start = time.perf_counter()
+    inventory_index.rebuild()
+    money_ranking.rebuild()
+    print(f"📚 Índice de inventário e ranking montados em {time.perf_counter() - start:.2f}s.")
+
+def run_bot(shard_count=None, shard_ids=None):
     # Carrega o token de um arquivo de configuração externo
-    if not os.path.exists("config.json"):
-        print("ERRO: Arquivo 'config.json' não encontrado! Crie o arquivo com seu token.")
+    if not os.path.exists(CONFIG_FILE):
+        print(f"ERRO: Arquivo '{CONFIG_FILE}' não encontrado! Crie o arquivo com seu token.")
         return
         
-    with open("config.json") as f:
-        config = json.load(f)
-        token = config.get("token")
+    token = config.get("token")
 
     if not token:
         print("ERRO: Token não encontrado dentro de 'config.json'!")
         return
 
+    if shard_count is not None:
+        bot.shard_count, bot.shard_ids = shard_count, shard_ids
+    worker_pool.start(int(config.get("worker_processes", WORKER_PROCESSES)))
+    # Depois do fork do pool: os processos de rolagem não precisam de uma cópia dos índices.
+    build_indexes()
     bot.run(token)
 
+def shard_ranges(shard_count, processes):
+    """Divide os shards `0..shard_count-1` em `processes` faixas contíguas de tamanhos parecidos."""
+    processes = max(1, min(processes, shard_count))
+    return [list(range(index * shard_count // processes, (index + 1) * shard_count // processes))
+            for index in range(processes)]
+
+def launch_shard_processes(shard_count, processes):
+    """
+    Roda o bot em vários processos, cada um com uma faixa de shards.
+
+    O Discord entrega os eventos de um servidor sempre ao mesmo shard, então o estado de
+    iniciativa (por canal) nunca é dividido entre processos. Os perfis, por outro lado, são
+    alterados por qualquer um deles, e por isso só o backend SQLite é aceito: cada comando lê
+    e grava o perfil dentro de uma transação `BEGIN IMMEDIATE` (ver `edit_profile`).
+    """
+    if config.get("storage", "json") != "sqlite":
+        print('ERRO: para rodar em vários processos use "storage": "sqlite" no config.json '
+              '(rode `python pdbot.py migrate --to sqlite` antes).')
+        return
+    children = []
+    for shard_ids in shard_ranges(shard_count, processes):
+        print(f"Iniciando processo com os shards {shard_ids[0]}-{shard_ids[-1]} de {shard_count}...")
+        children.append(subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "run",
+            "--shards", str(shard_count), "--shard-ids", ",".join(map(str, shard_ids)),
+        ]))
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        # O Ctrl+C também chega aos filhos (mesmo grupo de processos); aqui só esperamos que fechem.
+        for child in children:
+            try:
+                child.wait(timeout=SHARD_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                child.kill()
+
 if __name__ == "__main__":
-    run_bot()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="pd.BOT - bot de RPG para o Discord.")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "migrate", "convert"],
+                        help="run: inicia o bot (padrão) | migrate: copia os arquivos JSON para outro backend | "
+                             "convert: regrava database.json e initiative.json em JSON ou no snapshot binário")
+    parser.add_argument("--to", help="destino do migrate (sqlite, sharded; padrão: sqlite) ou do convert (binary, json)")
+    parser.add_argument("--shards", type=int,
+                        help="número total de shards (padrão: o que o Discord recomendar)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="processos entre os quais os shards são divididos (exige o backend sqlite)")
+    parser.add_argument("--shard-ids", help=argparse.SUPPRESS)  # usado pelo lançador: "0,1,2"
+    args = parser.parse_args()
+    if args.processes > 1 and not args.shards:
+        parser.error("--processes exige --shards")
+    if args.command == "migrate":
+        if args.to not in (None, "sqlite", "sharded"):
+            parser.error("migrate --to aceita sqlite ou sharded")
+        migrate_json(args.to or "sqlite")
+    elif args.command == "convert":
+        if args.to not in ("binary", "json"):
+            parser.error("convert exige --to binary ou --to json")
+        for file_path in (USER_DATA_FILE, INITIATIVE_FILE):
+            if os.path.exists(file_path):
+                before, after = convert_data(file_path, binary=args.to == "binary")
+                print(f"✅ {file_path}: {before / 1024:,.0f} KB -> {after / 1024:,.0f} KB ({args.to}).")
+    elif args.shard_ids:
+        run_bot(args.shards, [int(shard_id) for shard_id in args.shard_ids.split(",")])
+    elif args.shards and args.processes > 1:
+        launch_shard_processes(args.shards, args.processes)
+    else:
+        run_bot(args.shards)
\ No newline at end of file
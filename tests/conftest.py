@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def pdbot(tmp_path_factory):
+    """
+    O módulo do bot, importado num diretório vazio para não abrir os dados reais. Os stores usam
+    caminhos relativos, então os testes rodam todos dentro desse diretório.
+    """
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("pdbot"))
+    try:
+        import pdbot
+        yield pdbot
+    finally:
+        os.chdir(previous)
@@ -0,0 +1,25 @@
+import pytest
+
+@pytest.mark.parametrize("formula", ["100d10kh44", "40d20kh20", "40d20kh20+39d20kh20+38d20kh19"])
+def test_slow_keep_stats_leave_the_event_loop(pdbot, formula):
+    outcomes, keep_work = pdbot._check_stats_cost(pdbot.compile_dice(formula))
+    assert outcomes < pdbot.STATS_OFFLOAD_OUTCOMES
+    assert keep_work >= pdbot.STATS_OFFLOAD_KEEP_WORK
+
+def test_cheap_keep_stats_stay_on_the_event_loop(pdbot):
+    outcomes, keep_work = pdbot._check_stats_cost(pdbot.compile_dice("4d6kh3+2"))
+    assert outcomes < pdbot.STATS_OFFLOAD_OUTCOMES
+    assert keep_work < pdbot.STATS_OFFLOAD_KEEP_WORK
+
+def test_exploding_totals_are_python_ints(pdbot):
+    # Os totais vão para o diário JSON e para o SQLite, que não aceitam np.int64.
+    expression = pdbot.compile_dice("4#3d2!+1")
+    for _ in range(200):
+        for result in expression.roll():
+            assert type(result.total) is int
+
+def test_dropping_every_die_totals_zero(pdbot):
+    expression = pdbot.compile_dice("4#4d6dl4")
+    for _ in range(200):
+        assert all(result.total == 0 for result in expression.roll())
+    assert pdbot.dice_statistics("4d6dl4").maximum == 0
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+@pytest.fixture
+def split_shards(pdbot, monkeypatch):
+    """Este processo atende o shard 0 de 2; o store é compartilhado com o outro processo."""
+    monkeypatch.setattr(pdbot.bot, "shard_ids", [0])
+    monkeypatch.setattr(pdbot.bot, "shard_count", 2)
+    monkeypatch.setattr(pdbot, "initiative_activity", pdbot.InitiativeActivity())
+    monkeypatch.setattr(pdbot, "initiative_trackers", {})
+    monkeypatch.setitem(pdbot.config, "max_initiative_channels", 1)
+    return pdbot
+
+def test_split_shards_never_evict_other_process_channels(split_shards):
+    pdbot = split_shards
+    foreign = 9001
+    pdbot.initiative_store.set_entry(foreign, "npc:1", {"name": "Goblin", "score": 12, "modifier": 0, "seq": 0})
+    pdbot.initiative_store.touch(foreign, 1)  # parado há muito tempo
+    try:
+        assert len(pdbot.initiative_activity) == 0
+        assert pdbot.initiative_activity.idle(0) == []
+
+        pdbot.get_tracker(100, adding=True).add("npc:1", "Orc", 10)
+        pdbot.get_tracker(101, adding=True).add("npc:1", "Orc", 10)
+        assert 100 not in pdbot.initiative_trackers
+        assert foreign in pdbot.initiative_store
+    finally:
+        for channel_id in (foreign, 100, 101):
+            pdbot.initiative_store.clear(channel_id)
+
+class BlockedChannel:
+    """Canal cujo primeiro envio fica parado, como um envio segurado pelo limite do Discord."""
+
+    def __init__(self, id):
+        self.id = id
+        self.sent = []
+        self.release = None
+
+    async def send(self, content=None, **kwargs):
+        if self.release is None:
+            self.release = asyncio.Event()
+            await self.release.wait()
+        self.sent.append(content)
+
+class FakeCtx:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send(self, content=None, **kwargs):
+        await self.channel.send(content, **kwargs)
+
+def test_slow_send_does_not_hold_the_channel_lock(pdbot):
+    channel = BlockedChannel(4242)
+
+    async def scenario():
+        # A lista vazia responde sem alterar nada; o segundo comando não pode esperar o envio do primeiro.
+        first = asyncio.ensure_future(pdbot._advance_turn(FakeCtx(channel), 1))
+        await asyncio.sleep(0)
+        tracker = pdbot.get_tracker(str(channel.id), adding=True)
+        tracker.add_many([("npc:a", "A", 15, 0), ("npc:b", "B", 10, 0)])
+        await asyncio.wait_for(pdbot._advance_turn(FakeCtx(channel), 1), timeout=1)
+        channel.release.set()
+        await first
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        pdbot.initiative_store.clear(str(channel.id))
+        pdbot.forget_tracker(str(channel.id))
+    assert len(channel.sent) == 2
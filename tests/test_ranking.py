@@ -0,0 +1,22 @@
+import random
+
+def test_sorted_keys_fallback_matches_a_sorted_list(pdbot, monkeypatch):
+    monkeypatch.setattr(pdbot, "RANKING_BLOCK_SIZE", 8)
+    rng = random.Random(1)
+    expected = [(-rng.randrange(100), user_id) for user_id in range(200)]
+    keys = pdbot._SortedKeys(expected)
+    expected.sort()
+    for user_id in range(200, 1200):
+        if expected and rng.random() < 0.4:
+            key = expected.pop(rng.randrange(len(expected)))
+            keys.remove(key)
+        else:
+            key = (-rng.randrange(100), user_id)
+            expected.insert(pdbot.bisect.bisect_left(expected, key), key)
+            keys.add(key)
+        probe = (-rng.randrange(100), rng.randrange(1200))
+        assert keys.bisect_left(probe) == pdbot.bisect.bisect_left(expected, probe)
+        start = rng.randrange(len(expected) + 5)
+        assert keys[start:start + 10] == expected[start:start + 10]
+        assert len(keys) == len(expected)
+    assert keys[:] == expected
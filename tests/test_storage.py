@@ -0,0 +1,70 @@
+import json
+
+def write_journal(path, *operations):
+    with open(path, "w", encoding="utf-8") as f:
+        for operation in operations:
+            f.write(json.dumps(operation) + "\n")
+
+def test_journal_replay_skips_ops_for_deleted_user(pdbot, tmp_path):
+    # O snapshot já reflete o `delete` do usuário 1, mas o diário ainda traz as alterações
+    # que vieram antes dele.
+    db = tmp_path / "database.json"
+    pdbot.save_data({"2": pdbot.Profile().to_json()}, str(db))
+    write_journal(tmp_path / "database.journal",
+                  ["update", 1, {"money": 5}],
+                  ["item", 1, "Flecha", 3],
+                  ["attribute", 1, "for", 2],
+                  ["macro", 1, "ataque", "1d20+@for"],
+                  ["batch", [["update", 1, {"money": 6}], ["delete", 1]]],
+                  ["update", 2, {"money": 7}])
+    store = pdbot.JsonUserStore(str(db))
+    assert 1 not in store
+    assert store.get(2).money == 7
+
+def test_crash_between_snapshot_and_journal_truncate(pdbot, tmp_path):
+    db = str(tmp_path / "database.json")
+    store = pdbot.JsonUserStore(db)
+    store.create(1, pdbot.Profile())
+    store.update(1, money=5)
+    store.set_item(1, "Flecha", 3)
+    store.delete(1)
+    store.create(2, pdbot.Profile(money=9))
+    # A queda acontece depois de o snapshot ser gravado e antes de o diário ser zerado.
+    pdbot.save_data(store._snapshot(), db)
+
+    reopened = pdbot.JsonUserStore(db)
+    assert 1 not in reopened
+    assert reopened.get(2).money == 9
+
+def test_sharded_store_keeps_profile_count_in_memory(pdbot, tmp_path, monkeypatch):
+    store = pdbot.ShardedUserStore(str(tmp_path / "profiles"))
+    for user_id in range(5):
+        store.create(user_id, pdbot.Profile())
+    assert sum(1 for _ in store.items()) == 5
+
+    # Depois da varredura, len() não percorre mais as pastas do disco.
+    monkeypatch.setattr(pdbot.os, "scandir", None)
+    store.create(2, pdbot.Profile(money=3))  # recadastro: não muda a contagem
+    store.create(7, pdbot.Profile())
+    store.delete(0)
+    store.delete(99)
+    assert len(store) == 5
+
+def test_convert_data_round_trip(pdbot, tmp_path):
+    path = str(tmp_path / "database.json")
+    data = {"1": {"name": "Ana", "inventario": {"Poção, grande": 2}, "atributos": {}}, "2": {"money": 3}}
+    pdbot.save_data(data, path)
+    with open(path, encoding="utf-8") as f:
+        original = f.read()
+
+    pdbot.convert_data(path, binary=True)
+    assert pdbot.load_data(path) == data
+    pdbot.convert_data(path, binary=False)
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == original
+
+def test_save_data_pairs_match_dict_output(pdbot, tmp_path):
+    for data in ({}, {"1": {}}, {"1": [1, {"a": "x\\ny"}], "é": None}):
+        pdbot.save_data(data, str(tmp_path / "dict.json"))
+        pdbot.save_data(iter(data.items()), str(tmp_path / "pairs.json"))
+        assert (tmp_path / "dict.json").read_text("utf-8") == (tmp_path / "pairs.json").read_text("utf-8")